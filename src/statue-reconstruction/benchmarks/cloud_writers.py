@@ -0,0 +1,106 @@
+"""
+Point Cloud Writer Benchmark
+Compares the per-point XYZ loop export_to_formats used with the vectorized and binary writers
+"""
+
+import argparse
+import numpy as np
+from pathlib import Path
+import json
+import logging
+import time
+from src.pointcloud_io import write_cloud
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def legacy_xyz(path, points, colors):
+    """The XYZ export as export_to_formats wrote it, one f-string per point (colours 0-1)"""
+    with open(path, 'w') as f:
+        for i in range(len(points)):
+            f.write(f"{points[i, 0]} {points[i, 1]} {points[i, 2]} "
+                    f"{int(colors[i, 0]*255)} {int(colors[i, 1]*255)} {int(colors[i, 2]*255)}\n")
+
+
+def random_cloud(num_points, seed=0):
+    """Points on a unit sphere with normals and 0-255 colours"""
+    rng = np.random.default_rng(seed)
+    normals = rng.normal(size=(num_points, 3))
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    colors = rng.integers(0, 256, size=(num_points, 3)).astype(np.float32)
+    return normals.copy(), normals.astype(np.float32), colors
+
+
+def time_writer(name, write, path, num_points):
+    start_time = time.time()
+    write(path)
+    elapsed = time.time() - start_time
+    size = path.stat().st_size
+    result = {
+        "writer": name,
+        "elapsed_s": elapsed,
+        "points_per_s": num_points / elapsed,
+        "mb_per_s": size / 1024**2 / elapsed,
+        "file_mb": size / 1024**2,
+    }
+    logger.info(f"{name:>12}: {elapsed:7.2f}s  {result['points_per_s']:12,.0f} points/s  "
+                f"{result['mb_per_s']:8.1f} MB/s  {result['file_mb']:8.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the point cloud writers")
+    parser.add_argument(
+        "--points",
+        type=int,
+        default=2_000_000,
+        help="Points in the synthetic cloud (default: 2000000)"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        default="output/benchmarks/cloud_writers",
+        help="Output directory (default: output/benchmarks/cloud_writers)"
+    )
+    args = parser.parse_args()
+
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    points, normals, colors = random_cloud(args.points)
+    logger.info(f"Writing {args.points} points...")
+
+    writers = [
+        ("legacy_xyz", lambda path: legacy_xyz(path, points, colors / 255), "legacy.xyz"),
+        ("xyz", lambda path: write_cloud(path, points, colors=colors), "cloud.xyz"),
+        ("xyzrgb_bin", lambda path: write_cloud(path, points, colors=colors), "cloud_xyzrgb.bin"),
+        ("pcd", lambda path: write_cloud(path, points, normals, colors), "cloud.pcd"),
+        ("ply", lambda path: write_cloud(path, points, normals, colors), "cloud.ply"),
+    ]
+    results = [time_writer(name, write, output / filename, args.points)
+               for name, write, filename in writers]
+    legacy = results[0]["elapsed_s"]
+    for result in results:
+        result["speedup"] = legacy / result["elapsed_s"]
+
+    # The vectorized XYZ must hold the same points and colours as the loop
+    reference = np.loadtxt(output / "legacy.xyz", max_rows=10000)
+    written = np.loadtxt(output / "cloud.xyz", max_rows=10000)
+    max_error = float(np.abs(reference - written).max())
+
+    report = {"points": args.points, "xyz_max_difference": max_error, "results": results}
+
+    logger.info("\n" + "="*60)
+    logger.info("POINT CLOUD WRITER BENCHMARK")
+    logger.info("="*60)
+    for result in results:
+        logger.info(f"{result['writer']:>12}: {result['speedup']:6.1f}x the legacy XYZ loop")
+    logger.info(f"XYZ max difference from the legacy loop: {max_error:.2e}")
+
+    report_path = output / "report.json"
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
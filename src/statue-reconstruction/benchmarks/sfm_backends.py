@@ -0,0 +1,115 @@
+"""
+SfM Backend Benchmark
+Runs the COLMAP and native SfM backends on the same images and compares them
+"""
+
+import argparse
+import numpy as np
+from pathlib import Path
+import json
+import logging
+import shutil
+import time
+from src.colmap_io import ColmapModel
+from src.sfm import SfMPipeline
+from src.synthetic import align_centers
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def compare_models(model_a, model_b):
+    """Camera centre agreement of two models after similarity alignment"""
+    index_b = {name: i for i, name in enumerate(model_b.names)}
+    common = [(i, index_b[name]) for i, name in enumerate(model_a.names) if name in index_b]
+    if len(common) < 3:
+        return {"common_images": len(common)}
+
+    rows_a, rows_b = map(list, zip(*common))
+    centers_a = model_a.camera_centers()[rows_a]
+    centers_b = model_b.camera_centers()[rows_b]
+    _, _, _, aligned = align_centers(centers_a, centers_b)
+
+    # Errors relative to the scene extent so both scales compare
+    extent = np.linalg.norm(centers_b - centers_b.mean(axis=0), axis=1).mean()
+    errors = np.linalg.norm(aligned - centers_b, axis=1) / extent
+    return {
+        "common_images": len(common),
+        "median_center_error": float(np.median(errors)),
+        "max_center_error": float(errors.max()),
+    }
+
+
+def run_backend(backend, image_dir, output_dir, matching):
+    sfm = SfMPipeline(image_dir=image_dir, output_dir=output_dir, backend=backend)
+    start_time = time.time()
+    stats = sfm.run_full_pipeline(matching=matching) or {}
+    result = {
+        "backend": backend,
+        "elapsed_s": time.time() - start_time,
+        "stats": stats,
+    }
+    if backend == "native":
+        result["stage_timings"] = sfm.native_timings
+    return result, sfm.sparse_dir / "0"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SfM backends")
+    parser.add_argument(
+        "image_dir",
+        nargs="?",
+        default="data/input_images/yogesh_bust",
+        help="Input images (default: data/input_images/yogesh_bust)"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        default="output/benchmarks/sfm_backends",
+        help="Output directory (default: output/benchmarks/sfm_backends)"
+    )
+    parser.add_argument(
+        "--matching",
+        default="retrieval,turntable",
+        help="Matching mode for both backends (default: retrieval,turntable)"
+    )
+    args = parser.parse_args()
+
+    output = Path(args.output)
+    backends = ["native"]
+    if shutil.which("colmap"):
+        backends.insert(0, "colmap")
+    else:
+        logger.warning("colmap not found on PATH, benchmarking the native backend only")
+
+    results, models = [], {}
+    for backend in backends:
+        logger.info(f"Running {backend} backend...")
+        result, model_dir = run_backend(backend, args.image_dir, output / backend, args.matching)
+        results.append(result)
+        if (model_dir / "images.bin").exists():
+            models[backend] = ColmapModel.read(model_dir)
+
+    report = {"image_dir": args.image_dir, "matching": args.matching, "results": results}
+    if len(models) == 2:
+        report["pose_agreement"] = compare_models(models["native"], models["colmap"])
+
+    logger.info("\n" + "="*60)
+    logger.info("SFM BACKEND BENCHMARK")
+    logger.info("="*60)
+    for result in results:
+        stats = result["stats"]
+        logger.info(f"{result['backend']:>7}: {result['elapsed_s']:8.1f}s  "
+                    f"{stats.get('num_images', 0):4} images  "
+                    f"{stats.get('num_points', 0):7} points  "
+                    f"{stats.get('mean_reprojection_error', 0):.3f}px")
+    if "pose_agreement" in report:
+        logger.info(f"Pose agreement: {report['pose_agreement']}")
+
+    output.mkdir(parents=True, exist_ok=True)
+    with open(output / "report.json", 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report: {output / 'report.json'}")
+
+
+if __name__ == "__main__":
+    main()
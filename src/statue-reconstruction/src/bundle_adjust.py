@@ -0,0 +1,454 @@
+"""
+Sparse Bundle Adjustment
+Refines poses, intrinsics and points with scipy least_squares and a block-sparse Jacobian
+"""
+
+import argparse
+import cv2
+import inspect
+import numpy as np
+from scipy import sparse
+from scipy.optimize import least_squares
+from pathlib import Path
+import json
+import logging
+import time
+from src.colmap_io import ColmapModel, id_rows, rotation_to_quaternion
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# COLMAP model id -> indices of the focal and distortion parameters that
+# bundle adjustment refines (the principal point stays fixed, as in COLMAP)
+REFINABLE_PARAMS = {
+    0: [0],                   # SIMPLE_PINHOLE: f, cx, cy
+    1: [0, 1],                # PINHOLE: fx, fy, cx, cy
+    2: [0, 3],                # SIMPLE_RADIAL: f, cx, cy, k
+    3: [0, 3, 4],             # RADIAL: f, cx, cy, k1, k2
+    4: [0, 1, 4, 5, 6, 7],    # OPENCV: fx, fy, cx, cy, k1, k2, p1, p2
+}
+
+
+MODES = ("full", "fixed_intrinsics", "points_only")
+
+# least_squares robust losses rho(z) of the squared, scaled residual z
+ROBUST_LOSSES = {
+    "linear": lambda z: z,
+    "huber": lambda z: np.where(z <= 1, z, 2 * np.sqrt(z) - 1),
+    "soft_l1": lambda z: 2 * (np.sqrt(1 + z) - 1),
+    "cauchy": np.log1p,
+    "arctan": np.arctan,
+}
+
+# least_squares reports each iteration to a callback from scipy 1.16 on
+SUPPORTS_CALLBACK = "callback" in inspect.signature(least_squares).parameters
+
+
+class BundleAdjuster:
+    def __init__(self, loss="linear", f_scale=1.0, max_nfev=50, ftol=1e-4,
+                 mode="full", min_improvement=0.0, time_budget=None, verbose=False):
+        """
+        Initialize bundle adjuster
+
+        Each observation contributes two residuals that depend on one pose
+        (6 parameters), one camera's refinable intrinsics and one point (3
+        parameters); least_squares gets that block pattern as jac_sparsity,
+        so finite differences need only a few hundred residual evaluations
+        however large the problem is.
+
+        Args:
+            loss: least_squares robust loss ('linear', 'huber', 'soft_l1',
+                'cauchy', 'arctan')
+            f_scale: Inlier scale of the robust loss in pixels
+            max_nfev: Maximum residual evaluations (iterations)
+            ftol: Relative cost change at which to stop
+            mode: 'full' (poses, focal/distortion and points),
+                'fixed_intrinsics' (poses and points) or 'points_only'
+            min_improvement: Stop early once an iteration lowers the cost by
+                less than this fraction (turntable captures usually settle
+                after a few iterations)
+            time_budget: Optional wall-clock limit in seconds
+            verbose: Log every iteration
+
+        Per-iteration history, min_improvement and time_budget need scipy
+        1.16 or later; older versions report only the final cost.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown bundle adjustment mode: {mode}")
+        if loss not in ROBUST_LOSSES:
+            raise ValueError(f"Unknown robust loss: {loss}")
+        
+        self.loss = loss
+        self.f_scale = f_scale
+        self.max_nfev = max_nfev
+        self.ftol = ftol
+        self.mode = mode
+        self.min_improvement = min_improvement
+        self.time_budget = time_budget
+        self.verbose = verbose
+
+    def solve(self, model_ids, params, image_cameras, rvecs, tvecs, points,
+              obs_image, obs_point, obs_xy, fixed_images=(), fixed_cameras=()):
+        """
+        Run bundle adjustment
+
+        Args:
+            model_ids: COLMAP model id per camera (C,)
+            params: Camera parameters, padded (C x P)
+            image_cameras: Camera index of every image (I,)
+            rvecs, tvecs: World-to-camera axis-angle rotations and translations (I x 3)
+            points: 3D points (N x 3)
+            obs_image, obs_point: Image and point index of every observation (M,)
+            obs_xy: Observed pixel coordinates (M x 2)
+            fixed_images: Image indices whose poses stay fixed (gauge)
+            fixed_cameras: Camera indices whose intrinsics stay fixed in
+                'full' mode
+
+        Returns:
+            Dict with refined params, rvecs, tvecs, points, the initial and
+            final RMS reprojection error and the per-iteration history
+        """
+        start_time = time.time()
+        model_ids = np.asarray(model_ids)
+        for model_id in np.unique(model_ids):
+            if int(model_id) not in REFINABLE_PARAMS:
+                raise ValueError(f"Unsupported camera model id: {model_id}")
+
+        num_images = len(rvecs)
+        obs_camera = np.asarray(image_cameras)[obs_image]
+
+        # Parameter layout: free poses | free intrinsics | points
+        if self.mode == "points_only":
+            fixed_images = np.arange(num_images)
+        free_images = np.setdiff1d(np.arange(num_images), np.asarray(fixed_images, dtype=int))
+        pose_col = np.full(num_images, -1, dtype=np.int64)
+        pose_col[free_images] = np.arange(len(free_images)) * 6
+
+        intr_cams, intr_params = [], []
+        if self.mode == "full":
+            fixed_cameras = set(int(cam) for cam in fixed_cameras)
+            for cam, model_id in enumerate(model_ids):
+                if cam in fixed_cameras:
+                    continue
+                for p in REFINABLE_PARAMS[int(model_id)]:
+                    intr_cams.append(cam)
+                    intr_params.append(p)
+        intr_cams = np.asarray(intr_cams, dtype=np.int64)
+        intr_params = np.asarray(intr_params, dtype=np.int64)
+
+        intr_start = 6 * len(free_images)
+        point_start = intr_start + len(intr_cams)
+
+        poses = np.hstack([rvecs, tvecs])
+        x0 = np.concatenate([
+            poses[free_images].ravel(),
+            params[intr_cams, intr_params],
+            np.asarray(points, dtype=np.float64).ravel(),
+        ])
+
+        def unpack(x):
+            p = poses.copy()
+            p[free_images] = x[:intr_start].reshape(-1, 6)
+            cam_params = params.copy()
+            cam_params[intr_cams, intr_params] = x[intr_start:point_start]
+            return p, cam_params, x[point_start:].reshape(-1, 3)
+
+        def residuals(x):
+            p, cam_params, pts = unpack(x)
+            projected = project(pts[obs_point], p[obs_image, :3], p[obs_image, 3:],
+                                model_ids[obs_camera], cam_params[obs_camera])
+            return (projected - obs_xy).ravel()
+
+        sparsity = jacobian_sparsity(
+            obs_image, obs_point, obs_camera, pose_col, intr_cams, intr_start,
+            point_start, num_cols=len(x0)
+        )
+
+        r0 = residuals(x0)
+        initial_rms = rms(r0)
+        history = [{"iteration": 0, "cost": robust_cost(r0, self.loss, self.f_scale),
+                    "rms": initial_rms, "elapsed_s": time.time() - start_time}]
+        stop_reason = []
+
+        def callback(intermediate_result):
+            entry = {
+                "iteration": int(intermediate_result.nit),
+                "cost": float(intermediate_result.cost),
+                "rms": rms(intermediate_result.fun),
+                "elapsed_s": time.time() - start_time,
+            }
+            improvement = (history[-1]["cost"] - entry["cost"]) / max(history[-1]["cost"], 1e-12)
+            history.append(entry)
+            if self.verbose:
+                logger.info(f"  iteration {entry['iteration']}: cost {entry['cost']:.4g}, "
+                            f"RMS {entry['rms']:.3f}px, {entry['elapsed_s']:.2f}s")
+            if 0 <= improvement < self.min_improvement:
+                stop_reason.append(f"improvement {improvement:.2e} < {self.min_improvement:g}")
+                return True
+            if self.time_budget is not None and entry["elapsed_s"] > self.time_budget:
+                stop_reason.append(f"time budget {self.time_budget:g}s reached")
+                return True
+            return False
+
+        options = {"callback": callback} if SUPPORTS_CALLBACK else {}
+        if not SUPPORTS_CALLBACK and (self.min_improvement or self.time_budget is not None):
+            logger.warning("min_improvement and time_budget need scipy >= 1.16; ignored")
+        result = least_squares(
+            residuals, x0, jac_sparsity=sparsity, method="trf", tr_solver="lsmr",
+            loss=self.loss, f_scale=self.f_scale,
+            max_nfev=self.max_nfev, ftol=self.ftol, xtol=1e-10, **options
+        )
+        refined_poses, refined_params, refined_points = unpack(result.x)
+        if not SUPPORTS_CALLBACK:
+            # Without the callback only the final state is known; trf
+            # evaluates the Jacobian once per iteration
+            history.append({"iteration": int(result.njev), "cost": float(result.cost),
+                            "rms": rms(result.fun), "elapsed_s": time.time() - start_time})
+
+        final_rms = rms(result.fun)
+        elapsed = time.time() - start_time
+        message = stop_reason[0] if stop_reason else result.message
+        logger.info(f"Bundle adjustment ({self.mode}): {len(obs_xy)} observations, "
+                    f"{len(x0)} parameters, RMS {initial_rms:.3f} -> {final_rms:.3f}px "
+                    f"({history[-1]['iteration']} iterations, {result.nfev} evaluations, "
+                    f"{elapsed:.2f}s)")
+
+        return {
+            "params": refined_params,
+            "rvecs": refined_poses[:, :3],
+            "tvecs": refined_poses[:, 3:],
+            "points": refined_points,
+            "initial_rms": initial_rms,
+            "final_rms": final_rms,
+            "nfev": int(result.nfev),
+            "iterations": history[-1]["iteration"],
+            "converged": result.status > 0,
+            "stopped_early": bool(stop_reason),
+            "message": message,
+            "elapsed_s": elapsed,
+            "history": history,
+        }
+
+
+def adjust_model(model, adjuster, local_images=None):
+    """
+    Bundle-adjust a ColmapModel in place
+
+    The image with the most observations keeps its pose (gauge); in the
+    other modes every observation of a triangulated point takes part.
+
+    With local_images only those poses and the points they observe are
+    refined; every other image stays fixed and anchors the solution
+    through its observations of the same points. In 'full' mode only the
+    intrinsics of cameras that no fixed image uses are refined.
+
+    Args:
+        model: ColmapModel (e.g. ColmapModel.read(sparse/0))
+        adjuster: Configured BundleAdjuster
+        local_images: Optional image rows (indices into model.images) for
+            a local adjustment
+
+    Returns:
+        The BundleAdjuster.solve report (without the refined arrays)
+    """
+    observed = model.points2D["point3D_id"] >= 0
+    obs_image = np.repeat(np.arange(len(model.images)), np.diff(model.points2D_offsets))[observed]
+    obs_point = id_rows(model.points3D["point3D_id"].astype(np.int64),
+                        model.points2D["point3D_id"][observed])
+    if (obs_point < 0).any():
+        raise ValueError("Observations reference 3D points missing from the model")
+    obs_xy = model.points2D["xy"][observed]
+
+    point_subset = np.arange(len(model.points3D))
+    if local_images is not None:
+        local_images = np.asarray(local_images, dtype=np.int64)
+        point_subset = np.unique(obs_point[np.isin(obs_image, local_images)])
+        keep = np.isin(obs_point, point_subset)
+        obs_image, obs_xy = obs_image[keep], obs_xy[keep]
+        obs_point = np.searchsorted(point_subset, obs_point[keep])
+        if len(obs_point) == 0:
+            raise ValueError("The local images observe no 3D points")
+
+    image_cameras = id_rows(model.cameras["camera_id"], model.images["camera_id"])
+    if (image_cameras < 0).any():
+        raise ValueError("Images reference cameras missing from the model")
+    rotations = model.rotations()
+    rvecs = np.array([cv2.Rodrigues(R)[0].ravel() for R in rotations]).reshape(-1, 3)
+    if local_images is None:
+        fixed = [int(np.argmax(np.bincount(obs_image, minlength=len(model.images))))]
+        fixed_cameras = ()
+    else:
+        fixed = np.setdiff1d(np.arange(len(model.images)), local_images)
+        fixed_cameras = np.setdiff1d(np.arange(len(model.cameras)),
+                                     np.setdiff1d(image_cameras[local_images],
+                                                  image_cameras[fixed]))
+
+    result = adjuster.solve(
+        model.cameras["model_id"], model.cameras["params"], image_cameras,
+        rvecs, model.images["tvec"], model.points3D["xyz"][point_subset],
+        obs_image, obs_point, obs_xy, fixed_images=fixed, fixed_cameras=fixed_cameras
+    )
+
+    model.cameras["params"] = result["params"]
+    model.images["qvec"] = rotation_to_quaternion(
+        np.array([cv2.Rodrigues(r)[0] for r in result["rvecs"]]).reshape(-1, 3, 3)
+    )
+    model.images["tvec"] = result["tvecs"]
+    model.points3D["xyz"][point_subset] = result["points"]
+
+    # Mean reprojection error per point, as COLMAP stores it
+    projected = project(result["points"][obs_point], result["rvecs"][obs_image],
+                        result["tvecs"][obs_image],
+                        model.cameras["model_id"][image_cameras[obs_image]],
+                        result["params"][image_cameras[obs_image]])
+    errors = np.linalg.norm(projected - obs_xy, axis=1)
+    counts = np.bincount(obs_point, minlength=len(point_subset))
+    sums = np.bincount(obs_point, weights=errors, minlength=len(point_subset))
+    model.points3D["error"][point_subset] = np.where(counts > 0, sums / np.maximum(counts, 1), 0.0)
+
+    return {key: value for key, value in result.items()
+            if key not in ("params", "rvecs", "tvecs", "points")}
+
+
+def robust_cost(residuals, loss="linear", f_scale=1.0):
+    """Cost as least_squares reports it: 0.5 * f_scale^2 * sum(rho((r / f_scale)^2))"""
+    return float(0.5 * f_scale ** 2 * ROBUST_LOSSES[loss]((residuals / f_scale) ** 2).sum())
+
+
+def rms(residuals):
+    """RMS reprojection error in pixels from stacked (x, y) residuals"""
+    return float(np.sqrt(np.mean(residuals ** 2) * 2)) if len(residuals) else 0.0
+
+
+def jacobian_sparsity(obs_image, obs_point, obs_camera, pose_col, intr_cams,
+                      intr_start, point_start, num_cols):
+    """Block-sparse pattern of the reprojection Jacobian (2M x num_cols)"""
+    num_obs = len(obs_image)
+    rows, cols = [], []
+    obs_rows = np.stack([2 * np.arange(num_obs), 2 * np.arange(num_obs) + 1], axis=1)
+
+    def block(obs, first_col, width):
+        # Every residual row of the given observations touches width columns
+        r = np.broadcast_to(obs_rows[obs][:, :, None], (len(obs), 2, width))
+        c = np.broadcast_to((first_col[:, None] + np.arange(width))[:, None, :],
+                            (len(obs), 2, width))
+        rows.append(r.ravel())
+        cols.append(c.ravel())
+
+    free = np.flatnonzero(pose_col[obs_image] >= 0)
+    block(free, pose_col[obs_image[free]], 6)
+    block(np.arange(num_obs), point_start + 3 * np.asarray(obs_point, dtype=np.int64), 3)
+
+    for i, cam in enumerate(intr_cams):
+        obs = np.flatnonzero(obs_camera == cam)
+        block(obs, np.full(len(obs), intr_start + i, dtype=np.int64), 1)
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    return sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(2 * num_obs, num_cols)
+    )
+
+
+def rotate(points, rvecs):
+    """Rotate points by axis-angle vectors (Rodrigues' formula, row-wise)"""
+    theta = np.linalg.norm(rvecs, axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        axis = np.where(theta > 1e-12, rvecs / theta, 0.0)
+    cos, sin = np.cos(theta), np.sin(theta)
+    dot = np.sum(points * axis, axis=1, keepdims=True)
+    return points * cos + np.cross(axis, points) * sin + axis * dot * (1 - cos)
+
+
+def project(points, rvecs, tvecs, model_ids, params):
+    """
+    Project world points to pixels, one camera row per point
+
+    Args:
+        points: World points (M x 3)
+        rvecs, tvecs: Pose of the observing image per point (M x 3)
+        model_ids: COLMAP model id per point (M,)
+        params: Camera parameters per point, padded (M x P)
+    """
+    cam = rotate(points, rvecs) + tvecs
+    z = cam[:, 2]
+    z = np.where(np.abs(z) < 1e-12, 1e-12, z)
+    u, v = cam[:, 0] / z, cam[:, 1] / z
+
+    fx, fy, cx, cy, k1, k2, p1, p2 = opencv_params(model_ids, params)
+    r2 = u * u + v * v
+    radial = 1 + k1 * r2 + k2 * r2 * r2
+    du = u * radial + 2 * p1 * u * v + p2 * (r2 + 2 * u * u)
+    dv = v * radial + p1 * (r2 + 2 * v * v) + 2 * p2 * u * v
+    return np.stack([fx * du + cx, fy * dv + cy], axis=1)
+
+
+def opencv_params(model_ids, params):
+    """Express each row's camera as OPENCV (fx, fy, cx, cy, k1, k2, p1, p2) columns"""
+    model_ids = np.asarray(model_ids)
+    params = np.nan_to_num(np.asarray(params, dtype=np.float64))
+    out = np.zeros((len(params), 8))
+
+    single = np.isin(model_ids, (0, 2, 3))
+    out[single, 0] = out[single, 1] = params[single, 0]
+    out[single, 2:4] = params[single, 1:3]
+
+    double = np.isin(model_ids, (1, 4))
+    out[double, 0:4] = params[double, 0:4]
+
+    radial = np.isin(model_ids, (2, 3))
+    out[radial, 4] = params[radial, 3]
+    out[model_ids == 3, 5] = params[model_ids == 3, 4]
+
+    opencv = model_ids == 4
+    out[opencv, 4:8] = params[opencv, 4:8]
+    return out.T
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bundle-adjust a COLMAP binary model")
+    parser.add_argument("input", help="Model directory (cameras.bin, images.bin, points3D.bin)")
+    parser.add_argument("-o", "--output", help="Output model directory (default: in place)")
+    parser.add_argument(
+        "--mode",
+        choices=MODES,
+        default="full",
+        help="Parameters to refine (default: full)"
+    )
+    parser.add_argument(
+        "--loss",
+        default="linear",
+        help="Robust loss: linear, huber, soft_l1, cauchy or arctan (default: linear)"
+    )
+    parser.add_argument(
+        "--max-iterations",
+        type=int,
+        default=50,
+        help="Maximum residual evaluations (default: 50)"
+    )
+    parser.add_argument(
+        "--min-improvement",
+        type=float,
+        default=0.0,
+        help="Stop once an iteration improves the cost by less than this fraction"
+    )
+    args = parser.parse_args()
+
+    model = ColmapModel.read(args.input)
+    adjuster = BundleAdjuster(
+        loss=args.loss,
+        max_nfev=args.max_iterations,
+        mode=args.mode,
+        min_improvement=args.min_improvement,
+        verbose=True
+    )
+    report = adjust_model(model, adjuster)
+
+    output = Path(args.output or args.input)
+    model.write(output)
+    with open(output / "bundle_adjustment.json", 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Adjusted model saved: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""
+COLMAP Database Access
+Reads and writes database.db blobs as NumPy arrays and analyses the match graph
+"""
+
+import argparse
+import json
+import sqlite3
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from pathlib import Path
+import logging
+import time
+from src.colmap_io import CAMERA_DTYPE, CAMERA_MODELS, MAX_CAMERA_PARAMS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# pair_id = image_id1 * MAX_IMAGE_ID + image_id2 with image_id1 < image_id2
+MAX_IMAGE_ID = 2**31 - 1
+
+# TwoViewGeometry configurations that carry no usable relative pose
+UNDEFINED, DEGENERATE, WATERMARK = 0, 1, 7
+UNVERIFIED_CONFIGS = (UNDEFINED, DEGENERATE, WATERMARK)
+
+PAIR_DTYPE = np.dtype([
+    ("pair_id", "<i8"),
+    ("image_id1", "<i4"),
+    ("image_id2", "<i4"),
+    ("num_matches", "<i4"),
+    ("num_inliers", "<i4"),
+    ("config", "<i4"),
+])
+
+# Tables as created by COLMAP (the image pose priors keep older and newer
+# COLMAP versions able to read the file)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cameras (
+    camera_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    model INTEGER NOT NULL, width INTEGER NOT NULL, height INTEGER NOT NULL,
+    params BLOB, prior_focal_length INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS images (
+    image_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    name TEXT NOT NULL UNIQUE, camera_id INTEGER NOT NULL,
+    prior_qw REAL, prior_qx REAL, prior_qy REAL, prior_qz REAL,
+    prior_tx REAL, prior_ty REAL, prior_tz REAL,
+    CONSTRAINT image_id_check CHECK(image_id >= 0 and image_id < 2147483647),
+    FOREIGN KEY(camera_id) REFERENCES cameras(camera_id));
+CREATE UNIQUE INDEX IF NOT EXISTS index_name ON images(name);
+CREATE TABLE IF NOT EXISTS keypoints (
+    image_id INTEGER PRIMARY KEY NOT NULL, rows INTEGER NOT NULL, cols INTEGER NOT NULL,
+    data BLOB, FOREIGN KEY(image_id) REFERENCES images(image_id) ON DELETE CASCADE);
+CREATE TABLE IF NOT EXISTS descriptors (
+    image_id INTEGER PRIMARY KEY NOT NULL, rows INTEGER NOT NULL, cols INTEGER NOT NULL,
+    data BLOB, FOREIGN KEY(image_id) REFERENCES images(image_id) ON DELETE CASCADE);
+CREATE TABLE IF NOT EXISTS matches (
+    pair_id INTEGER PRIMARY KEY NOT NULL, rows INTEGER NOT NULL, cols INTEGER NOT NULL,
+    data BLOB);
+CREATE TABLE IF NOT EXISTS two_view_geometries (
+    pair_id INTEGER PRIMARY KEY NOT NULL, rows INTEGER NOT NULL, cols INTEGER NOT NULL,
+    data BLOB, config INTEGER NOT NULL, F BLOB, E BLOB, H BLOB, qvec BLOB, tvec BLOB);
+"""
+
+
+class ColmapDatabase:
+    def __init__(self, database_path, create=False):
+        """
+        Open a COLMAP database
+
+        Every reader issues one query per table and decodes all blobs with
+        a single np.frombuffer; variable-length data comes back flat with
+        offsets, as in ColmapModel (the rows of image i are
+        data[offsets[i]:offsets[i + 1]]).
+
+        Args:
+            database_path: Path to database.db
+            create: Create the file and COLMAP's tables if missing
+        """
+        self.database_path = Path(database_path)
+        if not create and not self.database_path.exists():
+            raise IOError(f"Database not found: {self.database_path}")
+
+        self.connection = sqlite3.connect(str(self.database_path))
+        if create:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Readers
+
+    def cameras(self):
+        """CAMERA_DTYPE array (params padded with NaN)"""
+        rows = self.connection.execute(
+            "SELECT camera_id, model, width, height, params FROM cameras ORDER BY camera_id"
+        ).fetchall()
+        cameras = np.zeros(len(rows), dtype=CAMERA_DTYPE)
+        cameras["params"] = np.nan
+        for i, (camera_id, model_id, width, height, params) in enumerate(rows):
+            values = np.frombuffer(params, dtype="<f8")
+            cameras[i] = (camera_id, model_id, width, height,
+                          np.pad(values, (0, MAX_CAMERA_PARAMS - len(values)),
+                                 constant_values=np.nan))
+        return cameras
+
+    def images(self):
+        """(image_ids, camera_ids, names) ordered by image_id"""
+        rows = self.connection.execute(
+            "SELECT image_id, camera_id, name FROM images ORDER BY image_id"
+        ).fetchall()
+        if not rows:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), []
+        image_ids, camera_ids, names = zip(*rows)
+        return (np.array(image_ids, dtype=np.int32), np.array(camera_ids, dtype=np.int32),
+                list(names))
+
+    def keypoints(self, image_ids=None):
+        """
+        Keypoints of every image (or of image_ids)
+
+        Returns:
+            (image_ids, keypoints (N x cols float32, x y first), offsets)
+        """
+        return self._read_blobs("keypoints", "image_id", "<f4", image_ids)
+
+    def descriptors(self, image_ids=None):
+        """
+        SIFT descriptors of every image (or of image_ids)
+
+        Returns:
+            (image_ids, descriptors (N x 128 uint8), offsets)
+        """
+        return self._read_blobs("descriptors", "image_id", "u1", image_ids)
+
+    def matches(self, verified=True, pair_ids=None):
+        """
+        Feature matches of every pair (or of pair_ids)
+
+        Args:
+            verified: Geometrically verified inliers (two_view_geometries)
+                instead of the raw matches
+            pair_ids: Optional subset of pairs
+
+        Returns:
+            (pair_ids, matches (M x 2 uint32 keypoint indices of image_id1
+            and image_id2), offsets)
+        """
+        table = "two_view_geometries" if verified else "matches"
+        return self._read_blobs(table, "pair_id", "<u4", pair_ids)
+
+    def pairs(self):
+        """
+        PAIR_DTYPE array of every matched pair, without loading any blob
+
+        Pairs that were matched but never verified have num_inliers 0 and
+        config UNDEFINED.
+        """
+        rows = self.connection.execute("""
+            SELECT pair_id, SUM(num_matches), SUM(num_inliers), MAX(config) FROM (
+                SELECT pair_id, rows AS num_matches, 0 AS num_inliers, 0 AS config FROM matches
+                UNION ALL
+                SELECT pair_id, 0, rows, config FROM two_view_geometries
+            ) GROUP BY pair_id ORDER BY pair_id
+        """).fetchall()
+        pairs = np.zeros(len(rows), dtype=PAIR_DTYPE)
+        if rows:
+            values = np.array(rows, dtype=np.int64)
+            pairs["pair_id"] = values[:, 0]
+            pairs["image_id1"], pairs["image_id2"] = pair_id_to_image_ids(values[:, 0])
+            pairs["num_matches"] = values[:, 1]
+            pairs["num_inliers"] = values[:, 2]
+            pairs["config"] = values[:, 3]
+        return pairs
+
+    def _read_blobs(self, table, key, dtype, keys=None):
+        query = f"SELECT {key}, rows, cols, data FROM {table}"
+        params = ()
+        if keys is not None:
+            # The key list travels as one JSON parameter, not one per key
+            query += f" WHERE {key} IN (SELECT value FROM json_each(?))"
+            params = (json.dumps([int(k) for k in keys]),)
+        rows = self.connection.execute(query + f" ORDER BY {key}", params).fetchall()
+
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=dtype), np.zeros(1, dtype=np.int64)
+
+        ids, counts, cols, blobs = zip(*rows)
+        cols = {c for c, n in zip(cols, counts) if n > 0} or {cols[0]}
+        if len(cols) > 1:
+            raise ValueError(f"Mixed column counts in {table}: {sorted(cols)}")
+        data = np.frombuffer(b"".join(blob or b"" for blob in blobs), dtype=dtype)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return np.array(ids, dtype=np.int64), data.reshape(-1, cols.pop()), offsets
+
+    # Writers
+
+    def add_camera(self, model_id, width, height, params, prior_focal_length=False):
+        """Insert a camera and return its camera_id"""
+        params = np.asarray(params, dtype="<f8")
+        if len(params) != CAMERA_MODELS[int(model_id)][1]:
+            raise ValueError(f"Camera model {model_id} takes "
+                             f"{CAMERA_MODELS[int(model_id)][1]} parameters")
+        cursor = self.connection.execute(
+            "INSERT INTO cameras (model, width, height, params, prior_focal_length) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (int(model_id), int(width), int(height), params.tobytes(), int(prior_focal_length))
+        )
+        return cursor.lastrowid
+
+    def add_images(self, names, camera_ids):
+        """Insert images and return their image_ids"""
+        self.connection.executemany(
+            "INSERT INTO images (name, camera_id) VALUES (?, ?)",
+            zip(names, (int(c) for c in np.broadcast_to(camera_ids, (len(names),))))
+        )
+        index = dict(self.connection.execute("SELECT name, image_id FROM images"))
+        return np.array([index[name] for name in names], dtype=np.int64)
+
+    def set_image_cameras(self, names, camera_ids):
+        """
+        Point images at other cameras and drop cameras no image uses
+
+        Returns:
+            camera_ids of the removed cameras
+        """
+        self.connection.executemany(
+            "UPDATE images SET camera_id = ? WHERE name = ?",
+            zip((int(c) for c in np.broadcast_to(camera_ids, (len(names),))), names)
+        )
+        unused = [row[0] for row in self.connection.execute(
+            "SELECT camera_id FROM cameras WHERE camera_id NOT IN "
+            "(SELECT DISTINCT camera_id FROM images)")]
+        self.connection.executemany("DELETE FROM cameras WHERE camera_id = ?",
+                                    ((c,) for c in unused))
+        self.connection.commit()
+        return unused
+
+    def write_keypoints(self, image_ids, keypoints, offsets):
+        """Replace the keypoints of image_ids (float32, x y first)"""
+        self._write_blobs("keypoints", "image_id", image_ids,
+                          np.asarray(keypoints, dtype="<f4"), offsets)
+
+    def write_descriptors(self, image_ids, descriptors, offsets):
+        """Replace the descriptors of image_ids (uint8)"""
+        self._write_blobs("descriptors", "image_id", image_ids,
+                          np.asarray(descriptors, dtype="u1"), offsets)
+
+    def write_matches(self, pair_ids, matches, offsets):
+        """Replace the raw matches of pair_ids (uint32 index pairs)"""
+        self._write_blobs("matches", "pair_id", pair_ids,
+                          np.asarray(matches, dtype="<u4"), offsets)
+
+    def write_two_view_geometries(self, pair_ids, inliers, offsets, configs):
+        """
+        Replace the verified inliers of pair_ids
+
+        F, E and H are stored as identity and the relative pose as unset;
+        the mapper only reads the inliers and config.
+        """
+        columns = {row[1] for row in self.connection.execute(
+            "PRAGMA table_info(two_view_geometries)")}
+        extra = {"F": np.eye(3), "E": np.eye(3), "H": np.eye(3),
+                 "qvec": np.array([1.0, 0, 0, 0]), "tvec": np.zeros(3)}
+        extra = {name: value.astype("<f8").tobytes() for name, value in extra.items()
+                 if name in columns}
+        self._write_blobs("two_view_geometries", "pair_id", pair_ids,
+                          np.asarray(inliers, dtype="<u4"), offsets,
+                          extra={"config": np.asarray(configs, dtype=np.int64), **extra})
+
+    def _write_blobs(self, table, key, keys, data, offsets, extra=None):
+        data = np.ascontiguousarray(data)
+        cols = data.shape[1] if data.ndim == 2 else 1
+        offsets = np.asarray(offsets, dtype=np.int64)
+        raw = data.tobytes()
+        row_bytes = cols * data.itemsize
+
+        extra = extra or {}
+        names = [key, "rows", "cols", "data", *extra]
+
+        def rows():
+            for i, k in enumerate(keys):
+                start, end = offsets[i], offsets[i + 1]
+                values = [int(k), int(end - start), cols, raw[start * row_bytes:end * row_bytes]]
+                for value in extra.values():
+                    values.append(int(value[i]) if isinstance(value, np.ndarray) else value)
+                yield values
+
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(names)}) "
+            f"VALUES ({', '.join('?' * len(names))})",
+            rows()
+        )
+        self.connection.commit()
+
+    # Match graph
+
+    def weak_pairs(self, min_inliers=15, min_inlier_ratio=0.0, pairs=None):
+        """
+        Mask over pairs() of pairs the mapper should not rely on
+
+        A pair is weak when it was never verified (or verified as
+        degenerate or a watermark), has fewer than min_inliers inliers, or
+        keeps less than min_inlier_ratio of its raw matches.
+        """
+        pairs = self.pairs() if pairs is None else pairs
+        ratio = pairs["num_inliers"] / np.maximum(pairs["num_matches"], 1)
+        return (np.isin(pairs["config"], UNVERIFIED_CONFIGS)
+                | (pairs["num_inliers"] < min_inliers)
+                | (ratio < min_inlier_ratio))
+
+    def graph_stats(self, min_inliers=15, min_inlier_ratio=0.0):
+        """
+        Match graph summary over the strong (non-weak) pairs
+
+        Returns:
+            Dict with pair counts, inlier statistics, the connected
+            components (largest first, as image names) and the images
+            without any strong pair
+        """
+        image_ids, _, names = self.images()
+        pairs = self.pairs()
+        weak = self.weak_pairs(min_inliers, min_inlier_ratio, pairs=pairs)
+        strong = pairs[~weak]
+
+        # Image ids -> dense indices
+        rows = np.searchsorted(image_ids, strong["image_id1"])
+        cols = np.searchsorted(image_ids, strong["image_id2"])
+        n = len(image_ids)
+        graph = sparse.coo_matrix((np.ones(len(strong)), (rows, cols)), shape=(n, n))
+        num_components, labels = connected_components(graph, directed=False)
+
+        degree = np.bincount(np.concatenate([rows, cols]), minlength=n)
+        inliers = np.bincount(np.concatenate([rows, cols]),
+                              weights=np.tile(strong["num_inliers"], 2), minlength=n)
+
+        sizes = np.bincount(labels, minlength=num_components)
+        components = [[names[i] for i in np.flatnonzero(labels == label)]
+                      for label in np.argsort(-sizes, kind="stable")]
+
+        return {
+            "num_images": n,
+            "num_pairs": len(pairs),
+            "num_verified_pairs": int(np.count_nonzero(~np.isin(pairs["config"], UNVERIFIED_CONFIGS))),
+            "num_weak_pairs": int(np.count_nonzero(weak)),
+            "num_inliers": int(strong["num_inliers"].sum()),
+            "median_pair_inliers": float(np.median(strong["num_inliers"])) if len(strong) else 0.0,
+            "mean_image_degree": float(degree.mean()) if n else 0.0,
+            "mean_image_inliers": float(inliers.mean()) if n else 0.0,
+            "components": components,
+            "isolated_images": [names[i] for i in np.flatnonzero(degree == 0)],
+        }
+
+    def prune_pairs(self, min_inliers=15, min_inlier_ratio=0.0, dry_run=False):
+        """
+        Drop weak pairs from the verified match graph
+
+        Their two_view_geometries entries are emptied and marked degenerate
+        rather than deleted, so the mapper skips them while re-running the
+        matcher still treats them as done. Raw matches are kept.
+
+        Returns:
+            pair_ids that were (or with dry_run would be) pruned
+        """
+        pairs = self.pairs()
+        pruned = pairs["pair_id"][self.weak_pairs(min_inliers, min_inlier_ratio, pairs=pairs)
+                                  & (pairs["num_inliers"] > 0)]
+        if not dry_run and len(pruned):
+            self.connection.executemany(
+                "UPDATE two_view_geometries SET rows = 0, data = ?, config = ? WHERE pair_id = ?",
+                ((b"", DEGENERATE, int(pair_id)) for pair_id in pruned)
+            )
+            self.connection.commit()
+        logger.info(f"{'Would prune' if dry_run else 'Pruned'} {len(pruned)} of "
+                    f"{len(pairs)} pairs (min_inliers={min_inliers}, "
+                    f"min_inlier_ratio={min_inlier_ratio})")
+        return pruned
+
+
+def image_ids_to_pair_id(image_id1, image_id2):
+    """COLMAP pair ids (order independent)"""
+    image_id1 = np.asarray(image_id1, dtype=np.int64)
+    image_id2 = np.asarray(image_id2, dtype=np.int64)
+    return np.minimum(image_id1, image_id2) * MAX_IMAGE_ID + np.maximum(image_id1, image_id2)
+
+
+def pair_id_to_image_ids(pair_ids):
+    """(image_id1, image_id2) with image_id1 < image_id2"""
+    pair_ids = np.asarray(pair_ids, dtype=np.int64)
+    image_id2 = pair_ids % MAX_IMAGE_ID
+    return (pair_ids - image_id2) // MAX_IMAGE_ID, image_id2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and prune a COLMAP database")
+    parser.add_argument("database", help="Path to database.db")
+    parser.add_argument("--min-inliers", type=int, default=15,
+                        help="Inliers for a strong pair (default: 15)")
+    parser.add_argument("--min-inlier-ratio", type=float, default=0.0,
+                        help="Inlier/match ratio for a strong pair (default: 0)")
+    parser.add_argument("--prune", action="store_true",
+                        help="Remove weak pairs before running the mapper")
+    args = parser.parse_args()
+
+    with ColmapDatabase(args.database) as db:
+        start_time = time.time()
+        stats = db.graph_stats(args.min_inliers, args.min_inlier_ratio)
+        logger.info(f"Match graph analysed in {(time.time() - start_time) * 1000:.1f} ms")
+
+        components = stats.pop("components")
+        isolated = stats.pop("isolated_images")
+        logger.info(json.dumps(stats, indent=2))
+        logger.info(f"Components: {[len(c) for c in components]}")
+        if isolated:
+            logger.info(f"Images without a strong pair: {', '.join(isolated)}")
+
+        if args.prune:
+            db.prune_pairs(args.min_inliers, args.min_inlier_ratio)
+
+
+if __name__ == "__main__":
+    main()
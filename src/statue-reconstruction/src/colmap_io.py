@@ -0,0 +1,401 @@
+"""
+COLMAP Binary Model I/O
+Reads and writes cameras.bin, images.bin and points3D.bin as NumPy arrays
+"""
+
+import numpy as np
+from pathlib import Path
+import logging
+import mmap
+import struct
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# model_id -> (name, number of parameters)
+CAMERA_MODELS = {
+    0: ("SIMPLE_PINHOLE", 3),
+    1: ("PINHOLE", 4),
+    2: ("SIMPLE_RADIAL", 4),
+    3: ("RADIAL", 5),
+    4: ("OPENCV", 8),
+    5: ("OPENCV_FISHEYE", 8),
+    6: ("FULL_OPENCV", 12),
+    7: ("FOV", 5),
+    8: ("SIMPLE_RADIAL_FISHEYE", 4),
+    9: ("RADIAL_FISHEYE", 5),
+    10: ("THIN_PRISM_FISHEYE", 12),
+    11: ("RAD_TAN_THIN_PRISM_FISHEYE", 16),
+}
+CAMERA_MODEL_IDS = {name: model_id for model_id, (name, _) in CAMERA_MODELS.items()}
+MAX_CAMERA_PARAMS = max(n for _, n in CAMERA_MODELS.values())
+
+CAMERA_DTYPE = np.dtype([
+    ("camera_id", "<i4"),
+    ("model_id", "<i4"),
+    ("width", "<u8"),
+    ("height", "<u8"),
+    ("params", "<f8", (MAX_CAMERA_PARAMS,)),
+])
+
+IMAGE_DTYPE = np.dtype([
+    ("image_id", "<i4"),
+    ("qvec", "<f8", (4,)),
+    ("tvec", "<f8", (3,)),
+    ("camera_id", "<i4"),
+    ("num_points2D", "<i8"),
+])
+
+# On-disk layouts (packed, little endian)
+POINT2D_DTYPE = np.dtype([("xy", "<f8", (2,)), ("point3D_id", "<i8")])
+POINT3D_DTYPE = np.dtype([
+    ("point3D_id", "<u8"),
+    ("xyz", "<f8", (3,)),
+    ("rgb", "u1", (3,)),
+    ("error", "<f8"),
+    ("track_length", "<u8"),
+])
+TRACK_DTYPE = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+
+
+class ColmapModel:
+    def __init__(self, cameras, images, names, points2D, points2D_offsets,
+                 points3D, tracks, track_offsets):
+        """
+        A sparse COLMAP reconstruction held in NumPy arrays
+
+        Variable-length data is stored flat with offsets: the observations
+        of image i are points2D[points2D_offsets[i]:points2D_offsets[i + 1]]
+        and the track of point j is tracks[track_offsets[j]:track_offsets[j + 1]].
+
+        Args:
+            cameras: CAMERA_DTYPE array (params padded with NaN)
+            images: IMAGE_DTYPE array
+            names: Image names, aligned with images
+            points2D: POINT2D_DTYPE array of all observations
+            points2D_offsets: int64 array of len(images) + 1
+            points3D: POINT3D_DTYPE array
+            tracks: TRACK_DTYPE array of all track elements
+            track_offsets: int64 array of len(points3D) + 1
+        """
+        self.cameras = cameras
+        self.images = images
+        self.names = names
+        self.points2D = points2D
+        self.points2D_offsets = points2D_offsets
+        self.points3D = points3D
+        self.tracks = tracks
+        self.track_offsets = track_offsets
+
+    @classmethod
+    def read(cls, model_dir):
+        """Read a binary model directory (cameras.bin, images.bin, points3D.bin)"""
+        model_dir = Path(model_dir)
+        cameras = read_cameras_bin(model_dir / "cameras.bin")
+        images, names, points2D, points2D_offsets = read_images_bin(model_dir / "images.bin")
+        points3D, tracks, track_offsets = read_points3d_bin(model_dir / "points3D.bin")
+        return cls(cameras, images, names, points2D, points2D_offsets,
+                   points3D, tracks, track_offsets)
+
+    def write(self, model_dir):
+        """Write the model as a binary model directory"""
+        model_dir = Path(model_dir)
+        model_dir.mkdir(parents=True, exist_ok=True)
+        write_cameras_bin(model_dir / "cameras.bin", self.cameras)
+        write_images_bin(model_dir / "images.bin", self.images, self.names,
+                         self.points2D, self.points2D_offsets)
+        write_points3d_bin(model_dir / "points3D.bin", self.points3D,
+                           self.tracks, self.track_offsets)
+        return model_dir
+
+    def camera_model(self, row):
+        """(model name, params) for a row of the cameras array"""
+        name, num_params = CAMERA_MODELS[int(self.cameras["model_id"][row])]
+        return name, self.cameras["params"][row, :num_params]
+
+    def image_points(self, row):
+        """Observations of the image at a row of the images array"""
+        return self.points2D[self.points2D_offsets[row]:self.points2D_offsets[row + 1]]
+
+    def track(self, row):
+        """Track of the point at a row of the points3D array"""
+        return self.tracks[self.track_offsets[row]:self.track_offsets[row + 1]]
+
+    def rotations(self):
+        """World-to-camera rotation matrices (N x 3 x 3) from the quaternions"""
+        return quaternion_to_rotation(self.images["qvec"])
+
+    def camera_centers(self):
+        """Camera centres in world coordinates (N x 3), C = -R^T t"""
+        R = self.rotations()
+        return -np.einsum("nji,nj->ni", R, self.images["tvec"])
+
+    def stats(self):
+        """Summary statistics of the reconstruction"""
+        track_lengths = np.diff(self.track_offsets)
+        observed = (self.points2D["point3D_id"] != -1).sum()
+        total_2d = len(self.points2D)
+        return {
+            "num_cameras": len(self.cameras),
+            "num_images": len(self.images),
+            "num_points": len(self.points3D),
+            "num_observations": int(track_lengths.sum()),
+            "mean_track_length": float(track_lengths.mean()) if len(track_lengths) else 0.0,
+            "mean_observations_per_image": (
+                float(observed / len(self.images)) if len(self.images) else 0.0
+            ),
+            "mean_reprojection_error": (
+                float(self.points3D["error"].mean()) if len(self.points3D) else 0.0
+            ),
+            "triangulated_ratio": float(observed / total_2d) if total_2d else 0.0,
+        }
+
+
+def id_rows(ids, queries):
+    """Rows of queries in an unsorted id array (-1 where missing)"""
+    if not len(ids):
+        return np.full(len(queries), -1, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    position = np.minimum(np.searchsorted(ids[order], queries), len(ids) - 1)
+    return np.where(ids[order][position] == queries, order[position], -1)
+
+
+def _offsets(counts):
+    return np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+
+
+def _record_mask(size, starts, itemsize):
+    """
+    Boolean mask over size bytes marking the itemsize bytes at each start
+
+    Built as a running sum of +1/-1 run edges, so no temporary is larger
+    than the buffer itself.
+    """
+    edges = np.zeros(size + 1, dtype=np.int8)
+    edges[starts] = 1
+    edges[starts + itemsize] -= 1
+    return np.cumsum(edges[:-1], dtype=np.int8).view(bool)
+
+
+def _map_file(path):
+    """Read-only memory map of a file"""
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_cameras_bin(path):
+    """Read cameras.bin into a CAMERA_DTYPE array"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    (num_cameras,) = struct.unpack_from("<Q", data, 0)
+    cameras = np.zeros(num_cameras, dtype=CAMERA_DTYPE)
+    cameras["params"] = np.nan
+
+    offset = 8
+    for i in range(num_cameras):
+        camera_id, model_id, width, height = struct.unpack_from("<iiQQ", data, offset)
+        offset += 24
+        if model_id not in CAMERA_MODELS:
+            raise ValueError(f"Unknown camera model id: {model_id}")
+        num_params = CAMERA_MODELS[model_id][1]
+        params = np.frombuffer(data, dtype="<f8", count=num_params, offset=offset)
+        offset += 8 * num_params
+
+        cameras["camera_id"][i] = camera_id
+        cameras["model_id"][i] = model_id
+        cameras["width"][i] = width
+        cameras["height"][i] = height
+        cameras["params"][i, :num_params] = params
+
+    return cameras
+
+
+def read_images_bin(path):
+    """
+    Read images.bin
+
+    The file is memory-mapped; only the per-image headers are walked in
+    Python and the observation blocks are copied out in one concatenate.
+
+    Returns:
+        (images, names, points2D, points2D_offsets)
+    """
+    data = _map_file(path)
+
+    (num_images,) = struct.unpack_from("<Q", data, 0)
+    images = np.zeros(num_images, dtype=IMAGE_DTYPE)
+    names = []
+    blocks = []
+
+    offset = 8
+    for i in range(num_images):
+        image_id, qw, qx, qy, qz, tx, ty, tz, camera_id = struct.unpack_from(
+            "<i7di", data, offset
+        )
+        offset += 64
+        end = data.find(b"\x00", offset)
+        names.append(data[offset:end].decode("utf-8"))
+        offset = end + 1
+
+        (num_points2D,) = struct.unpack_from("<Q", data, offset)
+        offset += 8
+        blocks.append(np.frombuffer(data, dtype=POINT2D_DTYPE,
+                                    count=num_points2D, offset=offset))
+        offset += POINT2D_DTYPE.itemsize * num_points2D
+
+        images[i] = (image_id, (qw, qx, qy, qz), (tx, ty, tz), camera_id, num_points2D)
+
+    points2D = (np.concatenate(blocks) if blocks
+                else np.zeros(0, dtype=POINT2D_DTYPE))
+    return images, names, points2D, _offsets(images["num_points2D"])
+
+
+def read_points3d_bin(path):
+    """
+    Read points3D.bin
+
+    Only the track lengths are read in a Python loop (each record's
+    offset depends on the previous length); headers and track elements
+    are then split out of the buffer with one byte mask.
+
+    Returns:
+        (points3D, tracks, track_offsets)
+    """
+    data = _map_file(path)
+    buf = np.frombuffer(data, dtype=np.uint8)
+
+    (num_points,) = struct.unpack_from("<Q", data, 0)
+    header_size = POINT3D_DTYPE.itemsize
+    length_offset = POINT3D_DTYPE.fields["track_length"][1]
+    unpack_length = struct.Struct("<Q").unpack_from
+
+    starts = np.empty(num_points, dtype=np.int64)
+    offset = 8
+    for i in range(num_points):
+        (length,) = unpack_length(data, offset + length_offset)
+        starts[i] = offset
+        offset += header_size + TRACK_DTYPE.itemsize * length
+    if offset > len(buf):
+        raise IOError(f"Truncated points3D file: {path}")
+
+    # Everything after the point count that is not a header is a track element
+    buf = buf[8:offset]
+    headers = _record_mask(len(buf), starts - 8, header_size)
+    points3D = buf[headers].view(POINT3D_DTYPE)
+    tracks = buf[np.logical_not(headers, out=headers)].view(TRACK_DTYPE)
+
+    return points3D, tracks, _offsets(points3D["track_length"])
+
+
+def write_cameras_bin(path, cameras):
+    with open(path, 'wb') as f:
+        f.write(struct.pack("<Q", len(cameras)))
+        for camera in cameras:
+            model_id = int(camera["model_id"])
+            num_params = CAMERA_MODELS[model_id][1]
+            f.write(struct.pack("<iiQQ", int(camera["camera_id"]), model_id,
+                                int(camera["width"]), int(camera["height"])))
+            f.write(np.asarray(camera["params"][:num_params], dtype="<f8").tobytes())
+
+
+def write_images_bin(path, images, names, points2D, points2D_offsets):
+    points2D = np.asarray(points2D, dtype=POINT2D_DTYPE)
+    with open(path, 'wb') as f:
+        f.write(struct.pack("<Q", len(images)))
+        for i, image in enumerate(images):
+            f.write(struct.pack("<i7di", int(image["image_id"]), *image["qvec"],
+                                *image["tvec"], int(image["camera_id"])))
+            f.write(names[i].encode("utf-8") + b"\x00")
+            block = points2D[points2D_offsets[i]:points2D_offsets[i + 1]]
+            f.write(struct.pack("<Q", len(block)))
+            f.write(block.tobytes())
+
+
+def write_points3d_bin(path, points3D, tracks, track_offsets):
+    """Write points3D.bin by scattering headers and tracks into one buffer"""
+    points3D = np.asarray(points3D, dtype=POINT3D_DTYPE).copy()
+    lengths = np.diff(track_offsets)
+    points3D["track_length"] = lengths
+    header_size = POINT3D_DTYPE.itemsize
+    track_size = TRACK_DTYPE.itemsize
+
+    starts = np.arange(len(points3D), dtype=np.int64) * header_size \
+        + track_size * track_offsets[:-1]
+    out = np.empty(len(points3D) * header_size + track_size * track_offsets[-1],
+                   dtype=np.uint8)
+    headers = _record_mask(len(out), starts, header_size)
+    out[headers] = points3D.view(np.uint8)
+    out[~headers] = np.ascontiguousarray(tracks, dtype=TRACK_DTYPE).view(np.uint8)
+
+    with open(path, 'wb') as f:
+        f.write(struct.pack("<Q", len(points3D)))
+        f.write(out.tobytes())
+
+
+def quaternion_to_rotation(qvec):
+    """Rotation matrices (N x 3 x 3) from COLMAP (w, x, y, z) quaternions"""
+    q = np.asarray(qvec, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    return np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+    ], axis=-1).reshape(q.shape[:-1] + (3, 3))
+
+
+def rotation_to_quaternion(R):
+    """COLMAP (w, x, y, z) quaternions from rotation matrices (N x 3 x 3)
+
+    Shepperd's method: the largest of w, x, y, z comes from the diagonal and
+    the others from the off-diagonals, so 180 degree rotations stay exact.
+    """
+    R = np.asarray(R, dtype=np.float64)
+    shape = R.shape[:-2]
+    R = R.reshape(-1, 3, 3)
+    r00, r11, r22 = R[:, 0, 0], R[:, 1, 1], R[:, 2, 2]
+    trace = r00 + r11 + r22
+    choice = np.argmax(np.stack([trace, r00, r11, r22], axis=-1), axis=-1)
+
+    q = np.empty((len(R), 4))
+    for k in range(4):
+        rows = np.nonzero(choice == k)[0]
+        M = R[rows]
+        d = [M[:, 0, 0], M[:, 1, 1], M[:, 2, 2]]
+        s21, d21 = M[:, 2, 1] + M[:, 1, 2], M[:, 2, 1] - M[:, 1, 2]
+        s02, d02 = M[:, 0, 2] + M[:, 2, 0], M[:, 0, 2] - M[:, 2, 0]
+        s10, d10 = M[:, 1, 0] + M[:, 0, 1], M[:, 1, 0] - M[:, 0, 1]
+        if k == 0:
+            c = np.sqrt(np.maximum(0.0, 1 + d[0] + d[1] + d[2])) * 2  # 4w
+            q[rows] = np.stack([c / 4, d21 / c, d02 / c, d10 / c], axis=-1)
+        elif k == 1:
+            c = np.sqrt(np.maximum(0.0, 1 + d[0] - d[1] - d[2])) * 2  # 4x
+            q[rows] = np.stack([d21 / c, c / 4, s10 / c, s02 / c], axis=-1)
+        elif k == 2:
+            c = np.sqrt(np.maximum(0.0, 1 - d[0] + d[1] - d[2])) * 2  # 4y
+            q[rows] = np.stack([d02 / c, s10 / c, c / 4, s21 / c], axis=-1)
+        else:
+            c = np.sqrt(np.maximum(0.0, 1 - d[0] - d[1] + d[2])) * 2  # 4z
+            q[rows] = np.stack([d10 / c, s02 / c, s21 / c, c / 4], axis=-1)
+
+    # COLMAP convention: non-negative scalar part
+    q *= np.where(q[:, :1] < 0, -1.0, 1.0)
+    return q.reshape(shape + (4,))
+
+
+def main():
+    """Example usage"""
+    model_dir = Path("output/sparse/sparse/0")
+
+    start_time = time.time()
+    model = ColmapModel.read(model_dir)
+    elapsed = time.time() - start_time
+
+    logger.info(f"Read {model_dir} in {elapsed * 1000:.1f} ms")
+    logger.info(f"Reconstruction stats: {model.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Instrumented COLMAP Runner
+Runs COLMAP commands with a thread/GPU budget, parses their logs and records resource use
+"""
+
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+import json
+import logging
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MATCHERS = ("exhaustive_matcher", "sequential_matcher", "spatial_matcher",
+            "vocab_tree_matcher", "transitive_matcher", "matches_importer")
+
+# Per-command option names for the thread, GPU and image size budgets
+# (bundle_adjuster, image_undistorter, patch_match_stereo, model_merger and
+# model_converter take no thread count)
+THREAD_OPTIONS = {
+    "feature_extractor": "--SiftExtraction.num_threads",
+    "mapper": "--Mapper.num_threads",
+    "image_registrator": "--Mapper.num_threads",
+    "point_triangulator": "--Mapper.num_threads",
+    "stereo_fusion": "--StereoFusion.num_threads",
+    **{matcher: "--SiftMatching.num_threads" for matcher in MATCHERS},
+}
+GPU_OPTIONS = {
+    "feature_extractor": "--SiftExtraction.use_gpu",
+    **{matcher: "--SiftMatching.use_gpu" for matcher in MATCHERS},
+}
+IMAGE_SIZE_OPTIONS = {
+    "feature_extractor": "--SiftExtraction.max_image_size",
+    "image_undistorter": "--max_image_size",
+    "patch_match_stereo": "--PatchMatchStereo.max_image_size",
+    "stereo_fusion": "--StereoFusion.max_image_size",
+}
+
+# glog prefix of newer COLMAP builds, e.g. "I0101 12:00:00.123456 4242 file.cc:12] "
+GLOG_PREFIX = re.compile(r"^[IWEF]\d{4,8} [\d:.]+\s+\d+ [\w.\-]+:\d+\] ")
+ELAPSED = re.compile(r"Elapsed time:\s*([\d.]+)\s*\[(seconds|minutes)\]")
+PROGRESS = re.compile(r"\[(\d+)/(\d+)\]")
+REGISTERING = re.compile(r"Registering image #\d+ \((\d+)\)")
+
+
+class ColmapRunner:
+    def __init__(self, num_threads=None, use_gpu=False, max_image_size=None, log_dir=None):
+        """
+        Initialize COLMAP runner
+
+        Every command gets the same thread budget (the matching COLMAP
+        option plus OMP_NUM_THREADS for Ceres/OpenMP) and GPU setting, so
+        several reconstructions can share one machine without
+        oversubscribing it. Options already present in a command win.
+
+        Args:
+            num_threads: Threads per COLMAP call (None: COLMAP default, all cores)
+            use_gpu: Allow SIFT extraction/matching on the GPU
+            max_image_size: Optional image size cap for commands that take one
+            log_dir: Optional directory receiving one log file per call
+        """
+        self.num_threads = num_threads
+        self.use_gpu = use_gpu
+        self.max_image_size = max_image_size
+        self.log_dir = Path(log_dir) if log_dir else None
+        if self.log_dir is not None:
+            self.log_dir.mkdir(parents=True, exist_ok=True)
+
+        self.records = []
+
+    def build_command(self, cmd):
+        """Add the thread, GPU and image size options to a COLMAP command"""
+        cmd = [str(part) for part in cmd]
+        command = cmd[1]
+
+        def add(option, value):
+            if option is not None and option not in cmd:
+                cmd.extend([option, str(value)])
+
+        if self.num_threads is not None:
+            add(THREAD_OPTIONS.get(command), self.num_threads)
+        add(GPU_OPTIONS.get(command), 1 if self.use_gpu else 0)
+        if self.max_image_size is not None:
+            add(IMAGE_SIZE_OPTIONS.get(command), self.max_image_size)
+        return cmd
+
+    def run(self, cmd, stage=None):
+        """
+        Run a COLMAP command, streaming and parsing its output
+
+        Args:
+            cmd: [colmap_path, command, options...]
+            stage: Label for logs and the report (default: the command)
+
+        Returns:
+            Record dict with wall time, child CPU time, peak RSS and the
+            substage timings parsed from the log
+
+        Raises:
+            subprocess.CalledProcessError: When COLMAP exits non-zero
+        """
+        cmd = self.build_command(cmd)
+        command = cmd[1]
+        stage = stage or command
+
+        env = dict(os.environ)
+        if self.num_threads is not None:
+            env["OMP_NUM_THREADS"] = str(self.num_threads)
+
+        log_path = None
+        log_file = None
+        if self.log_dir is not None:
+            log_path = self.log_dir / f"{len(self.records):02d}_{stage}.log"
+            log_file = open(log_path, 'w')
+
+        logger.info(f"[{stage}] {' '.join(cmd)}")
+        parser = LogParser(stage)
+        tail = []
+        start_time = time.time()
+
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, bufsize=1, env=env)
+        try:
+            for line in proc.stdout:
+                if log_file is not None:
+                    log_file.write(line)
+                tail = (tail + [line.rstrip()])[-20:]
+                parser.feed(line, time.time() - start_time)
+        finally:
+            proc.stdout.close()
+            if log_file is not None:
+                log_file.close()
+            returncode, usage = wait_with_usage(proc)
+
+        wall = time.time() - start_time
+        record = {
+            "stage": stage,
+            "command": command,
+            "args": cmd[2:],
+            "returncode": returncode,
+            "wall_s": wall,
+            "substages": parser.finish(wall),
+            "log": str(log_path) if log_path else None,
+        }
+        if usage is not None:
+            record["cpu_user_s"] = usage.ru_utime
+            record["cpu_sys_s"] = usage.ru_stime
+            record["peak_rss_mb"] = max_rss_mb(usage.ru_maxrss)
+        self.records.append(record)
+
+        if usage is not None:
+            cpu = usage.ru_utime + usage.ru_stime
+            logger.info(f"[{stage}] {wall:.1f}s wall, {cpu:.1f}s CPU "
+                        f"({cpu / wall if wall > 0 else 0:.1f} cores), "
+                        f"peak RSS {record['peak_rss_mb']:.0f} MB")
+        else:
+            logger.info(f"[{stage}] {wall:.1f}s wall")
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, output="\n".join(tail))
+        return record
+
+    def summary(self):
+        """Totals over all calls"""
+        return {
+            "calls": len(self.records),
+            "wall_s": sum(r["wall_s"] for r in self.records),
+            "cpu_s": sum(r.get("cpu_user_s", 0) + r.get("cpu_sys_s", 0) for r in self.records),
+            "peak_rss_mb": max((r.get("peak_rss_mb", 0) for r in self.records), default=0),
+        }
+
+    def save_report(self, path):
+        """Write all call records and the summary as JSON"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({"summary": self.summary(), "runs": self.records}, f, indent=2)
+        return path
+
+
+class LogParser:
+    def __init__(self, stage):
+        """
+        Incremental parser for COLMAP console output
+
+        COLMAP announces substages with a title between two rules of '='
+        and closes them with "Elapsed time: X [minutes]"; progress shows
+        as "[i/n]" or, in the mapper, "Registering image #id (n)".
+        """
+        self.stage = stage
+        self.substages = []
+        self._lines = ["", ""]
+        self._last_logged = -1
+
+    def feed(self, line, now):
+        text = GLOG_PREFIX.sub("", line.strip())
+
+        if is_rule(text) and is_rule(self._lines[-2]) and self._lines[-1]:
+            self._start(self._lines[-1], now)
+        self._lines = [self._lines[-1], text]
+
+        match = ELAPSED.search(text)
+        if match and self.substages:
+            seconds = float(match.group(1)) * (60 if match.group(2) == "minutes" else 1)
+            self.substages[-1]["reported_s"] = seconds
+
+        match = PROGRESS.search(text)
+        if match:
+            self._progress(int(match.group(1)), int(match.group(2)))
+        match = REGISTERING.search(text)
+        if match:
+            logger.info(f"[{self.stage}] registered {match.group(1)} images")
+
+    def _start(self, name, now):
+        if self.substages and self.substages[-1]["end_s"] is None:
+            self.substages[-1]["end_s"] = now
+        self.substages.append({"name": name, "start_s": now, "end_s": None})
+        self._last_logged = -1
+        logger.info(f"[{self.stage}] {name}")
+
+    def _progress(self, done, total):
+        if total <= 0:
+            return
+        # Log every 10%
+        step = int(10 * done / total)
+        if step > self._last_logged:
+            self._last_logged = step
+            name = self.substages[-1]["name"] if self.substages else self.stage
+            logger.info(f"[{self.stage}] {name}: {done}/{total}")
+
+    def finish(self, now):
+        if self.substages and self.substages[-1]["end_s"] is None:
+            self.substages[-1]["end_s"] = now
+        for substage in self.substages:
+            substage["elapsed_s"] = substage["end_s"] - substage["start_s"]
+        return self.substages
+
+
+def is_rule(text):
+    return len(text) >= 10 and set(text) == {"="}
+
+
+def wait_with_usage(proc):
+    """Wait for a child, returning (returncode, rusage or None)"""
+    if not hasattr(os, "wait4"):
+        return proc.wait(), None
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, usage
+
+
+def max_rss_mb(ru_maxrss):
+    """ru_maxrss is in kilobytes on Linux and bytes on macOS"""
+    return ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else ru_maxrss / 1024
+
+
+def main():
+    """Example usage"""
+    runner = ColmapRunner(num_threads=2, log_dir="output/logs")
+    runner.run([
+        "colmap", "feature_extractor",
+        "--database_path", "output/sparse/database.db",
+        "--image_path", "data/input_images"
+    ])
+    runner.save_report("output/colmap_runs.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,473 @@
+"""
+CPU Dense Stereo
+Computes COLMAP-compatible depth and normal maps with rectified multi-scale SGBM, without CUDA
+"""
+
+import argparse
+import json
+import os
+import warnings
+import numpy as np
+import cv2
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import logging
+import time
+from src.colmap_io import ColmapModel, id_rows
+from src.depth_maps import map_paths, read_array, write_array
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Continuous pixel coordinates (centres at +0.5) <-> OpenCV's (centres at 0)
+TO_OPENCV = np.array([[1, 0, -0.5], [0, 1, -0.5], [0, 0, 1]])
+FROM_OPENCV = np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]])
+
+
+class CPUStereo:
+    def __init__(self, workspace_dir, num_sources=4, max_image_size=1600, levels=2,
+                 block_size=5, max_disparities=256, min_triangulation_angle=3.0,
+                 max_triangulation_angle=30.0, min_consistent=2, max_reproj_error=1.0,
+                 max_depth_error=0.01):
+        """
+        Initialize CPU stereo
+
+        Works on the workspace written by COLMAP's image_undistorter
+        (images/, sparse/ with PINHOLE cameras, stereo/). Each reference
+        view is rectified against its source views and matched with
+        OpenCV's semi-global block matcher, coarse to fine; the per-source
+        depths are merged into a photometric map, which is then checked
+        against the neighbours' maps into a geometric map, as COLMAP's
+        patch_match_stereo does with geom_consistency.
+
+        Args:
+            workspace_dir: Undistorted workspace (e.g. output/dense)
+            num_sources: Source views matched per reference view
+            max_image_size: Largest depth map dimension
+            levels: Pyramid levels; coarse levels narrow the disparity
+                search range of the finer ones
+            block_size: SGBM matching block size
+            max_disparities: Largest disparity search range per level
+            min_triangulation_angle: Smallest source view angle (degrees)
+            max_triangulation_angle: Largest source view angle (degrees)
+            min_consistent: Source views that must agree for a pixel to
+                enter the geometric map
+            max_reproj_error: Forward-backward reprojection error (pixels)
+                of the geometric check
+            max_depth_error: Relative depth difference of the geometric check
+        """
+        self.workspace_dir = Path(workspace_dir)
+        self.stereo_dir = self.workspace_dir / "stereo"
+        self.num_sources = num_sources
+        self.max_image_size = max_image_size
+        self.levels = max(1, levels)
+        self.block_size = block_size
+        self.max_disparities = max_disparities
+        self.min_triangulation_angle = min_triangulation_angle
+        self.max_triangulation_angle = max_triangulation_angle
+        self.min_consistent = min_consistent
+        self.max_reproj_error = max_reproj_error
+        self.max_depth_error = max_depth_error
+
+        self.model = ColmapModel.read(self.workspace_dir / "sparse")
+        for folder in ("depth_maps", "normal_maps"):
+            (self.stereo_dir / folder).mkdir(parents=True, exist_ok=True)
+
+    def views(self):
+        """Per image the camera at depth-map resolution (see pinhole_views)"""
+        return pinhole_views(self.model, self.max_image_size)
+
+    def select_sources(self):
+        """Source image indices per image (see covisible_views)"""
+        return covisible_views(self.model, self.num_sources, self.min_triangulation_angle,
+                               self.max_triangulation_angle)
+
+    def run(self, workers=None):
+        """
+        Compute photometric then geometric depth and normal maps for every
+        image, reference views in parallel
+
+        Args:
+            workers: Worker processes (default: all CPUs)
+
+        Returns:
+            Report dict (also saved as stereo/cpu_stereo.json)
+        """
+        start_time = time.time()
+        workers = workers or os.cpu_count() or 1
+        views = self.views()
+        sources = self.select_sources()
+        settings = {
+            "levels": self.levels, "block_size": self.block_size,
+            "max_disparities": self.max_disparities, "min_consistent": self.min_consistent,
+            "max_reproj_error": self.max_reproj_error, "max_depth_error": self.max_depth_error,
+        }
+
+        # Views without sources or sparse points get no depth map
+        references = [i for i, view in enumerate(views)
+                      if sources[i] and view["depth_range"] is not None]
+
+        results = {}
+        for kind in ("photometric", "geometric"):
+            stage_start = time.time()
+            jobs = [(self.workspace_dir, views[i], [views[j] for j in sources[i]], settings, kind)
+                    for i in references]
+            if workers <= 1 or len(jobs) <= 1:
+                entries = [_stereo_job(*job) for job in jobs]
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    entries = list(executor.map(_stereo_job, *zip(*jobs)))
+            for entry in entries:
+                results.setdefault(entry["name"], {})[kind] = entry["valid_ratio"]
+            logger.info(f"{kind.capitalize()} depth maps: {len(entries)} views in "
+                        f"{time.time() - stage_start:.1f}s")
+
+        report = {
+            "num_images": len(views),
+            "num_depth_maps": len(results),
+            "skipped": [view["name"] for view in views if view["name"] not in results],
+            "elapsed_s": time.time() - start_time,
+            "views": [
+                {"name": view["name"], "sources": [views[j]["name"] for j in sources[i]],
+                 "valid_ratio": results.get(view["name"], {})}
+                for i, view in enumerate(views)
+            ],
+        }
+        with open(self.stereo_dir / "cpu_stereo.json", 'w') as f:
+            json.dump(report, f, indent=2)
+        if report["skipped"]:
+            logger.warning(f"No depth map for {len(report['skipped'])} images without "
+                           f"usable source views: {', '.join(report['skipped'])}")
+        logger.info(f"CPU stereo complete: {len(results)} depth maps in {report['elapsed_s']:.1f}s")
+        return report
+
+
+def pinhole_views(model, max_image_size=None):
+    """
+    Per image of an undistorted model its camera, scaled so the larger
+    side is at most max_image_size, and the depth range of its sparse points
+
+    Returns:
+        List of dicts with name, K, R, t, width, height, depth_range
+        (None with fewer than 10 points)
+    """
+    camera_row = {int(c): i for i, c in enumerate(model.cameras["camera_id"])}
+    R = model.rotations()
+
+    views = []
+    for i, name in enumerate(model.names):
+        camera = camera_row[int(model.images["camera_id"][i])]
+        model_name, params = model.camera_model(camera)
+        if model_name not in ("PINHOLE", "SIMPLE_PINHOLE"):
+            raise ValueError(f"{name}: {model_name} camera, run image_undistorter first")
+        fx, fy, cx, cy = params if model_name == "PINHOLE" else params[[0, 0, 1, 2]]
+        width, height = int(model.cameras["width"][camera]), int(model.cameras["height"][camera])
+
+        scale = min(1.0, max_image_size / max(width, height)) if max_image_size else 1.0
+        map_width, map_height = int(round(width * scale)), int(round(height * scale))
+        sx, sy = map_width / width, map_height / height
+        K = np.array([[fx * sx, 0, cx * sx], [0, fy * sy, cy * sy], [0, 0, 1]])
+
+        ids = model.image_points(i)["point3D_id"]
+        rows = id_rows(model.points3D["point3D_id"], ids[ids != -1])
+        depths = (model.points3D["xyz"][rows[rows >= 0]] @ R[i].T + model.images["tvec"][i])[:, 2]
+        depths = depths[depths > 0]
+        depth_range = ((float(np.percentile(depths, 1)) * 0.8, float(np.percentile(depths, 99)) * 1.25)
+                       if len(depths) >= 10 else None)
+
+        views.append({"name": name, "K": K, "R": R[i], "t": model.images["tvec"][i],
+                      "width": map_width, "height": map_height,
+                      "depth_range": depth_range})
+    return views
+
+
+def covisible_views(model, count, min_angle=0.0, max_angle=180.0):
+    """
+    Per image the count images sharing the most sparse points with it,
+    among those seeing its points under a triangulation angle between
+    min_angle and max_angle (degrees)
+
+    Returns:
+        List of image indices per image
+    """
+    num_images = len(model.names)
+    image_row = id_rows(model.images["image_id"], model.tracks["image_id"])
+    point_row = np.repeat(np.arange(len(model.points3D)), np.diff(model.track_offsets))
+    visibility = sparse.csr_matrix(
+        (np.ones(len(image_row)), (image_row, point_row)),
+        shape=(num_images, len(model.points3D))
+    )
+    visibility.data[:] = 1
+    shared = (visibility @ visibility.T).toarray()
+    np.fill_diagonal(shared, 0)
+
+    centers = model.camera_centers()
+    neighbours = []
+    for i in range(num_images):
+        seen = visibility[i].indices
+        if not len(seen):
+            neighbours.append([])
+            continue
+        anchor = np.median(model.points3D["xyz"][seen], axis=0)
+        rays = centers - anchor
+        rays /= np.linalg.norm(rays, axis=1, keepdims=True)
+        angles = np.degrees(np.arccos(np.clip(rays @ rays[i], -1, 1)))
+        usable = (shared[i] > 0) & (angles >= min_angle) & (angles <= max_angle)
+        candidates = np.flatnonzero(usable)
+        order = np.argsort(-shared[i, candidates], kind="stable")
+        neighbours.append(candidates[order[:count]].tolist())
+    return neighbours
+
+
+def load_view_image(workspace_dir, view):
+    """Undistorted image of a view at its depth-map resolution"""
+    path = Path(workspace_dir) / "images" / view["name"]
+    img = cv2.imread(str(path))
+    if img is None:
+        raise IOError(f"Could not read image: {path}")
+    if img.shape[:2] != (view["height"], view["width"]):
+        img = cv2.resize(img, (view["width"], view["height"]), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def rectify_pair(ref, src):
+    """
+    Rectifying rotation shared by a reference and a source view
+
+    The rectified x axis runs along the baseline from the reference to the
+    source, so the reference is always the left image of the pair.
+
+    Returns:
+        (K_rect, R_rect world-to-rectified, baseline, homographies
+        reference -> rectified and source -> rectified in pixels), or None
+        when the baseline runs along the viewing direction
+    """
+    c_ref = -ref["R"].T @ ref["t"]
+    c_src = -src["R"].T @ src["t"]
+    baseline = c_src - c_ref
+    length = np.linalg.norm(baseline)
+    x = baseline / length
+    if abs(x @ ref["R"][2]) > 0.7:
+        return None
+    y = np.cross(ref["R"][2], x)
+    y /= np.linalg.norm(y)
+    R_rect = np.stack([x, y, np.cross(x, y)])
+
+    # Centre the reference image's footprint in the rectified frame
+    width, height = ref["width"], ref["height"]
+    corners = np.array([[0, 0, 1], [width, 0, 1], [0, height, 1], [width, height, 1]], float)
+    rays = R_rect @ ref["R"].T @ np.linalg.solve(ref["K"], corners.T)
+    if (rays[2] <= 0).any():
+        return None
+    xy = rays[:2] / rays[2]
+    f = (ref["K"][0, 0] + ref["K"][1, 1]) / 2
+    K_rect = np.array([
+        [f, 0, width / 2 - f * (xy[0].min() + xy[0].max()) / 2],
+        [0, f, height / 2 - f * (xy[1].min() + xy[1].max()) / 2],
+        [0, 0, 1],
+    ])
+    H_ref = K_rect @ R_rect @ ref["R"].T @ np.linalg.inv(ref["K"])
+    H_src = K_rect @ R_rect @ src["R"].T @ np.linalg.inv(src["K"])
+    return K_rect, R_rect, length, H_ref, H_src
+
+
+def pair_depth(ref_img, src_img, ref, src, settings):
+    """
+    Depth of every reference pixel seen by a source view (NaN elsewhere)
+
+    The pair is matched on a pyramid: the coarsest level searches the
+    disparities of the reference's sparse depth range, every finer level
+    only the range the previous level found (plus a margin).
+
+    Wide baselines give disparities of a large part of the image, so the
+    rectified source is shifted right by the smallest expected disparity:
+    its content stays on the reference-sized canvas and the search starts
+    near zero. The shift is added back before converting to depth.
+    """
+    rectified = rectify_pair(ref, src)
+    if rectified is None:
+        return None
+    K_rect, R_rect, length, H_ref, H_src = rectified
+    width, height = ref["width"], ref["height"]
+    f = K_rect[0, 0]
+    near, far = ref["depth_range"]
+    low, high = f * length / far, f * length / near
+    if high - low > width:
+        return None  # The disparity range does not fit the canvas
+    offset = np.floor(low)
+    H_src = np.array([[1, 0, offset], [0, 1, 0], [0, 0, 1]]) @ H_src
+
+    disparity = None
+    for level in reversed(range(settings["levels"])):
+        scale = 0.5 ** level
+        S = np.diag([scale, scale, 1.0])
+        size = (max(16, int(round(width * scale))), max(16, int(round(height * scale))))
+        left = cv2.warpPerspective(ref_img, TO_OPENCV @ S @ H_ref @ FROM_OPENCV, size)
+        right = cv2.warpPerspective(src_img, TO_OPENCV @ S @ H_src @ FROM_OPENCV, size)
+
+        min_disp = int(np.floor((low - offset) * scale))
+        num_disp = int(np.ceil((high - low) * scale)) + 1
+        num_disp = min(settings["max_disparities"], max(16, -(-num_disp // 16) * 16))
+        block = settings["block_size"]
+        matcher = cv2.StereoSGBM_create(
+            minDisparity=min_disp, numDisparities=num_disp, blockSize=block,
+            P1=8 * 3 * block ** 2, P2=32 * 3 * block ** 2, disp12MaxDiff=1,
+            uniquenessRatio=10, speckleWindowSize=100, speckleRange=2,
+            mode=cv2.STEREO_SGBM_MODE_SGBM_3WAY
+        )
+        raw = matcher.compute(left, right).astype(np.float32) / 16
+        disparity = np.where(raw >= min_disp, raw / scale + offset, np.nan)
+        valid = disparity > 0.5
+
+        # Narrow the next level's search to what this level found
+        if level and valid.sum() > 100:
+            found = np.percentile(disparity[valid], [1, 99])
+            margin = 2 / scale + 0.1 * (found[1] - found[0])
+            low = max(low, found[0] - margin)
+            high = min(high, found[1] + margin)
+
+    # Sample the rectified disparity along every reference pixel's ray
+    u, v = np.meshgrid(np.arange(width) + 0.5, np.arange(height) + 0.5)
+    rays = np.stack([u, v, np.ones_like(u)], axis=-1) @ H_ref.T
+    q = rays[..., :2] / rays[..., 2:]
+    sampled = cv2.remap(disparity, (q[..., 0] - 0.5).astype(np.float32),
+                        (q[..., 1] - 0.5).astype(np.float32), cv2.INTER_NEAREST,
+                        borderMode=cv2.BORDER_CONSTANT, borderValue=np.nan)
+    z_rect = f * length / sampled
+    # Rectified depth -> reference depth along the same ray
+    direction = (np.stack([q[..., 0], q[..., 1], np.ones_like(u)], axis=-1)
+                 @ np.linalg.inv(K_rect).T @ R_rect @ ref["R"].T)
+    depth = z_rect * direction[..., 2]
+    depth[(depth < near) | (depth > far)] = np.nan
+    return depth
+
+
+def backproject(depth, view):
+    """Camera-frame points (H x W x 3) of a depth map"""
+    height, width = depth.shape
+    K = view["K"]
+    u, v = np.meshgrid(np.arange(width) + 0.5, np.arange(height) + 0.5)
+    return np.stack([(u - K[0, 2]) / K[0, 0] * depth, (v - K[1, 2]) / K[1, 1] * depth, depth],
+                    axis=-1)
+
+
+def normals_from_depth(depth, view):
+    """
+    Camera-frame unit normals facing the camera (H x W x 3, zero where
+    the depth or a neighbour is invalid); depth is H x W with 0 as invalid
+    """
+    valid = depth > 0
+    points = backproject(cv2.medianBlur(depth.astype(np.float32), 5), view)
+    du = np.zeros_like(points)
+    dv = np.zeros_like(points)
+    du[:, 1:-1] = points[:, 2:] - points[:, :-2]
+    dv[1:-1] = points[2:] - points[:-2]
+    normals = np.cross(du, dv)
+    normals /= np.maximum(np.linalg.norm(normals, axis=-1, keepdims=True), 1e-12)
+    flip = (normals * points).sum(axis=-1) > 0
+    normals[flip] *= -1
+    keep = cv2.erode(valid.astype(np.uint8), np.ones((3, 3), np.uint8)) > 0
+    normals[~keep] = 0
+    return normals.astype(np.float32)
+
+
+def geometric_filter(depth, ref, sources, source_depths, settings):
+    """
+    Keep reference depths that at least min_consistent source depth maps
+    reproduce (forward-backward reprojection and relative depth checks)
+    """
+    valid = np.isfinite(depth) & (depth > 0)
+    rows, cols = np.nonzero(valid)
+    points = backproject(np.where(valid, depth, 0), ref)[rows, cols]
+    world = (points - ref["t"]) @ ref["R"]
+    pixels = np.stack([cols + 0.5, rows + 0.5], axis=1)
+
+    consistent = np.zeros(len(rows), dtype=np.int64)
+    for src, src_depth in zip(sources, source_depths):
+        cam = world @ src["R"].T + src["t"]
+        z = cam[:, 2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = src["K"][0, 0] * cam[:, 0] / z + src["K"][0, 2]
+            v = src["K"][1, 1] * cam[:, 1] / z + src["K"][1, 2]
+        height, width = src_depth.shape
+        inside = (z > 0) & (u >= 0) & (u < width) & (v >= 0) & (v < height)
+        col = np.clip(np.floor(np.nan_to_num(u)).astype(np.int64), 0, width - 1)
+        row = np.clip(np.floor(np.nan_to_num(v)).astype(np.int64), 0, height - 1)
+        d = src_depth[row, col]
+        inside &= d > 0
+
+        # The source pixel's own 3D point, projected back into the reference
+        back = np.stack([(col + 0.5 - src["K"][0, 2]) / src["K"][0, 0] * d,
+                         (row + 0.5 - src["K"][1, 2]) / src["K"][1, 1] * d, d], axis=1)
+        back = ((back - src["t"]) @ src["R"]) @ ref["R"].T + ref["t"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            reprojected = back[:, :2] / back[:, 2:] * [ref["K"][0, 0], ref["K"][1, 1]] + ref["K"][:2, 2]
+            error = np.linalg.norm(reprojected - pixels, axis=1)
+            depth_error = np.abs(d - z) / z
+        consistent += (inside & (error < settings["max_reproj_error"])
+                       & (depth_error < settings["max_depth_error"]))
+
+    needed = min(settings["min_consistent"], len(sources))
+    filtered = np.zeros_like(depth, dtype=np.float32)
+    keep = consistent >= needed
+    filtered[rows[keep], cols[keep]] = depth[rows[keep], cols[keep]]
+    return filtered
+
+
+def _stereo_job(workspace_dir, ref, sources, settings, kind):
+    """Process-pool entry point: one reference view's photometric or geometric maps"""
+    cv2.setNumThreads(1)  # The pool provides the parallelism
+    start_time = time.time()
+    stereo_dir = Path(workspace_dir) / "stereo"
+    depth_path, normal_path = map_paths(stereo_dir, ref["name"], kind)
+
+    if kind == "photometric":
+        ref_img = load_view_image(workspace_dir, ref)
+        depths = []
+        for src in sources:
+            depth = pair_depth(ref_img, load_view_image(workspace_dir, src), ref, src, settings)
+            if depth is not None:
+                depths.append(depth)
+        if depths:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)  # Pixels no source sees
+                depth = np.nanmedian(np.stack(depths), axis=0)
+        else:
+            depth = np.full((ref["height"], ref["width"]), np.nan)
+        depth = np.nan_to_num(depth, nan=0.0).astype(np.float32)
+    else:
+        # Memory-mapped: only the source pixels the reference projects to are read
+        photometric = read_array(map_paths(stereo_dir, ref["name"], "photometric")[0], mmap=True)
+        source_depths = []
+        for src in sources:
+            path = map_paths(stereo_dir, src["name"], "photometric")[0]
+            source_depths.append(read_array(path, mmap=True) if path.exists()
+                                 else np.zeros((src["height"], src["width"]), np.float32))
+        depth = geometric_filter(photometric, ref, sources, source_depths, settings)
+
+    write_array(depth_path, depth)
+    write_array(normal_path, normals_from_depth(depth, ref))
+    valid_ratio = float((depth > 0).mean())
+    logger.info(f"{kind.capitalize()} depth {ref['name']}: {valid_ratio:.1%} valid "
+                f"({time.time() - start_time:.1f}s)")
+    return {"name": ref["name"], "valid_ratio": valid_ratio}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU dense stereo on an undistorted COLMAP workspace")
+    parser.add_argument("workspace", nargs="?", default="output/dense",
+                        help="Workspace written by image_undistorter (default: output/dense)")
+    parser.add_argument("--num-sources", type=int, default=4)
+    parser.add_argument("--max-image-size", type=int, default=1600)
+    parser.add_argument("--levels", type=int, default=2)
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all CPUs)")
+    args = parser.parse_args()
+
+    stereo = CPUStereo(args.workspace, num_sources=args.num_sources,
+                       max_image_size=args.max_image_size, levels=args.levels)
+    stereo.run(workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
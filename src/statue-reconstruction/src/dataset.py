@@ -0,0 +1,187 @@
+"""
+Image Dataset Index
+Lazily lists input images and caches header-only metadata and EXIF focal priors
+"""
+
+from PIL import Image
+from pathlib import Path
+import json
+import logging
+import re
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+# EXIF tags read from the header
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_EXIF_IFD = 0x8769
+TAG_FOCAL_LENGTH = 0x920A
+TAG_FOCAL_35MM = 0xA405
+TAG_FOCAL_PLANE_X_RES = 0xA20E
+TAG_FOCAL_PLANE_UNIT = 0xA210
+
+# FocalPlaneResolutionUnit -> millimetres per unit
+FOCAL_PLANE_UNITS_MM = {2: 25.4, 3: 10.0, 4: 1.0, 5: 0.001}
+
+
+class ImageDataset:
+    def __init__(self, image_dir, index_path=None):
+        """
+        Initialize image dataset
+
+        Nothing is read until it is needed: the directory is listed on the
+        first call to paths() and each header is parsed on the first
+        metadata() call for that image. Metadata is cached in index_path
+        (keyed on file size and mtime) so later runs skip header parsing.
+
+        Args:
+            image_dir: Directory containing input images
+            index_path: Optional JSON file for the metadata cache
+        """
+        self.image_dir = Path(image_dir)
+        self.index_path = Path(index_path) if index_path else None
+
+        self._paths = None
+        self._index = None
+        self._dirty = False
+
+    def paths(self):
+        """Images (.jpg/.jpeg/.png, any case) in natural name order"""
+        if self._paths is None:
+            self._paths = sorted(
+                (p for p in self.image_dir.iterdir()
+                 if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS),
+                key=natural_key
+            )
+        return self._paths
+
+    def names(self):
+        return [p.name for p in self.paths()]
+
+    def __len__(self):
+        return len(self.paths())
+
+    def __iter__(self):
+        return iter(self.paths())
+
+    def metadata(self, img_path):
+        """
+        Header-only metadata for an image
+
+        Returns:
+            Dict with width, height (as stored, before EXIF orientation),
+            orientation, make, model, focal_mm, focal_35mm and focal_px
+            (None when the EXIF gives no way to compute it)
+        """
+        img_path = Path(img_path)
+        index = self._load_index()
+        stat = img_path.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+
+        entry = index.get(img_path.name)
+        if entry is None or entry["stamp"] != stamp:
+            entry = read_header(img_path)
+            entry["stamp"] = stamp
+            index[img_path.name] = entry
+            self._dirty = True
+        return entry
+
+    def all_metadata(self):
+        """Metadata for every image, saving the index if anything was parsed"""
+        metadata = {p.name: self.metadata(p) for p in self.paths()}
+        self.save()
+        return metadata
+
+    def camera_groups(self):
+        """
+        Group images that share a camera (make, model, size, focal length)
+
+        Returns:
+            List of dicts with names, width, height and focal_px (None for
+            images without an EXIF focal prior), largest groups first
+        """
+        groups = {}
+        for name, meta in self.all_metadata().items():
+            focal = round(meta["focal_px"], 1) if meta["focal_px"] else None
+            key = (meta["make"], meta["model"], meta["width"], meta["height"], focal)
+            groups.setdefault(key, []).append(name)
+
+        result = [
+            {"make": make, "model": model, "width": w, "height": h,
+             "focal_px": focal, "names": names}
+            for (make, model, w, h, focal), names in groups.items()
+        ]
+        return sorted(result, key=lambda group: -len(group["names"]))
+
+    def save(self):
+        """Write the metadata index if it changed"""
+        if self.index_path is None or not self._dirty:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.index_path, 'w') as f:
+            json.dump(self._index, f, indent=1)
+        self._dirty = False
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            if self.index_path is not None and self.index_path.exists():
+                with open(self.index_path) as f:
+                    self._index = json.load(f)
+        return self._index
+
+
+def natural_key(path):
+    """Sort key ordering 2.jpg before 10.jpg"""
+    return [int(part) if part.isdigit() else part.lower()
+            for part in re.split(r"(\d+)", Path(path).name)]
+
+
+def read_header(img_path):
+    """Parse size and EXIF camera data without decoding pixels"""
+    with Image.open(img_path) as img:
+        width, height = img.size
+        exif = img.getexif()
+        exif_ifd = exif.get_ifd(TAG_EXIF_IFD) if exif else {}
+
+    def number(value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError, ZeroDivisionError):
+            return None
+        return value if value > 0 else None
+
+    entry = {
+        "width": width,
+        "height": height,
+        "orientation": int(exif.get(TAG_ORIENTATION, 1)) if exif else 1,
+        "make": str(exif.get(TAG_MAKE, "")).strip("\x00 ") if exif else "",
+        "model": str(exif.get(TAG_MODEL, "")).strip("\x00 ") if exif else "",
+        "focal_mm": number(exif_ifd.get(TAG_FOCAL_LENGTH)),
+        "focal_35mm": number(exif_ifd.get(TAG_FOCAL_35MM)),
+    }
+
+    plane_res = number(exif_ifd.get(TAG_FOCAL_PLANE_X_RES))
+    plane_unit = FOCAL_PLANE_UNITS_MM.get(exif_ifd.get(TAG_FOCAL_PLANE_UNIT, 2))
+    entry["focal_px"] = focal_from_exif(
+        width, height, entry["focal_mm"], entry["focal_35mm"], plane_res, plane_unit
+    )
+    return entry
+
+
+def focal_from_exif(width, height, focal_mm, focal_35mm, plane_res=None, plane_unit_mm=None):
+    """
+    Focal length in pixels from EXIF
+
+    Prefers the 35 mm equivalent (36 mm wide frame), then the focal plane
+    resolution (pixels per unit on the sensor).
+    """
+    if focal_35mm:
+        return focal_35mm / 36.0 * max(width, height)
+    if focal_mm and plane_res and plane_unit_mm:
+        return focal_mm * plane_res / plane_unit_mm
+    return None
@@ -0,0 +1,329 @@
+"""
+Streaming Depth Map Fusion
+Fuses dense/stereo depth maps into a point cloud one view at a time through a sparse voxel map
+"""
+
+import argparse
+from collections import OrderedDict
+import numpy as np
+from pathlib import Path
+import logging
+import time
+from src.colmap_io import ColmapModel
+from src.cpu_stereo import backproject, covisible_views, load_view_image, pinhole_views
+from src.depth_maps import DepthMapStore
+from src.pointcloud_io import write_ply
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Voxel coordinates are packed into one int64 key, 21 bits per axis
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+
+
+class VoxelMap:
+    def __init__(self, voxel_size):
+        """
+        Sparse voxel map accumulating points, normals and colours
+
+        Occupied voxels are kept as sorted packed keys with per-voxel sums
+        and counts, so memory grows with the occupied voxels only. A batch
+        updates the voxels it shares with them through one searchsorted;
+        its new voxels wait in a pending list that is merged (one sort)
+        once it outgrows the sorted arrays, so each voxel is re-sorted a
+        bounded number of times rather than once per batch. Each voxel's
+        point, normal and colour are the running means of everything
+        added to it.
+
+        Args:
+            voxel_size: Voxel edge length in scene units
+        """
+        self.voxel_size = voxel_size
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int32)
+        self.xyz = np.zeros((0, 3), dtype=np.float64)
+        self.normals = np.zeros((0, 3), dtype=np.float32)
+        self.colors = np.zeros((0, 3), dtype=np.float32)
+        # Batches of (keys, counts, xyz, normal and colour sums) not yet merged
+        self._pending = []
+        self._pending_rows = 0
+
+    def __len__(self):
+        self._merge()
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        arrays = [self.keys, *self._arrays()] + [a for batch in self._pending for a in batch]
+        return sum(a.nbytes for a in arrays)
+
+    def add(self, points, normals, colors):
+        """Accumulate points (N x 3) with their normals and RGB colours into their voxels"""
+        if not len(points):
+            return
+        keys = voxel_keys(points, self.voxel_size)
+        batch_keys, inverse = np.unique(keys, return_inverse=True)
+
+        def sums(values):
+            return np.stack([np.bincount(inverse, weights=column, minlength=len(batch_keys))
+                             for column in np.asarray(values, dtype=np.float64).T], axis=1)
+
+        batch = (np.bincount(inverse, minlength=len(batch_keys)),
+                 sums(points), sums(normals), sums(colors))
+
+        position = np.searchsorted(self.keys, batch_keys)
+        found = np.zeros(len(batch_keys), dtype=bool)
+        inside = position < len(self.keys)
+        found[inside] = self.keys[position[inside]] == batch_keys[inside]
+
+        existing = position[found]
+        for array, values in zip(self._arrays(), batch):
+            array[existing] += values[found].astype(array.dtype)
+
+        new = ~found
+        if new.any():
+            self._pending.append((batch_keys[new], *(values[new] for values in batch)))
+            self._pending_rows += int(new.sum())
+        if self._pending_rows > len(self.keys):
+            self._merge()
+
+    def _arrays(self):
+        return self.counts, self.xyz, self.normals, self.colors
+
+    def _merge(self):
+        """Fold the pending batches into the sorted arrays"""
+        if not self._pending:
+            return
+        keys = np.concatenate([self.keys] + [batch[0] for batch in self._pending])
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+
+        def sums(array, column):
+            values = np.concatenate([array] + [batch[column] for batch in self._pending])
+            values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+            summed = np.stack([np.bincount(inverse, weights=v, minlength=len(self.keys))
+                               for v in values.T], axis=1)
+            return summed.reshape((len(self.keys),) + array.shape[1:]).astype(array.dtype)
+
+        self.counts, self.xyz, self.normals, self.colors = (
+            sums(array, column) for column, array in enumerate(self._arrays(), start=1))
+        self._pending = []
+        self._pending_rows = 0
+
+    def means(self):
+        """(points, unit normals, uint8 colours), one per occupied voxel"""
+        self._merge()
+        counts = np.maximum(self.counts, 1)[:, None]
+        normals = self.normals / np.maximum(np.linalg.norm(self.normals, axis=1, keepdims=True), 1e-12)
+        colors = np.clip(self.colors / counts + 0.5, 0, 255).astype(np.uint8)
+        return self.xyz / counts, normals, colors
+
+
+class DepthFusion:
+    def __init__(self, workspace_dir, input_type="geometric", voxel_size=None, min_views=3,
+                 num_neighbors=6, max_depth_error=0.01, max_normal_error=10.0):
+        """
+        Initialize depth map fusion
+
+        Depth maps are read one reference view at a time (plus a few
+        cached neighbours). Every valid pixel is back-projected, checked
+        against the depth (and normal) maps of the reference's most
+        covisible views and, if enough views agree, added to a VoxelMap.
+
+        Args:
+            workspace_dir: Workspace with images/, sparse/ and stereo/
+            input_type: 'geometric' or 'photometric' maps
+            voxel_size: Voxel edge length (default: the pixel footprint at
+                the median depth of the first depth map with valid pixels)
+            min_views: Views, including the reference, that must agree on
+                a pixel for it to be fused
+            num_neighbors: Views a pixel is checked against
+            max_depth_error: Relative depth difference of agreeing views
+            max_normal_error: Normal angle of agreeing views (degrees)
+        """
+        if input_type not in ("geometric", "photometric"):
+            raise ValueError(f"Unknown input type: {input_type}")
+
+        self.workspace_dir = Path(workspace_dir)
+        self.stereo_dir = self.workspace_dir / "stereo"
+        self.input_type = input_type
+        self.store = DepthMapStore(self.stereo_dir, input_type)
+        self.voxel_size = voxel_size
+        self.min_views = min_views
+        self.num_neighbors = num_neighbors
+        self.max_depth_error = max_depth_error
+        self.max_normal_cos = np.cos(np.radians(max_normal_error))
+
+        self.model = ColmapModel.read(self.workspace_dir / "sparse")
+        self.views = pinhole_views(self.model)
+        self._maps = OrderedDict()
+
+    def fused_images(self):
+        """Image indices to fuse: those listed in stereo/fusion.cfg, or all"""
+        index = {view["name"]: i for i, view in enumerate(self.views)}
+        config = self.stereo_dir / "fusion.cfg"
+        if not config.exists():
+            return list(range(len(self.views)))
+        with open(config) as f:
+            names = [line.strip() for line in f if line.strip()]
+        return [index[name] for name in names if name in index]
+
+    def maps(self, index):
+        """
+        (depth, normals, view scaled to the depth map) of an image, or None
+        without a depth map; the most recently used maps stay mapped
+        """
+        if index in self._maps:
+            self._maps.move_to_end(index)
+            return self._maps[index]
+
+        name = self.views[index]["name"]
+        entry = None
+        if name in self.store:
+            depth = self.store.depth(name)
+            entry = (depth, self.store.normals(name), scaled_view(self.views[index], *depth.shape[::-1]))
+
+        self._maps[index] = entry
+        while len(self._maps) > self.num_neighbors + 2:
+            self._maps.popitem(last=False)
+        return entry
+
+    def fuse_view(self, index, neighbors):
+        """
+        Agreeing points of one reference view
+
+        Returns:
+            (world points, world normals, RGB colours) of the pixels at
+            least min_views views agree on
+        """
+        depth, normals, ref = self.maps(index)
+        rows, cols = np.nonzero(depth > 0)
+        points = backproject(depth, ref)[rows, cols]
+        world = (points - ref["t"]) @ ref["R"]
+        world_normals = (normals[rows, cols] @ ref["R"] if normals is not None
+                         else np.zeros_like(world))
+
+        agree = np.ones(len(rows), dtype=np.int64)
+        for j in neighbors:
+            maps = self.maps(j)
+            if maps is None:
+                continue
+            src_depth, src_normals, src = maps
+            cam = world @ src["R"].T + src["t"]
+            z = cam[:, 2]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                u = src["K"][0, 0] * cam[:, 0] / z + src["K"][0, 2]
+                v = src["K"][1, 1] * cam[:, 1] / z + src["K"][1, 2]
+            height, width = src_depth.shape
+            inside = (z > 0) & (u >= 0) & (u < width) & (v >= 0) & (v < height)
+            col = np.clip(np.floor(np.nan_to_num(u)).astype(np.int64), 0, width - 1)
+            row = np.clip(np.floor(np.nan_to_num(v)).astype(np.int64), 0, height - 1)
+            d = src_depth[row, col]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                match = inside & (d > 0) & (np.abs(d - z) < self.max_depth_error * z)
+            if normals is not None and src_normals is not None:
+                src_world = src_normals[row, col] @ src["R"]
+                match &= (src_world * world_normals).sum(axis=1) > self.max_normal_cos
+            agree += match
+
+        keep = agree >= self.min_views
+        image = load_view_image(self.workspace_dir, ref)
+        colors = image[rows[keep], cols[keep], ::-1]
+        return world[keep], world_normals[keep], colors
+
+    def run(self, output_ply=None):
+        """
+        Fuse every depth map into a point cloud
+
+        Args:
+            output_ply: Output file (default: fused.ply in the workspace)
+
+        Returns:
+            Stats dict with the output path, point count and voxel map size
+        """
+        start_time = time.time()
+        output_ply = Path(output_ply) if output_ply else self.workspace_dir / "fused.ply"
+        neighbors = covisible_views(self.model, self.num_neighbors)
+
+        voxels = None
+        fused_views = 0
+        peak_bytes = 0
+        found_maps = False
+        for i in self.fused_images():
+            maps = self.maps(i)
+            if maps is None:
+                continue
+            found_maps = True
+            if not (maps[0] > 0).any():
+                logger.info(f"Skipped {self.views[i]['name']}: empty depth map")
+                continue
+            if voxels is None:
+                # The default size needs a map with valid pixels
+                voxels = VoxelMap(self.voxel_size or pixel_footprint(*maps[::2]))
+                logger.info(f"Voxel size: {voxels.voxel_size:.5f}")
+            points, normals, colors = self.fuse_view(i, neighbors[i])
+            voxels.add(points, normals, colors)
+            fused_views += 1
+            peak_bytes = max(peak_bytes, voxels.nbytes)
+            logger.info(f"Fused {self.views[i]['name']}: {len(points)} points")
+
+        if not found_maps:
+            raise IOError(f"No {self.input_type} depth maps in {self.stereo_dir}")
+        if voxels is None or len(voxels) == 0:
+            raise RuntimeError(f"No points fused from the {self.input_type} depth maps in "
+                               f"{self.stereo_dir} (empty maps or fewer than "
+                               f"{self.min_views} agreeing views)")
+
+        points, normals, colors = voxels.means()
+        write_ply(output_ply, points, normals=normals, colors=colors)
+        stats = {
+            "output": str(output_ply),
+            "num_views": fused_views,
+            "num_points": len(points),
+            "voxel_size": voxels.voxel_size,
+            "voxel_map_mb": peak_bytes / 1024**2,
+            "elapsed_s": time.time() - start_time,
+        }
+        logger.info(f"Fusion complete: {stats['num_points']} points from {fused_views} views "
+                    f"({stats['voxel_map_mb']:.1f} MB voxel map, {stats['elapsed_s']:.1f}s)")
+        return stats
+
+
+def voxel_keys(points, voxel_size):
+    """Packed int64 keys of the voxels containing points"""
+    coords = np.floor(np.asarray(points) / voxel_size).astype(np.int64) + KEY_OFFSET
+    if (coords < 0).any() or (coords >= 1 << KEY_BITS).any():
+        raise ValueError(f"Points span more than {1 << KEY_BITS} voxels of size "
+                         f"{voxel_size}; use a larger voxel size")
+    return (coords[:, 0] << (2 * KEY_BITS)) | (coords[:, 1] << KEY_BITS) | coords[:, 2]
+
+
+def scaled_view(view, width, height):
+    """A view with its intrinsics rescaled to a width x height map"""
+    sx, sy = width / view["width"], height / view["height"]
+    K = view["K"] * [[sx], [sy], [1]]
+    return {**view, "K": K, "width": width, "height": height}
+
+
+def pixel_footprint(depth, view):
+    """Size of one depth map pixel at its median valid depth"""
+    return float(np.median(depth[depth > 0]) / view["K"][0, 0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuse depth maps into a point cloud")
+    parser.add_argument("workspace", nargs="?", default="output/dense",
+                        help="Dense workspace (default: output/dense)")
+    parser.add_argument("--input-type", choices=["geometric", "photometric"], default="geometric")
+    parser.add_argument("--voxel-size", type=float, help="Voxel size (default: one pixel footprint)")
+    parser.add_argument("--min-views", type=int, default=3)
+    parser.add_argument("-o", "--output", help="Output PLY (default: <workspace>/fused.ply)")
+    args = parser.parse_args()
+
+    fusion = DepthFusion(args.workspace, input_type=args.input_type,
+                         voxel_size=args.voxel_size, min_views=args.min_views)
+    fusion.run(args.output)
+
+
+if __name__ == "__main__":
+    main()
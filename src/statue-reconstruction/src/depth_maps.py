@@ -0,0 +1,199 @@
+"""
+COLMAP Depth and Normal Maps
+Reads and writes the dense/stereo .bin maps as NumPy arrays
+"""
+
+import argparse
+import json
+import numpy as np
+from pathlib import Path
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DepthMapStore:
+    def __init__(self, stereo_dir, input_type="geometric"):
+        """
+        Lazy, memory-mapped access to the maps of a dense/stereo folder
+
+        Maps are opened on access and never copied, so only the pages a
+        caller touches are read and a whole workspace can be inspected
+        without fitting in RAM.
+
+        Args:
+            stereo_dir: Folder with depth_maps/ and normal_maps/
+            input_type: 'geometric' or 'photometric' maps
+        """
+        if input_type not in ("geometric", "photometric"):
+            raise ValueError(f"Unknown input type: {input_type}")
+
+        self.stereo_dir = Path(stereo_dir)
+        self.input_type = input_type
+
+    def names(self):
+        """Image names that have a depth map, sorted"""
+        suffix = f".{self.input_type}.bin"
+        return sorted(path.name[:-len(suffix)]
+                      for path in (self.stereo_dir / "depth_maps").glob(f"*{suffix}"))
+
+    def __len__(self):
+        return len(self.names())
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __contains__(self, name):
+        return map_paths(self.stereo_dir, name, self.input_type)[0].exists()
+
+    def depth(self, name):
+        """Read-only memory-mapped depth map (H x W) of an image"""
+        return read_array(map_paths(self.stereo_dir, name, self.input_type)[0], mmap=True)
+
+    def normals(self, name):
+        """Read-only memory-mapped normal map (H x W x 3), or None if missing"""
+        path = map_paths(self.stereo_dir, name, self.input_type)[1]
+        return read_array(path, mmap=True) if path.exists() else None
+
+    def write(self, name, depth, normals=None):
+        """Write an image's depth (and normal) map"""
+        depth_path, normal_path = map_paths(self.stereo_dir, name, self.input_type)
+        write_array(depth_path, depth)
+        if normals is not None:
+            write_array(normal_path, normals)
+
+    def view_stats(self, name):
+        """Size, valid-pixel ratio and depth range of one map"""
+        depth = self.depth(name)
+        valid = depth[depth > 0]
+        stats = {"name": name, "width": depth.shape[1], "height": depth.shape[0],
+                 "valid_ratio": len(valid) / depth.size}
+        if len(valid):
+            stats.update(min_depth=float(valid.min()), max_depth=float(valid.max()),
+                         median_depth=float(np.median(valid)))
+        return stats
+
+    def batch_stats(self, names=None, bins=64, depth_range=None):
+        """
+        Per-view statistics and a depth histogram over many maps
+
+        Maps are streamed one at a time. Without a depth_range, a first
+        pass finds the overall range.
+
+        Args:
+            names: Image names (default: all)
+            bins: Histogram bins
+            depth_range: (min, max) of the histogram
+
+        Returns:
+            Dict with per-view stats, the overall valid-pixel ratio and the
+            histogram counts and bin edges
+        """
+        names = self.names() if names is None else list(names)
+        views = [self.view_stats(name) for name in names]
+        ranged = [v for v in views if "min_depth" in v]
+        if depth_range is None:
+            depth_range = ((min(v["min_depth"] for v in ranged),
+                            max(v["max_depth"] for v in ranged)) if ranged else (0.0, 1.0))
+
+        counts = np.zeros(bins, dtype=np.int64)
+        for name in names:
+            depth = self.depth(name)
+            counts += np.histogram(depth[depth > 0], bins=bins, range=depth_range)[0]
+        edges = np.linspace(depth_range[0], depth_range[1], bins + 1)
+
+        pixels = sum(v["width"] * v["height"] for v in views)
+        valid = sum(v["valid_ratio"] * v["width"] * v["height"] for v in views)
+        return {
+            "input_type": self.input_type,
+            "num_views": len(views),
+            "valid_ratio": valid / pixels if pixels else 0.0,
+            "histogram": {"counts": counts.tolist(), "edges": edges.tolist()},
+            "views": views,
+        }
+
+
+def map_paths(stereo_dir, name, kind):
+    """(depth map path, normal map path) of an image for kind 'photometric' or 'geometric'"""
+    return (Path(stereo_dir) / "depth_maps" / f"{name}.{kind}.bin",
+            Path(stereo_dir) / "normal_maps" / f"{name}.{kind}.bin")
+
+
+def read_header(path):
+    """(width, height, channels, data offset) of a map file"""
+    with open(path, 'rb') as f:
+        header = b""
+        while header.count(b"&") < 3:
+            byte = f.read(1)
+            if not byte:
+                raise IOError(f"Truncated map header: {path}")
+            header += byte
+    width, height, channels = (int(v) for v in header.split(b"&")[:3])
+    return width, height, channels, len(header)
+
+
+def read_array(path, mmap=False):
+    """
+    Read a COLMAP depth (H x W) or normal (H x W x 3) map
+
+    The file is an ASCII header "width&height&channels&" followed by
+    float32 values stored channel by channel, each channel row by row.
+
+    Args:
+        path: Map file
+        mmap: Return a read-only view of a memory map instead of reading
+            the file into memory
+    """
+    width, height, channels, offset = read_header(path)
+    shape = (channels, height, width)
+    if mmap:
+        data = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=shape)
+    else:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = np.fromfile(f, dtype="<f4", count=width * height * channels)
+        if data.size < width * height * channels:
+            raise IOError(f"Truncated map data: {path}")
+        data = data.reshape(shape)
+    array = data.transpose(1, 2, 0)
+    return array[..., 0] if channels == 1 else array
+
+
+def write_array(path, array):
+    """Write a depth (H x W) or normal (H x W x C) map in COLMAP's format"""
+    array = np.asarray(array, dtype="<f4")
+    if array.ndim == 2:
+        array = array[..., None]
+    height, width, channels = array.shape
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(f"{width}&{height}&{channels}&".encode("ascii"))
+        f.write(np.ascontiguousarray(array.transpose(2, 0, 1)).tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the depth maps of a dense workspace")
+    parser.add_argument("stereo_dir", nargs="?", default="output/dense/stereo",
+                        help="Folder with depth_maps/ (default: output/dense/stereo)")
+    parser.add_argument("--input-type", choices=["geometric", "photometric"], default="geometric")
+    parser.add_argument("--bins", type=int, default=64)
+    parser.add_argument("-o", "--output", help="Write the full statistics as JSON")
+    args = parser.parse_args()
+
+    store = DepthMapStore(args.stereo_dir, args.input_type)
+    stats = store.batch_stats(bins=args.bins)
+    for view in stats["views"]:
+        logger.info(f"{view['name']}: {view['width']}x{view['height']}, "
+                    f"{view['valid_ratio']:.1%} valid")
+    logger.info(f"{stats['num_views']} {args.input_type} maps, "
+                f"{stats['valid_ratio']:.1%} valid pixels overall")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(stats, f, indent=2)
+        logger.info(f"Statistics saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
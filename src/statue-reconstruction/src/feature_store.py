@@ -0,0 +1,149 @@
+"""
+Persisted Feature Store
+Compact on-disk keypoints and descriptors, loadable without re-detection
+"""
+
+import cv2
+import numpy as np
+from pathlib import Path
+import json
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Keypoint columns: x, y, size, angle, response, octave
+KEYPOINT_COLUMNS = ("x", "y", "size", "angle", "response", "octave")
+
+
+class FeatureStore:
+    def __init__(self, store_dir):
+        """
+        Open a feature store written by FeatureStore.write
+
+        Layout: keypoints.npy (float32, N x 6), descriptors.npy (float32 for
+        SIFT, uint8 for ORB, N x D) and index.json holding the per-image
+        offsets. Both arrays are memory-mapped, so opening a store is cheap
+        and per-image access only touches that image's rows.
+
+        Args:
+            store_dir: Directory containing the store
+        """
+        self.store_dir = Path(store_dir)
+
+        with open(self.store_dir / "index.json") as f:
+            index = json.load(f)
+
+        self.method = index["method"]
+        self.names = index["names"]
+        self.offsets = np.asarray(index["offsets"], dtype=np.int64)
+        self._rows = {name: i for i, name in enumerate(self.names)}
+
+        self._keypoints = np.load(self.store_dir / "keypoints.npy", mmap_mode="r")
+        self._descriptors = np.load(self.store_dir / "descriptors.npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def _slice(self, name):
+        i = self._rows[name]
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def keypoints(self, name):
+        """Keypoint array (N x 6) for an image, as a view into the store"""
+        return self._keypoints[self._slice(name)]
+
+    def descriptors(self, name):
+        """Descriptor array (N x D) for an image, as a view into the store"""
+        return self._descriptors[self._slice(name)]
+
+    def cv_keypoints(self, name):
+        """Rebuild cv2.KeyPoint objects for drawing or OpenCV matchers"""
+        return array_to_keypoints(self.keypoints(name))
+
+    def counts(self):
+        """Number of features per image"""
+        return dict(zip(self.names, np.diff(self.offsets).tolist()))
+
+    def items(self):
+        """Yield (name, keypoints, descriptors) for every image"""
+        for name in self.names:
+            yield name, self.keypoints(name), self.descriptors(name)
+
+    @staticmethod
+    def write(store_dir, method, entries):
+        """
+        Write a feature store
+
+        Args:
+            store_dir: Output directory
+            method: Detector name ('SIFT' or 'ORB')
+            entries: Iterable of (image name, keypoint array, descriptors)
+
+        Returns:
+            Path to the store directory
+        """
+        store_dir = Path(store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+
+        entries = sorted(entries, key=lambda entry: entry[0])
+        dtype, dim = descriptor_layout(method)
+
+        names = [name for name, _, _ in entries]
+        counts = [len(kps) for _, kps, _ in entries]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        keypoints = np.zeros((offsets[-1], len(KEYPOINT_COLUMNS)), dtype=np.float32)
+        descriptors = np.zeros((offsets[-1], dim), dtype=dtype)
+        for i, (_, kps, desc) in enumerate(entries):
+            if counts[i] == 0:
+                continue
+            keypoints[offsets[i]:offsets[i + 1]] = kps
+            descriptors[offsets[i]:offsets[i + 1]] = desc
+
+        np.save(store_dir / "keypoints.npy", keypoints)
+        np.save(store_dir / "descriptors.npy", descriptors)
+        with open(store_dir / "index.json", 'w') as f:
+            json.dump({
+                "method": method,
+                "columns": list(KEYPOINT_COLUMNS),
+                "names": names,
+                "offsets": offsets.tolist(),
+            }, f)
+
+        size_mb = (keypoints.nbytes + descriptors.nbytes) / 1e6
+        logger.info(f"Feature store: {len(names)} images, {offsets[-1]} features, "
+                    f"{size_mb:.1f} MB -> {store_dir}")
+        return store_dir
+
+
+def descriptor_layout(method):
+    """Descriptor dtype and width for a detector"""
+    if method == 'SIFT':
+        return np.float32, 128
+    elif method == 'ORB':
+        return np.uint8, 32
+    raise ValueError(f"Unknown method: {method}")
+
+
+def keypoints_to_array(keypoints):
+    """Pack cv2.KeyPoint objects into a float32 (N x 6) array"""
+    if not keypoints:
+        return np.zeros((0, len(KEYPOINT_COLUMNS)), dtype=np.float32)
+    return np.array(
+        [(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave)
+         for kp in keypoints],
+        dtype=np.float32
+    )
+
+
+def array_to_keypoints(array):
+    """Unpack a keypoint array into cv2.KeyPoint objects"""
+    return [
+        cv2.KeyPoint(float(x), float(y), float(size), float(angle),
+                     float(response), int(octave))
+        for x, y, size, angle, response, octave in array
+    ]
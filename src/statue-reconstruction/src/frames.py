@@ -0,0 +1,270 @@
+"""
+Decoded Frame Store
+Decodes every input image once and shares the array across preprocessing stages
+"""
+
+import cv2
+from collections import OrderedDict
+import numpy as np
+from pathlib import Path
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from src.dataset import ImageDataset
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class FrameStore:
+    def __init__(self, image_dir, cache_dir=None, dataset=None, max_resident=8,
+                 max_cache_bytes=None):
+        """
+        Initialize frame store
+
+        Args:
+            image_dir: Directory containing input images
+            cache_dir: Optional directory for memory-mapped decoded frames.
+                Frames are written once as uint8 .npy files and mapped on
+                later runs (and by worker processes) instead of decoding JPEG
+            dataset: ImageDataset listing the images (default: a new one
+                over image_dir)
+            max_resident: Frames kept in memory; the least recently used
+                is dropped beyond this, so stages running one after another
+                share a frame only through cache_dir
+            max_cache_bytes: Optional size limit of cache_dir. Frames this
+                store has not used are evicted least recently used first;
+                once only its own frames are left, further frames are
+                decoded without being cached, so a capture larger than the
+                limit keeps a fixed cached prefix instead of thrashing
+        """
+        self.image_dir = Path(image_dir)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.dataset = dataset or ImageDataset(self.image_dir)
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.max_resident = max_resident
+        self._frames = OrderedDict()
+
+        self.max_cache_bytes = max_cache_bytes
+        self._cache_sizes = None
+        self._cache_used = set()
+
+        # Counters for the decode/map summary
+        self.num_decoded = 0
+        self.num_mapped = 0
+        self.num_evicted = 0
+        self.num_uncached = 0
+
+    def paths(self):
+        """Input images in the dataset's deterministic order"""
+        return self.dataset.paths()
+
+    def __len__(self):
+        return len(self.paths())
+
+    def __iter__(self):
+        """Yield (path, frame) pairs; frames are decoded on first access"""
+        for img_path in self.paths():
+            yield img_path, self.get(img_path)
+
+    def get(self, img_path):
+        """
+        Return the decoded BGR frame for an image
+
+        The same array is returned to every caller, so stages must treat it
+        as read-only (all OpenCV calls in the pipeline allocate new outputs).
+
+        Args:
+            img_path: Path of the input image
+        """
+        img_path = Path(img_path)
+        frame = self._frames.get(img_path)
+        if frame is not None:
+            self._frames.move_to_end(img_path)
+            return frame
+
+        if self.cache_dir is not None:
+            frame = self._load_mapped(img_path)
+        else:
+            frame = decode_image(img_path)
+            self.num_decoded += 1
+
+        self._frames[img_path] = frame
+        while len(self._frames) > self.max_resident:
+            self._frames.popitem(last=False)
+        return frame
+
+    def has_frame(self, img_path):
+        """Whether a frame is available without decoding (resident or mapped)"""
+        img_path = Path(img_path)
+        if img_path in self._frames:
+            return True
+        return self.cache_dir is not None and self.cache_path(img_path).exists()
+
+    def release(self, img_path=None):
+        """Drop in-memory frames (one image, or all when img_path is None)"""
+        if img_path is None:
+            self._frames.clear()
+        else:
+            self._frames.pop(Path(img_path), None)
+
+    def cache_path(self, img_path):
+        """Memory-map file for an image: its file name plus a key of its name, size and mtime"""
+        img_path = Path(img_path)
+        stat = img_path.stat()
+        key = hashlib.sha1(
+            f"{img_path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+        ).hexdigest()[:16]
+        return self.cache_dir / f"{img_path.name}.{key}.npy"
+
+    def _load_mapped(self, img_path):
+        """Map a cached frame, decoding and writing it first on a miss"""
+        cached = self.cache_path(img_path)
+
+        if not cached.exists():
+            frame = decode_image(img_path)
+            self.num_decoded += 1
+            if not self._make_room(frame.nbytes):
+                self.num_uncached += 1
+                return frame
+
+            # Write to a per-process temp file first so concurrent readers
+            # never map a partial frame and writers never share a name
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=".tmp-", suffix=".npy",
+                                             delete=False) as tmp:
+                np.save(tmp, np.ascontiguousarray(frame, dtype=np.uint8))
+            os.replace(tmp.name, cached)
+
+            # Remove stale entries left by older versions of the same image
+            stale = re.compile(re.escape(img_path.name) + r"\.[0-9a-f]{16}\.npy")
+            for old in self.cache_dir.iterdir():
+                if old != cached and stale.fullmatch(old.name):
+                    old.unlink(missing_ok=True)
+                    if self._cache_sizes is not None:
+                        self._cache_sizes.pop(old, None)
+            if self._cache_sizes is not None:
+                self._cache_sizes[cached] = cached.stat().st_size
+        elif self.max_cache_bytes is not None:
+            # The file mtime records the last use for eviction
+            os.utime(cached)
+
+        self._cache_used.add(cached)
+        self.num_mapped += 1
+        # Copy-on-write mapping: pages stay shared until someone writes
+        return np.load(cached, mmap_mode="c")
+
+    def _make_room(self, nbytes):
+        """Evict unused frames until nbytes more fit in max_cache_bytes"""
+        if self.max_cache_bytes is None:
+            return True
+        if self._cache_sizes is None:
+            self._cache_sizes = {path: path.stat().st_size
+                                 for path in self.cache_dir.glob("*.npy")
+                                 if not path.name.startswith(".tmp-")}
+
+        total = sum(self._cache_sizes.values())
+        if total + nbytes <= self.max_cache_bytes:
+            return True
+
+        unused = sorted((path for path in self._cache_sizes if path not in self._cache_used),
+                        key=lambda path: path.stat().st_mtime_ns if path.exists() else 0)
+        for path in unused:
+            path.unlink(missing_ok=True)
+            total -= self._cache_sizes.pop(path)
+            self.num_evicted += 1
+            if total + nbytes <= self.max_cache_bytes:
+                return True
+        return False
+
+    def summary(self):
+        """Return decode/map counters for logging"""
+        return {
+            "num_images": len(self.paths()),
+            "num_decoded": self.num_decoded,
+            "num_mapped": self.num_mapped,
+            "num_resident": len(self._frames),
+            "num_evicted": self.num_evicted,
+            "num_uncached": self.num_uncached,
+        }
+
+
+def apply_orientation(array, orientation):
+    """
+    Stored pixels -> displayed pixels for an EXIF orientation (1-8), as
+    cv2.imread applies it; returns a view
+    """
+    if orientation in (5, 6, 7, 8):
+        # Transpose, then the flips of orientations 1-4
+        array = np.swapaxes(array, 0, 1)
+        orientation = {5: 1, 6: 2, 7: 3, 8: 4}[orientation]
+    if orientation in (2, 3):
+        array = array[:, ::-1]
+    if orientation in (3, 4):
+        array = array[::-1]
+    return array
+
+
+def stored_orientation(array, orientation):
+    """Displayed pixels -> stored pixels, the inverse of apply_orientation"""
+    inverse = {6: 8, 8: 6}.get(orientation, orientation)
+    return apply_orientation(array, inverse)
+
+
+def stored_box(box, orientation, size):
+    """
+    A displayed-pixel box (x1, y1, x2, y2, exclusive ends) in stored pixels
+
+    Args:
+        box: Box in the displayed (orientation-applied) image
+        orientation: EXIF orientation (1-8)
+        size: (width, height) of the displayed image
+    """
+    x1, y1, x2, y2 = box
+    width, height = size
+    if orientation in (2, 3):
+        x1, x2 = width - x2, width - x1
+    if orientation in (3, 4):
+        y1, y2 = height - y2, height - y1
+    if orientation in (5, 6, 7, 8):
+        # Transpose after undoing the flips, as in apply_orientation
+        flip_x, flip_y = {5: (False, False), 6: (True, False),
+                          7: (True, True), 8: (False, True)}[orientation]
+        if flip_x:
+            x1, x2 = width - x2, width - x1
+        if flip_y:
+            y1, y2 = height - y2, height - y1
+        x1, y1, x2, y2 = y1, x1, y2, x2
+    return [x1, y1, x2, y2]
+
+
+def reduced_decode_flag(src_size, max_size):
+    """
+    Pick the largest IMREAD_REDUCED_COLOR_* factor that keeps the decoded
+    image at least max_size on its long side
+
+    Args:
+        src_size: Long side of the source image in pixels
+        max_size: Target long side in pixels
+
+    Returns:
+        (factor, imread flags), (1, IMREAD_COLOR) when no reduction fits
+    """
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                         (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if src_size >= factor * max_size:
+            return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+
+def decode_image(img_path, flags=cv2.IMREAD_COLOR):
+    """Decode an image with OpenCV, raising instead of returning None"""
+    img = cv2.imread(str(img_path), flags)
+    if img is None:
+        raise IOError(f"Could not decode image: {img_path}")
+    return img
@@ -0,0 +1,612 @@
+"""
+Incremental Structure from Motion
+COLMAP-free SfM backend built on OpenCV RANSAC geometry and sparse bundle adjustment
+"""
+
+import cv2
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from pathlib import Path
+import itertools
+import logging
+import time
+from src.bundle_adjust import BundleAdjuster, project, rotate
+from src.colmap_io import (
+    ColmapModel, CAMERA_DTYPE, CAMERA_MODEL_IDS, IMAGE_DTYPE, POINT2D_DTYPE,
+    POINT3D_DTYPE, TRACK_DTYPE, rotation_to_quaternion
+)
+from src.dataset import ImageDataset
+from src.frames import decode_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SIMPLE_RADIAL = CAMERA_MODEL_IDS["SIMPLE_RADIAL"]
+
+
+class IncrementalSfM:
+    def __init__(self, image_dir, output_dir, dataset=None, image_list=None,
+                 mask_dir=None, max_image_size=1600, max_features=8192,
+                 min_inliers=15, max_error=4.0, min_tri_angle=1.5):
+        """
+        Initialize incremental SfM
+
+        Produces the same sparse/0 binary model as COLMAP's mapper, with
+        one SIMPLE_RADIAL camera per camera group of the dataset.
+
+        Args:
+            image_dir: Directory containing input images
+            output_dir: Directory for SfM output
+            dataset: ImageDataset over image_dir (default: a new one)
+            image_list: Optional text file of image names to use
+            mask_dir: Optional COLMAP mask directory (<image name>.png)
+            max_image_size: Long side at which SIFT runs (keypoints are
+                scaled back to full resolution)
+            max_features: SIFT features per image
+            min_inliers: Minimum verified matches for a pair and minimum
+                PnP inliers for registering an image
+            max_error: Reprojection error threshold in pixels
+            min_tri_angle: Minimum triangulation angle in degrees
+        """
+        self.image_dir = Path(image_dir)
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.dataset = dataset or ImageDataset(self.image_dir)
+        self.mask_dir = Path(mask_dir) if mask_dir else None
+
+        self.max_image_size = max_image_size
+        self.max_features = max_features
+        self.min_inliers = min_inliers
+        self.max_error = max_error
+        self.min_tri_angle = min_tri_angle
+
+        names = self.dataset.names()
+        if image_list is not None:
+            with open(image_list) as f:
+                keep = {line.strip() for line in f if line.strip()}
+            names = [name for name in names if name in keep]
+        self.names = names
+        self.timings = {}
+
+        self._setup_cameras()
+
+    def _setup_cameras(self):
+        """One SIMPLE_RADIAL camera per dataset camera group, focal from EXIF"""
+        index = {name: i for i, name in enumerate(self.names)}
+        self.image_camera = np.zeros(len(self.names), dtype=np.int64)
+
+        cameras = []
+        for group in self.dataset.camera_groups():
+            members = [index[name] for name in group["names"] if name in index]
+            if not members:
+                continue
+            w, h = group["width"], group["height"]
+            focal = group["focal_px"] or 1.2 * max(w, h)
+            self.image_camera[members] = len(cameras)
+            cameras.append((w, h, [focal, w / 2, h / 2, 0.0]))
+
+        self.camera_sizes = np.array([(w, h) for w, h, _ in cameras], dtype=np.int64)
+        self.camera_params = np.full((len(cameras), 16), np.nan)
+        for i, (_, _, params) in enumerate(cameras):
+            self.camera_params[i, :4] = params
+        self.camera_models = np.full(len(cameras), SIMPLE_RADIAL)
+
+    def extract_features(self):
+        """Detect RootSIFT features (COLMAP pixel convention, centre at +0.5)"""
+        start_time = time.time()
+        # OpenCV's contrast threshold is divided by the 3 octave layers;
+        # 0.02 / 1.5 matches COLMAP's default peak threshold of 0.02 / 3
+        sift = cv2.SIFT_create(nfeatures=self.max_features, contrastThreshold=0.02 / 1.5)
+        self.keypoints, self.descriptors = [], []
+
+        for name in self.names:
+            # COLMAP ignores EXIF orientation, so decode the stored pixels
+            gray = decode_image(self.image_dir / name,
+                                cv2.IMREAD_GRAYSCALE | cv2.IMREAD_IGNORE_ORIENTATION)
+            h, w = gray.shape
+            scale = min(1.0, self.max_image_size / max(h, w))
+            if scale < 1.0:
+                gray = cv2.resize(gray, (round(w * scale), round(h * scale)),
+                                  interpolation=cv2.INTER_AREA)
+
+            mask = None
+            if self.mask_dir is not None and (self.mask_dir / f"{name}.png").exists():
+                mask = decode_image(self.mask_dir / f"{name}.png", cv2.IMREAD_GRAYSCALE)
+                mask = cv2.resize(mask, (gray.shape[1], gray.shape[0]),
+                                  interpolation=cv2.INTER_NEAREST)
+
+            kps, desc = sift.detectAndCompute(gray, mask)
+            if desc is None:
+                self.keypoints.append(np.zeros((0, 2)))
+                self.descriptors.append(np.zeros((0, 128), dtype=np.float32))
+                continue
+
+            xy = (np.array([kp.pt for kp in kps], dtype=np.float64) + 0.5) / scale
+            desc /= desc.sum(axis=1, keepdims=True) + 1e-7
+            self.keypoints.append(xy)
+            self.descriptors.append(np.sqrt(desc).astype(np.float32))
+
+        counts = [len(k) for k in self.keypoints]
+        self.timings["features"] = time.time() - start_time
+        logger.info(f"Extracted {sum(counts)} features from {len(self.names)} images "
+                    f"in {self.timings['features']:.2f}s")
+
+    def match(self, pairs=None, ratio=0.8):
+        """
+        Match and geometrically verify image pairs
+
+        Args:
+            pairs: Iterable of (name_a, name_b); default is every pair
+            ratio: Lowe ratio test threshold
+        """
+        start_time = time.time()
+        index = {name: i for i, name in enumerate(self.names)}
+        if pairs is None:
+            pairs = itertools.combinations(range(len(self.names)), 2)
+        else:
+            pairs = [(index[a], index[b]) for a, b in pairs if a in index and b in index]
+
+        flann = {}
+        self.matches = {}
+        num_pairs = 0
+        for i, j in pairs:
+            num_pairs += 1
+            if len(self.keypoints[i]) < 2 or len(self.keypoints[j]) < 2:
+                continue
+            if j not in flann:
+                flann[j] = cv2.flann_Index(self.descriptors[j], dict(algorithm=1, trees=4))
+            nn, dist = flann[j].knnSearch(self.descriptors[i], 2, params=dict(checks=64))
+
+            # Ratio test on squared distances, then one match per train feature
+            good = np.flatnonzero(dist[:, 0] < ratio * ratio * dist[:, 1])
+            good = good[np.argsort(dist[good, 0])]
+            _, first = np.unique(nn[good, 0], return_index=True)
+            idx_i = good[first]
+            idx_j = nn[idx_i, 0].astype(np.int64)
+            if len(idx_i) < self.min_inliers:
+                continue
+
+            _, inliers = cv2.findFundamentalMat(
+                self.keypoints[i][idx_i], self.keypoints[j][idx_j],
+                cv2.FM_RANSAC, self.max_error, 0.999
+            )
+            if inliers is None:
+                continue
+            inliers = inliers.ravel().astype(bool)
+            if inliers.sum() >= self.min_inliers:
+                self.matches[(i, j)] = (idx_i[inliers], idx_j[inliers])
+
+        self.timings["matching"] = time.time() - start_time
+        logger.info(f"Verified {len(self.matches)} of {num_pairs} pairs "
+                    f"in {self.timings['matching']:.2f}s")
+
+    def build_tracks(self):
+        """Chain verified matches into tracks (connected keypoint components)"""
+        counts = np.array([len(k) for k in self.keypoints], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        total = int(offsets[-1])
+
+        a = np.concatenate([offsets[i] + m[0] for (i, _), m in self.matches.items()] or [[]])
+        b = np.concatenate([offsets[j] + m[1] for (_, j), m in self.matches.items()] or [[]])
+        graph = sparse.coo_matrix((np.ones(len(a)), (a.astype(np.int64), b.astype(np.int64))),
+                                  shape=(total, total))
+        _, labels = connected_components(graph, directed=False)
+
+        node_image = np.repeat(np.arange(len(counts)), counts)
+        nodes = np.flatnonzero(np.bincount(labels)[labels] >= 2)
+
+        # A track may see an image only once; keep the first keypoint per image
+        nodes = nodes[np.lexsort((nodes, node_image[nodes], labels[nodes]))]
+        key = labels[nodes] * len(counts) + node_image[nodes]
+        nodes = nodes[np.concatenate([[True], key[1:] != key[:-1]])]
+        nodes = nodes[np.bincount(labels[nodes])[labels[nodes]] >= 2]
+
+        _, element_track = np.unique(labels[nodes], return_inverse=True)
+        self.element_track = element_track.astype(np.int64)
+        self.element_image = node_image[nodes]
+        self.element_kp = nodes - offsets[self.element_image]
+        self.track_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.element_track))])
+        self.node_element = np.full(total, -1, dtype=np.int64)
+        self.node_element[nodes] = np.arange(len(nodes))
+        self.kp_offsets = offsets
+
+        num_tracks = len(self.track_offsets) - 1
+        self.element_xy = np.concatenate(self.keypoints)[nodes] if len(nodes) else np.zeros((0, 2))
+        self.element_ok = np.ones(len(nodes), dtype=bool)
+        self.points = np.full((num_tracks, 3), np.nan)
+        self.has_point = np.zeros(num_tracks, dtype=bool)
+
+        num_images = len(self.names)
+        self.registered = np.zeros(num_images, dtype=bool)
+        self.rvecs = np.zeros((num_images, 3))
+        self.tvecs = np.zeros((num_images, 3))
+
+        lengths = np.diff(self.track_offsets)
+        logger.info(f"Built {num_tracks} tracks (mean length "
+                    f"{lengths.mean() if num_tracks else 0:.2f})")
+
+    def initialize(self, candidates=20):
+        """
+        Pick and reconstruct the initial image pair
+
+        The top verified pairs are tried in order of inlier count; a pair is
+        rejected when a homography explains most of its matches (too little
+        parallax). The pair yielding most well-triangulated points wins.
+        """
+        ranked = sorted(self.matches.items(), key=lambda item: -len(item[1][0]))
+        best = None
+        for (i, j), (idx_i, idx_j) in ranked[:candidates]:
+            xi = self._normalized(i, self.keypoints[i][idx_i])
+            xj = self._normalized(j, self.keypoints[j][idx_j])
+            threshold = self.max_error / self.camera_params[self.image_camera[i], 0]
+
+            E, mask = cv2.findEssentialMat(xi, xj, np.eye(3), cv2.RANSAC, 0.999, threshold)
+            if E is None or E.shape != (3, 3):
+                continue
+            _, H_mask = cv2.findHomography(xi, xj, cv2.RANSAC, threshold)
+            if H_mask is not None and H_mask.sum() > 0.8 * mask.sum():
+                continue
+
+            num, R, t, pose_mask = cv2.recoverPose(E, xi, xj, np.eye(3), mask=mask.copy())
+            if num < self.min_inliers:
+                continue
+
+            # Count points with enough parallax
+            X = cv2.triangulatePoints(np.eye(3, 4), np.hstack([R, t]),
+                                      xi[pose_mask.ravel() > 0].T, xj[pose_mask.ravel() > 0].T)
+            X = (X[:3] / X[3]).T
+            c2 = -R.T @ t.ravel()
+            rays_1 = X / np.linalg.norm(X, axis=1, keepdims=True)
+            rays_2 = (X - c2) / np.linalg.norm(X - c2, axis=1, keepdims=True)
+            angles = np.degrees(np.arccos(np.clip(np.sum(rays_1 * rays_2, axis=1), -1, 1)))
+            score = int((angles >= self.min_tri_angle).sum())
+
+            if best is None or score > best[0]:
+                best = (score, i, j, R, t.ravel())
+
+        if best is None:
+            raise RuntimeError("No suitable initial image pair found")
+
+        score, i, j, R, t = best
+        self.registered[[i, j]] = True
+        self.rvecs[j] = cv2.Rodrigues(R)[0].ravel()
+        self.tvecs[j] = t
+        self.fixed_image = i
+        logger.info(f"Initial pair: {self.names[i]} / {self.names[j]} "
+                    f"({score} points with parallax)")
+
+        self.triangulate()
+        self.bundle_adjust(max_nfev=30)
+
+    def register_next(self):
+        """
+        Register the unregistered image with the most 2D-3D correspondences
+
+        Returns:
+            Index of the registered image, or None when no image can be added
+        """
+        while True:
+            e = self._open_elements()
+            e = e[~self.registered[self.element_image[e]]
+                  & self.has_point[self.element_track[e]]
+                  & ~self.failed[self.element_image[e]]]
+            counts = np.bincount(self.element_image[e], minlength=len(self.names))
+            image = int(np.argmax(counts))
+            if counts[image] < self.min_inliers:
+                return None
+
+            if self._register(image, e[self.element_image[e] == image]):
+                self.failed[:] = False
+                return image
+            self.failed[image] = True
+
+    def _register(self, image, elements):
+        obj = self.points[self.element_track[elements]]
+        img = self.element_xy[elements]
+        K, dist = self._camera_matrix(image)
+
+        ok, rvec, tvec, inliers = cv2.solvePnPRansac(
+            obj, img, K, dist, iterationsCount=1000,
+            reprojectionError=self.max_error, confidence=0.9999,
+            flags=cv2.SOLVEPNP_EPNP
+        )
+        if not ok or inliers is None or len(inliers) < self.min_inliers:
+            logger.info(f"Could not register {self.names[image]}")
+            return False
+
+        inliers = inliers.ravel()
+        rvec, tvec = cv2.solvePnPRefineLM(obj[inliers], img[inliers], K, dist, rvec, tvec)
+
+        self.registered[image] = True
+        self.rvecs[image] = rvec.ravel()
+        self.tvecs[image] = tvec.ravel()
+        outliers = np.ones(len(elements), dtype=bool)
+        outliers[inliers] = False
+        self.element_ok[elements[outliers]] = False
+
+        logger.info(f"Registered {self.names[image]} "
+                    f"({len(inliers)}/{len(elements)} inliers, "
+                    f"{self.registered.sum()}/{len(self.names)} images)")
+        return True
+
+    def triangulate(self):
+        """Triangulate every track seen by two or more registered images"""
+        e = self._open_elements()
+        e = e[self.registered[self.element_image[e]] & ~self.has_point[self.element_track[e]]]
+        tracks, starts, counts = np.unique(self.element_track[e], return_index=True,
+                                           return_counts=True)
+        keep = np.repeat(counts >= 2, counts)
+        e = e[keep]
+        tracks, counts = tracks[counts >= 2], counts[counts >= 2]
+        if len(tracks) == 0:
+            return 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        # Linear multi-view triangulation: accumulate A^T A per track, take
+        # the eigenvector of the smallest eigenvalue, all tracks at once
+        images = self.element_image[e]
+        xy = self._normalized_elements(e)
+        P = self._projection_matrices()[images]
+        rows = np.stack([xy[:, :1] * P[:, 2] - P[:, 0],
+                         xy[:, 1:] * P[:, 2] - P[:, 1]], axis=1)
+        rows /= np.linalg.norm(rows, axis=2, keepdims=True)
+        AtA = np.add.reduceat(np.einsum("nri,nrj->nij", rows, rows), starts, axis=0)
+        _, vecs = np.linalg.eigh(AtA)
+        X = vecs[:, :, 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            X = X[:, :3] / X[:, 3:]
+
+        valid = self._check_points(X, e, starts, counts)
+        self.points[tracks[valid]] = X[valid]
+        self.has_point[tracks[valid]] = True
+        return int(valid.sum())
+
+    def _check_points(self, X, e, starts, counts):
+        """Positive depth, reprojection error and triangulation angle per track"""
+        Xe = np.repeat(X, counts, axis=0)
+        images = self.element_image[e]
+        cam = rotate(Xe, self.rvecs[images]) + self.tvecs[images]
+        error = self._errors(Xe, e)
+        finite = np.isfinite(Xe).all(axis=1)
+
+        ok = finite & (cam[:, 2] > 0) & (error < self.max_error)
+        all_ok = np.logical_and.reduceat(ok, starts)
+
+        # Angle of every ray against the track's first ray (a lower bound on
+        # the widest pairwise angle)
+        centers = self._camera_centers()[images]
+        rays = Xe - centers
+        rays /= np.linalg.norm(rays, axis=1, keepdims=True)
+        first = np.repeat(rays[starts], counts, axis=0)
+        cos = np.clip(np.sum(rays * first, axis=1), -1, 1)
+        angle = np.maximum.reduceat(np.degrees(np.arccos(cos)), starts)
+
+        return all_ok & (angle >= self.min_tri_angle)
+
+    def bundle_adjust(self, max_nfev=20):
+        """Global bundle adjustment of registered images and their points"""
+        self.filter_observations()
+        e = self._point_elements()
+        if len(e) == 0:
+            return
+
+        images = np.flatnonzero(self.registered)
+        image_row = np.full(len(self.names), -1)
+        image_row[images] = np.arange(len(images))
+        tracks = np.flatnonzero(self.has_point)
+        track_row = np.full(len(self.has_point), -1)
+        track_row[tracks] = np.arange(len(tracks))
+
+        result = BundleAdjuster(max_nfev=max_nfev).solve(
+            self.camera_models, self.camera_params, self.image_camera[images],
+            self.rvecs[images], self.tvecs[images], self.points[tracks],
+            image_row[self.element_image[e]], track_row[self.element_track[e]],
+            self.element_xy[e], fixed_images=[image_row[self.fixed_image]]
+        )
+        self.camera_params = result["params"]
+        self.rvecs[images] = result["rvecs"]
+        self.tvecs[images] = result["tvecs"]
+        self.points[tracks] = result["points"]
+
+        self.filter_observations()
+
+    def filter_observations(self):
+        """Drop observations over max_error and points left with fewer than two"""
+        e = self._point_elements()
+        if len(e) == 0:
+            return
+        error = self._errors(self.points[self.element_track[e]], e)
+        images = self.element_image[e]
+        depth = (rotate(self.points[self.element_track[e]], self.rvecs[images])
+                 + self.tvecs[images])[:, 2]
+        self.element_ok[e[(error > self.max_error) | (depth <= 0)]] = False
+
+        e = self._point_elements()
+        remaining = np.bincount(self.element_track[e], minlength=len(self.has_point))
+        dropped = self.has_point & (remaining < 2)
+        self.has_point[dropped] = False
+        self.points[dropped] = np.nan
+
+    def run(self, model_dir, pairs=None):
+        """
+        Run incremental SfM and write the binary model
+
+        Args:
+            model_dir: Output model directory (e.g. sparse/0)
+            pairs: Optional (name_a, name_b) pairs to match (default: all)
+
+        Returns:
+            Dict of stage timings and reconstruction counts
+        """
+        total_start = time.time()
+        self.extract_features()
+        self.match(pairs)
+        self.build_tracks()
+
+        start_time = time.time()
+        self.failed = np.zeros(len(self.names), dtype=bool)
+        self.initialize()
+
+        last_ba = self.registered.sum()
+        while self.register_next() is not None:
+            self.triangulate()
+            # Global BA whenever the model has grown by 20%
+            if self.registered.sum() >= 1.2 * last_ba:
+                self.bundle_adjust()
+                self.triangulate()
+                last_ba = self.registered.sum()
+
+        self.bundle_adjust(max_nfev=50)
+        self.triangulate()
+        self.filter_observations()
+        self.timings["mapping"] = time.time() - start_time
+
+        self.write_model(model_dir)
+        self.timings["total"] = time.time() - total_start
+
+        summary = {
+            "num_images": int(self.registered.sum()),
+            "num_input_images": len(self.names),
+            "num_points": int(self.has_point.sum()),
+            "timings": dict(self.timings),
+        }
+        logger.info(f"Registered {summary['num_images']}/{len(self.names)} images, "
+                    f"{summary['num_points']} points in {self.timings['total']:.2f}s")
+        return summary
+
+    def write_model(self, model_dir):
+        """Write registered images and triangulated points as a COLMAP binary model"""
+        images = np.flatnonzero(self.registered)
+        tracks = np.flatnonzero(self.has_point)
+        point_id = np.full(len(self.has_point), -1, dtype=np.int64)
+        point_id[tracks] = np.arange(1, len(tracks) + 1)
+
+        cameras = np.zeros(len(self.camera_models), dtype=CAMERA_DTYPE)
+        cameras["camera_id"] = np.arange(1, len(cameras) + 1)
+        cameras["model_id"] = self.camera_models
+        cameras["width"] = self.camera_sizes[:, 0]
+        cameras["height"] = self.camera_sizes[:, 1]
+        cameras["params"] = self.camera_params
+
+        image_array = np.zeros(len(images), dtype=IMAGE_DTYPE)
+        image_array["image_id"] = images + 1
+        image_array["qvec"] = rotation_to_quaternion(self._rotation_matrices()[images])
+        image_array["tvec"] = self.tvecs[images]
+        image_array["camera_id"] = self.image_camera[images] + 1
+
+        # Keypoint -> point id, through the track of each valid observation
+        e = self._point_elements()
+        blocks = []
+        for row, image in enumerate(images):
+            ids = np.full(len(self.keypoints[image]), -1, dtype=np.int64)
+            mine = e[self.element_image[e] == image]
+            ids[self.element_kp[mine]] = point_id[self.element_track[mine]]
+            block = np.zeros(len(ids), dtype=POINT2D_DTYPE)
+            block["xy"] = self.keypoints[image]
+            block["point3D_id"] = ids
+            blocks.append(block)
+            image_array["num_points2D"][row] = len(ids)
+
+        order = np.argsort(self.element_track[e], kind="stable")
+        e = e[order]
+        track_counts = np.bincount(self.element_track[e], minlength=len(self.has_point))[tracks]
+
+        points = np.zeros(len(tracks), dtype=POINT3D_DTYPE)
+        points["point3D_id"] = point_id[tracks]
+        points["xyz"] = self.points[tracks]
+        points["rgb"] = self._point_colors(e, track_counts)
+        error = self._errors(self.points[self.element_track[e]], e)
+        starts = np.concatenate([[0], np.cumsum(track_counts)[:-1]])
+        points["error"] = np.add.reduceat(error, starts) / track_counts if len(e) else 0.0
+        points["track_length"] = track_counts
+
+        track = np.zeros(len(e), dtype=TRACK_DTYPE)
+        track["image_id"] = self.element_image[e] + 1
+        track["point2D_idx"] = self.element_kp[e]
+
+        model = ColmapModel(
+            cameras, image_array, [self.names[i] for i in images],
+            np.concatenate(blocks) if blocks else np.zeros(0, dtype=POINT2D_DTYPE),
+            np.concatenate([[0], np.cumsum(image_array["num_points2D"])]).astype(np.int64),
+            points, track, np.concatenate([[0], np.cumsum(track_counts)]).astype(np.int64)
+        )
+        model.write(model_dir)
+        logger.info(f"Sparse model saved: {model_dir}")
+        return model
+
+    def _point_colors(self, e, track_counts):
+        """Colour of each point from its first observation (reduced decode)"""
+        colors = np.zeros((len(track_counts), 3), dtype=np.uint8)
+        if len(e) == 0:
+            return colors
+        first = e[np.concatenate([[0], np.cumsum(track_counts)[:-1]])]
+        for image in np.unique(self.element_image[first]):
+            rows = np.flatnonzero(self.element_image[first] == image)
+            img = decode_image(self.image_dir / self.names[image],
+                               cv2.IMREAD_REDUCED_COLOR_4 | cv2.IMREAD_IGNORE_ORIENTATION)
+            xy = self.element_xy[first[rows]] / 4 - 0.5
+            x = np.clip(np.round(xy[:, 0]).astype(int), 0, img.shape[1] - 1)
+            y = np.clip(np.round(xy[:, 1]).astype(int), 0, img.shape[0] - 1)
+            colors[rows] = img[y, x, ::-1]
+        return colors
+
+    def _open_elements(self):
+        """Track elements not rejected as outliers"""
+        return np.flatnonzero(self.element_ok)
+
+    def _point_elements(self):
+        """Valid observations of triangulated points in registered images"""
+        e = self._open_elements()
+        return e[self.registered[self.element_image[e]] & self.has_point[self.element_track[e]]]
+
+    def _errors(self, X, e):
+        images = self.element_image[e]
+        cams = self.image_camera[images]
+        projected = project(X, self.rvecs[images], self.tvecs[images],
+                            self.camera_models[cams], self.camera_params[cams])
+        return np.linalg.norm(projected - self.element_xy[e], axis=1)
+
+    def _camera_matrix(self, image):
+        f, cx, cy, k = self.camera_params[self.image_camera[image], :4]
+        K = np.array([[f, 0, cx], [0, f, cy], [0, 0, 1]])
+        return K, np.array([k, 0.0, 0.0, 0.0])
+
+    def _normalized(self, image, xy):
+        """Undistorted normalized coordinates of pixels in an image"""
+        K, dist = self._camera_matrix(image)
+        return cv2.undistortPoints(xy.reshape(-1, 1, 2), K, dist).reshape(-1, 2)
+
+    def _normalized_elements(self, e):
+        xy = np.zeros((len(e), 2))
+        cams = self.image_camera[self.element_image[e]]
+        for cam in np.unique(cams):
+            rows = np.flatnonzero(cams == cam)
+            image = self.element_image[e[rows[0]]]
+            xy[rows] = self._normalized(image, self.element_xy[e[rows]])
+        return xy
+
+    def _rotation_matrices(self):
+        basis = np.eye(3)
+        columns = [rotate(np.tile(basis[k], (len(self.rvecs), 1)), self.rvecs) for k in range(3)]
+        return np.stack(columns, axis=2)
+
+    def _projection_matrices(self):
+        return np.concatenate([self._rotation_matrices(), self.tvecs[:, :, None]], axis=2)
+
+    def _camera_centers(self):
+        return -np.einsum("nji,nj->ni", self._rotation_matrices(), self.tvecs)
+
+
+def main():
+    """Example usage"""
+    sfm = IncrementalSfM(
+        image_dir="data/input_images",
+        output_dir="output/sparse"
+    )
+    summary = sfm.run("output/sparse/sparse/0")
+    logger.info(f"Final reconstruction: {summary}")
+
+
+if __name__ == "__main__":
+    main()
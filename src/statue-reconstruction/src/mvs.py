@@ -4,17 +4,25 @@ Converts sparse point cloud to dense point cloud
 """
 
 import subprocess
+from contextlib import ExitStack
 import logging
 from pathlib import Path
 import open3d as o3d
 import numpy as np
+from src.colmap_runner import ColmapRunner
+from src.cpu_stereo import CPUStereo
+from src.depth_fusion import DepthFusion
+from src.pointcloud_io import CloudWriter, iter_ply_chunks, ply_arrays, read_ply_header
+from src.tiled_filter import TiledFilter
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 class MVSPipeline:
-    def __init__(self, sparse_dir, output_dir, colmap_path="colmap"):
+    def __init__(self, sparse_dir, output_dir, colmap_path="colmap", runner=None,
+                 stereo_backend="colmap", fusion_backend="colmap", workers=1,
+                 tiled_filter=False):
         """
         Initialize MVS pipeline
         
@@ -22,11 +30,31 @@ class MVSPipeline:
             sparse_dir: Directory with sparse reconstruction
             output_dir: Directory for dense output
             colmap_path: Path to COLMAP executable
+            runner: ColmapRunner shared with other stages (default: a new one)
+            stereo_backend: Depth maps from 'colmap' (patch_match_stereo,
+                needs CUDA) or 'cpu' (rectified SGBM, see cpu_stereo.py)
+            fusion_backend: Fuse depth maps with 'colmap' (stereo_fusion) or
+                'voxel' (streaming voxel map, see depth_fusion.py)
+            workers: Worker processes of the CPU stereo backend and tiled filter
+            tiled_filter: Filter the fused cloud tile by tile from disk
+                (see tiled_filter.py) instead of in memory
         """
+        if stereo_backend not in ("colmap", "cpu"):
+            raise ValueError(f"Unknown stereo backend: {stereo_backend}")
+        if fusion_backend not in ("colmap", "voxel"):
+            raise ValueError(f"Unknown fusion backend: {fusion_backend}")
+        
         self.sparse_dir = Path(sparse_dir)
         self.output_dir = Path(output_dir)
         self.dense_dir = self.output_dir / "dense"
         self.colmap_path = colmap_path
+        self.runner = runner or ColmapRunner()
+        self.stereo_backend = stereo_backend
+        self.fusion_backend = fusion_backend
+        self.workers = workers
+        self.tiled_filter = tiled_filter
+        self.filtered_ply = None
+        self.filtered_cloud = None
         
         self.dense_dir.mkdir(parents=True, exist_ok=True)
     
@@ -47,7 +75,7 @@ class MVSPipeline:
             "--output_type", "COLMAP"
         ]
         
-        subprocess.run(cmd, check=True)
+        self.runner.run(cmd)
         logger.info("Image undistortion complete")
     
     def patch_match_stereo(self, max_image_size=3200):
@@ -67,9 +95,23 @@ class MVSPipeline:
             "--PatchMatchStereo.geom_consistency", "true"
         ]
         
-        subprocess.run(cmd, check=True)
+        self.runner.run(cmd)
         logger.info("PatchMatch stereo complete")
     
+    def cpu_stereo(self, max_image_size=1600):
+        """
+        Compute depth and normal maps on the CPU
+        
+        Writes the same dense/stereo layout as patch_match_stereo, so
+        stereo_fusion runs unchanged.
+        
+        Args:
+            max_image_size: Maximum depth map dimension
+        """
+        logger.info("Running CPU stereo...")
+        stereo = CPUStereo(self.dense_dir, max_image_size=max_image_size)
+        return stereo.run(workers=self.workers)
+    
     def stereo_fusion(self, min_num_pixels=5):
         """
         Fuse depth maps into dense point cloud
@@ -90,12 +132,30 @@ class MVSPipeline:
             "--StereoFusion.min_num_pixels", str(min_num_pixels)
         ]
         
-        subprocess.run(cmd, check=True)
+        self.runner.run(cmd)
         logger.info(f"Stereo fusion complete: {output_ply}")
         return output_ply
     
+    def voxel_fusion(self, min_views=3, voxel_size=None):
+        """
+        Fuse depth maps in process, one view at a time
+        
+        Writes the same dense/fused.ply as stereo_fusion, averaged per
+        voxel, with memory bounded by the occupied voxels.
+        
+        Args:
+            min_views: Minimum number of consistent views
+            voxel_size: Fusion voxel size (default: one depth map pixel)
+        """
+        logger.info("Fusing depth maps into a voxel map...")
+        output_ply = self.dense_dir / "fused.ply"
+        fusion = DepthFusion(self.dense_dir, voxel_size=voxel_size, min_views=min_views)
+        fusion.run(output_ply)
+        return output_ply
+    
     def filter_point_cloud(self, input_ply, output_ply=None, 
-                          voxel_size=0.01, nb_neighbors=20, std_ratio=2.0):
+                          voxel_size=0.01, nb_neighbors=20, std_ratio=2.0,
+                          tiled=False, tile_points=2_000_000):
         """
         Filter and clean the dense point cloud
         
@@ -105,9 +165,23 @@ class MVSPipeline:
             voxel_size: Voxel size for downsampling
             nb_neighbors: Number of neighbors for statistical outlier removal
             std_ratio: Standard deviation ratio threshold
+            tiled: Stream the cloud from disk and filter it in spatial
+                tiles over the worker processes, for clouds too large
+                for memory
+            tile_points: Approximate input points per tile
         """
         logger.info("Filtering point cloud...")
         
+        if output_ply is None:
+            output_ply = self.dense_dir / "fused_filtered.ply"
+        
+        if tiled:
+            TiledFilter(voxel_size=voxel_size, nb_neighbors=nb_neighbors, std_ratio=std_ratio,
+                        tile_points=tile_points, workers=self.workers).run(input_ply, output_ply)
+            self.filtered_ply, self.filtered_cloud = Path(output_ply), None
+            logger.info(f"Filtered point cloud saved: {output_ply}")
+            return output_ply
+        
         # Load point cloud
         pcd = o3d.io.read_point_cloud(str(input_ply))
         logger.info(f"Original points: {len(pcd.points)}")
@@ -124,12 +198,17 @@ class MVSPipeline:
         logger.info(f"After filtering: {len(pcd_filtered.points)}")
         
         # Save filtered point cloud
-        if output_ply is None:
-            output_ply = self.dense_dir / "fused_filtered.ply"
-        
         o3d.io.write_point_cloud(str(output_ply), pcd_filtered)
         logger.info(f"Filtered point cloud saved: {output_ply}")
         
+        # Kept for export_to_formats, which then skips re-reading the file
+        self.filtered_ply = Path(output_ply)
+        self.filtered_cloud = (
+            np.asarray(pcd_filtered.points),
+            np.asarray(pcd_filtered.normals) if pcd_filtered.has_normals() else None,
+            np.asarray(pcd_filtered.colors) * 255 if pcd_filtered.has_colors() else None
+        )
+        
         return output_ply
     
     def visualize_point_cloud(self, ply_path):
@@ -151,25 +230,46 @@ class MVSPipeline:
             point_show_normal=False
         )
     
-    def export_to_formats(self, input_ply):
-        """Export point cloud to various formats"""
-        pcd = o3d.io.read_point_cloud(str(input_ply))
+    def export_to_formats(self, input_ply, cloud=None):
+        """
+        Export point cloud to various formats
+        
+        Writes fused.pcd (binary), fused.xyz (text "x y z r g b") and
+        fused_xyzrgb.bin (binary float32 xyz + uint8 rgb records) next to
+        the PLY, each a whole chunk at a time.
+        
+        Args:
+            input_ply: Filtered point cloud (the PLY export)
+            cloud: (points, normals, colors 0-255) already in memory
+                (default: the cloud filter_point_cloud kept for this
+                file, else the PLY streamed in chunks)
+        """
+        if cloud is None and self.filtered_ply == Path(input_ply):
+            cloud = self.filtered_cloud
+        if cloud is not None:
+            count = len(cloud[0])
+            has_normals, has_colors = cloud[1] is not None, cloud[2] is not None
+            chunks = [cloud]
+        else:
+            _, count, dtype, _ = read_ply_header(input_ply)
+            has_normals = {"nx", "ny", "nz"} <= set(dtype.names)
+            has_colors = {"red", "green", "blue"} <= set(dtype.names)
+            chunks = (ply_arrays(chunk) for chunk in iter_ply_chunks(input_ply))
+        
+        paths = {"PCD": self.dense_dir / "fused.pcd",
+                 "XYZ": self.dense_dir / "fused.xyz",
+                 "XYZRGB": self.dense_dir / "fused_xyzrgb.bin"}
+        with ExitStack() as stack:
+            writers = [stack.enter_context(CloudWriter(path, count, normals=has_normals,
+                                                       colors=has_colors))
+                       for path in paths.values()]
+            for points, normals, colors in chunks:
+                for writer in writers:
+                    writer.write(points, normals, colors)
         
-        # Export to PLY (already done)
-        # Export to PCD
-        pcd_path = self.dense_dir / "fused.pcd"
-        o3d.io.write_point_cloud(str(pcd_path), pcd)
-        logger.info(f"Exported to PCD: {pcd_path}")
-        
-        # Export to XYZ
-        xyz_path = self.dense_dir / "fused.xyz"
-        points = np.asarray(pcd.points)
-        colors = np.asarray(pcd.colors)
-        with open(xyz_path, 'w') as f:
-            for i in range(len(points)):
-                f.write(f"{points[i, 0]} {points[i, 1]} {points[i, 2]} "
-                       f"{int(colors[i, 0]*255)} {int(colors[i, 1]*255)} {int(colors[i, 2]*255)}\n")
-        logger.info(f"Exported to XYZ: {xyz_path}")
+        for name, path in paths.items():
+            logger.info(f"Exported to {name}: {path}")
+        return paths
     
     def run_full_pipeline(self, image_dir, visualize=False):
         """Run the complete MVS pipeline"""
@@ -178,14 +278,20 @@ class MVSPipeline:
         # Step 1: Undistort images
         self.image_undistortion(image_dir)
         
-        # Step 2: PatchMatch stereo
-        self.patch_match_stereo()
+        # Step 2: Depth maps (PatchMatch stereo or the CPU backend)
+        if self.stereo_backend == "cpu":
+            self.cpu_stereo()
+        else:
+            self.patch_match_stereo()
         
         # Step 3: Stereo fusion
-        fused_ply = self.stereo_fusion()
+        if self.fusion_backend == "voxel":
+            fused_ply = self.voxel_fusion()
+        else:
+            fused_ply = self.stereo_fusion()
         
         # Step 4: Filter point cloud
-        filtered_ply = self.filter_point_cloud(fused_ply)
+        filtered_ply = self.filter_point_cloud(fused_ply, tiled=self.tiled_filter)
         
         # Step 5: Export to multiple formats
         self.export_to_formats(filtered_ply)
@@ -213,7 +319,8 @@ def main():
         logger.info(f"Dense reconstruction saved: {result}")
     except subprocess.CalledProcessError as e:
         logger.error(f"COLMAP error: {e}")
-        logger.error("Make sure COLMAP is installed with CUDA support for PatchMatch")
+        logger.error("Make sure COLMAP is installed with CUDA support for PatchMatch, "
+                     "or use stereo_backend=\"cpu\"")
     except Exception as e:
         logger.error(f"Error: {e}")
 
@@ -0,0 +1,265 @@
+"""
+Image Pair Planner
+Builds a candidate match list so matching cost grows linearly with image count
+"""
+
+import cv2
+import numpy as np
+from scipy import sparse
+from pathlib import Path
+import logging
+import time
+from src.colmap_io import ColmapModel
+from src.dataset import ImageDataset
+from src.frames import decode_image, reduced_decode_flag
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("retrieval", "turntable", "covisibility")
+
+
+class PairPlanner:
+    def __init__(self, image_dir, dataset=None, image_names=None, thumb_size=64):
+        """
+        Initialize pair planner
+
+        Args:
+            image_dir: Directory containing the images
+            dataset: ImageDataset over image_dir (default: a new one)
+            image_names: Optional subset of image names to plan for (e.g.
+                the frames kept by triage); default is every image
+            thumb_size: Thumbnail side used for the global descriptors
+        """
+        self.image_dir = Path(image_dir)
+        self.dataset = dataset or ImageDataset(self.image_dir)
+        self.thumb_size = thumb_size
+
+        names = self.dataset.names()
+        if image_names is not None:
+            keep = set(image_names)
+            names = [name for name in names if name in keep]
+        self.names = names
+
+        self._descriptors = None
+
+    def global_descriptors(self):
+        """
+        One L2-normalised descriptor per image (N x D), computed on thumbnails
+
+        The descriptor concatenates a 4x4 grid of gradient-orientation
+        histograms with the mean Lab colour of each cell, which is enough
+        to tell nearby viewpoints of one object apart from distant ones.
+        """
+        if self._descriptors is not None:
+            return self._descriptors
+
+        start_time = time.time()
+        descriptors = []
+        for name in self.names:
+            img_path = self.image_dir / name
+            meta = self.dataset.metadata(img_path)
+            thumb = decode_thumbnail(img_path, max(meta["width"], meta["height"]),
+                                     self.thumb_size)
+            descriptors.append(thumbnail_descriptor(thumb))
+        self.dataset.save()
+
+        self._descriptors = np.stack(descriptors) if descriptors else np.zeros((0, 1))
+        logger.info(f"Global descriptors for {len(self.names)} images "
+                    f"in {time.time() - start_time:.2f}s")
+        return self._descriptors
+
+    def retrieval_pairs(self, k=10):
+        """
+        Pair every image with its k most similar images
+
+        Args:
+            k: Neighbours per image
+        """
+        desc = self.global_descriptors()
+        n = len(desc)
+        if n < 2:
+            return set()
+        k = min(k, n - 1)
+
+        similarity = desc @ desc.T
+        np.fill_diagonal(similarity, -np.inf)
+        neighbours = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+
+        rows = np.repeat(np.arange(n), k)
+        return self._pair_set(rows, neighbours.reshape(-1))
+
+    def turntable_pairs(self, overlap=5, circular=True):
+        """
+        Pair each image with the next overlap images in capture order
+
+        Args:
+            overlap: Following images paired with each image
+            circular: Wrap around so the last images match the first (a
+                full turn around the object)
+        """
+        n = len(self.names)
+        if n < 2:
+            return set()
+        overlap = min(overlap, n - 1)
+
+        rows = np.repeat(np.arange(n), overlap)
+        cols = rows + np.tile(np.arange(1, overlap + 1), n)
+        if circular:
+            cols %= n
+        else:
+            keep = cols < n
+            rows, cols = rows[keep], cols[keep]
+        return self._pair_set(rows, cols)
+
+    def covisibility_pairs(self, model_dir, min_shared=15, k=None):
+        """
+        Pair images that observe common points in an existing sparse model
+
+        Args:
+            model_dir: COLMAP binary model directory
+            min_shared: Minimum number of shared 3D points
+            k: Optional cap on partners per image (strongest first)
+        """
+        model = ColmapModel.read(model_dir)
+        if len(model.tracks) == 0:
+            return set()
+
+        # Point x image incidence; its Gram matrix counts shared points
+        owner = np.repeat(np.arange(len(model.points3D)), np.diff(model.track_offsets))
+        image_ids = model.tracks["image_id"]
+        incidence = sparse.csr_matrix(
+            (np.ones(len(owner), dtype=np.int32), (owner, image_ids)),
+            shape=(len(model.points3D), int(image_ids.max()) + 1)
+        )
+        incidence.data[:] = 1  # count each point once even if seen twice
+        shared = (incidence.T @ incidence).tocoo()
+
+        keep = (shared.row < shared.col) & (shared.data >= min_shared)
+        rows, cols, counts = shared.row[keep], shared.col[keep], shared.data[keep]
+
+        id_to_name = dict(zip(model.images["image_id"].tolist(), model.names))
+        index = {name: i for i, name in enumerate(self.names)}
+        pairs = set()
+        partners = {}
+        for order in np.argsort(-counts, kind="stable"):
+            a = index.get(id_to_name.get(int(rows[order])))
+            b = index.get(id_to_name.get(int(cols[order])))
+            if a is None or b is None:
+                continue
+            if k is not None and (partners.get(a, 0) >= k or partners.get(b, 0) >= k):
+                continue
+            partners[a] = partners.get(a, 0) + 1
+            partners[b] = partners.get(b, 0) + 1
+            pairs.add((min(a, b), max(a, b)))
+        return pairs
+
+    def plan(self, strategies=("retrieval", "turntable"), k=10, overlap=5,
+             circular=True, model_dir=None, min_shared=15):
+        """
+        Union of the pairs from several strategies
+
+        Args:
+            strategies: Any of 'retrieval', 'turntable', 'covisibility'
+            k: Neighbours per image for retrieval (and covisibility cap)
+            overlap: Sequential neighbours for turntable
+            circular: Wrap the turntable ordering around
+            model_dir: Sparse model for covisibility
+            min_shared: Shared points for a covisibility pair
+
+        Returns:
+            Sorted list of (name_a, name_b)
+        """
+        pairs = set()
+        for strategy in strategies:
+            if strategy == "retrieval":
+                found = self.retrieval_pairs(k=k)
+            elif strategy == "turntable":
+                found = self.turntable_pairs(overlap=overlap, circular=circular)
+            elif strategy == "covisibility":
+                if model_dir is None or not (Path(model_dir) / "images.bin").exists():
+                    logger.warning("No sparse model for covisibility pairs, skipping")
+                    continue
+                found = self.covisibility_pairs(model_dir, min_shared=min_shared, k=k)
+            else:
+                raise ValueError(f"Unknown pair strategy: {strategy}")
+            logger.info(f"{strategy}: {len(found)} pairs")
+            pairs |= found
+
+        n = len(self.names)
+        exhaustive = max(n * (n - 1) // 2, 1)
+        logger.info(f"Planned {len(pairs)} pairs for {n} images "
+                    f"({len(pairs) / exhaustive:.1%} of exhaustive)")
+        return [(self.names[a], self.names[b]) for a, b in sorted(pairs)]
+
+    def write(self, pairs, output_path):
+        """Write pairs in COLMAP matches_importer format (one 'a b' per line)"""
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w') as f:
+            for a, b in pairs:
+                f.write(f"{a} {b}\n")
+        return output_path
+
+    @staticmethod
+    def _pair_set(rows, cols):
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        keep = rows != cols
+        lo = np.minimum(rows[keep], cols[keep])
+        hi = np.maximum(rows[keep], cols[keep])
+        return set(zip(lo.tolist(), hi.tolist()))
+
+
+def decode_thumbnail(img_path, long_side, size):
+    """
+    Square BGR thumbnail, decoded at reduced JPEG resolution where possible
+
+    Args:
+        img_path: Source image
+        long_side: Long side of the source image (from the dataset index)
+        size: Thumbnail side length
+    """
+    _, flags = reduced_decode_flag(long_side, size)
+    img = decode_image(img_path, flags)
+    return cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+
+
+def thumbnail_descriptor(thumb, grid=4, bins=8):
+    """Gradient-orientation histograms plus mean Lab colour on a grid of cells"""
+    gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    magnitude = np.hypot(gx, gy)
+    orientation = (np.arctan2(gy, gx) % np.pi) / np.pi * bins
+    orientation = np.minimum(orientation.astype(np.int64), bins - 1)
+
+    size = thumb.shape[0]
+    cell = size // grid
+    cell_index = (np.arange(size) // cell).clip(max=grid - 1)
+    cells = cell_index[:, None] * grid + cell_index[None, :]
+
+    # Orientation histograms weighted by magnitude, one per cell
+    hist = np.bincount((cells * bins + orientation).ravel(), weights=magnitude.ravel(),
+                       minlength=grid * grid * bins).reshape(grid * grid, bins)
+    hist = np.sqrt(hist)
+    hist /= np.linalg.norm(hist, axis=1, keepdims=True) + 1e-6
+
+    lab = cv2.cvtColor(thumb, cv2.COLOR_BGR2LAB).reshape(-1, 3).astype(np.float32) / 255.0
+    counts = np.bincount(cells.ravel(), minlength=grid * grid)[:, None]
+    color = np.stack([np.bincount(cells.ravel(), weights=lab[:, c], minlength=grid * grid)
+                      for c in range(3)], axis=1) / counts
+    color -= color.mean(axis=0)
+
+    desc = np.concatenate([hist.ravel(), color.ravel()])
+    return desc / (np.linalg.norm(desc) + 1e-6)
+
+
+def main():
+    """Example usage"""
+    planner = PairPlanner(image_dir="data/input_images")
+    pairs = planner.plan(strategies=("retrieval", "turntable"), k=10, overlap=5)
+    planner.write(pairs, "output/sparse/pairs.txt")
+
+
+if __name__ == "__main__":
+    main()
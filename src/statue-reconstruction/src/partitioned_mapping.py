@@ -0,0 +1,304 @@
+"""
+Partitioned Sparse Mapping
+Clusters the match graph, maps the clusters in parallel COLMAP processes and merges the submodels
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import logging
+import time
+from src.colmap_database import ColmapDatabase
+from src.colmap_io import ColmapModel
+from src.colmap_runner import ColmapRunner
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PartitionedMapper:
+    def __init__(self, database_path, image_dir, output_dir, colmap_path="colmap",
+                 runner=None, max_cluster_size=100, overlap=10, min_inliers=15,
+                 workers=2):
+        """
+        Initialize partitioned mapper
+
+        Args:
+            database_path: COLMAP database with verified matches
+            image_dir: Directory containing the images
+            output_dir: Directory for the cluster models and the report
+            colmap_path: Path to COLMAP executable
+            runner: ColmapRunner shared with other stages (default: a new one)
+            max_cluster_size: Largest cluster before overlap is added
+            overlap: Images borrowed from neighbouring clusters, so that
+                submodels share cameras for merging
+            min_inliers: Verified inliers for a pair to count as an edge
+            workers: Clusters mapped at the same time
+        """
+        self.database_path = Path(database_path)
+        self.image_dir = Path(image_dir)
+        self.output_dir = Path(output_dir)
+        self.parts_dir = self.output_dir / "partitions"
+        self.colmap_path = colmap_path
+        self.runner = runner or ColmapRunner()
+        self.max_cluster_size = max_cluster_size
+        self.overlap = overlap
+        self.min_inliers = min_inliers
+        self.workers = max(1, workers)
+
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+
+    def match_graph(self):
+        """Image names and the symmetric inlier-weighted adjacency (dense, n x n)"""
+        with ColmapDatabase(self.database_path) as db:
+            image_ids, _, names = db.images()
+            pairs = db.pairs()
+            strong = pairs[~db.weak_pairs(self.min_inliers, pairs=pairs)]
+
+        rows = np.searchsorted(image_ids, strong["image_id1"])
+        cols = np.searchsorted(image_ids, strong["image_id2"])
+        weights = np.zeros((len(names), len(names)))
+        weights[rows, cols] = strong["num_inliers"]
+        weights[cols, rows] = strong["num_inliers"]
+        return names, weights
+
+    def partition(self, weights):
+        """
+        Split the graph into clusters of at most max_cluster_size images
+
+        Connected components are split recursively along the Fiedler vector
+        of their normalised Laplacian (a balanced spectral cut through the
+        weakest connections); each cluster is then grown by the overlap
+        images with the most inliers to it.
+
+        Returns:
+            (clusters as lists of image indices, indices of unmatched images)
+        """
+        n = len(weights)
+        clusters, unmatched = [], []
+        pending = [np.arange(n)]
+        while pending:
+            members = pending.pop()
+            sub = weights[np.ix_(members, members)]
+            num_components, labels = connected_components(sparse.csr_matrix(sub), directed=False)
+            if num_components > 1:
+                pending += [members[labels == label] for label in range(num_components)]
+            elif len(members) < 3:
+                unmatched.extend(members.tolist())
+            elif len(members) <= self.max_cluster_size:
+                clusters.append(members)
+            else:
+                order = np.argsort(fiedler_vector(sub))
+                half = len(members) // 2
+                pending += [members[order[:half]], members[order[half:]]]
+
+        # Grow every cluster by its most strongly connected outside images
+        membership = np.zeros((n, len(clusters)))
+        for c, members in enumerate(clusters):
+            membership[members, c] = 1
+        scores = np.where(membership > 0, 0, weights @ membership)
+        grown = []
+        for c, members in enumerate(clusters):
+            extra = np.argsort(-scores[:, c], kind="stable")[:self.overlap]
+            extra = extra[scores[extra, c] > 0]
+            grown.append(np.sort(np.concatenate([members, extra])))
+
+        logger.info(f"Partitioned {n} images into {len(grown)} clusters "
+                    f"(sizes {[len(c) for c in grown]}), {len(unmatched)} unmatched")
+        return grown, sorted(unmatched)
+
+    def map_clusters(self, clusters, names):
+        """
+        Run one COLMAP mapper per cluster, workers at a time
+
+        Returns:
+            Per cluster the directory of its largest model, or None
+        """
+        cpus = os.cpu_count() or 1
+        threads = self.runner.num_threads or max(1, cpus // self.workers)
+
+        def map_cluster(index):
+            cluster_dir = self.parts_dir / f"cluster{index}"
+            cluster_dir.mkdir(exist_ok=True)
+            image_list = cluster_dir / "images.txt"
+            with open(image_list, 'w') as f:
+                f.write("\n".join(names[i] for i in clusters[index]) + "\n")
+
+            cmd = [
+                self.colmap_path, "mapper",
+                "--database_path", str(self.database_path),
+                "--image_path", str(self.image_dir),
+                "--output_path", str(cluster_dir),
+                "--image_list_path", str(image_list),
+                "--Mapper.num_threads", str(threads)
+            ]
+            try:
+                self.runner.run(cmd, stage=f"mapper_cluster{index}")
+            except subprocess.CalledProcessError as e:
+                logger.warning(f"Cluster {index} failed to map: {e}")
+                return None
+            return largest_model(cluster_dir)
+
+        # Each thread only waits on its own COLMAP process
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(map_cluster, range(len(clusters))))
+
+    def merge(self, model_dirs, output_model_dir):
+        """
+        Merge submodels into one with COLMAP's model_merger
+
+        Starting from the largest, the submodel sharing the most images with
+        the merged model is merged next; submodels sharing fewer than three
+        images cannot be aligned and are left out.
+
+        Returns:
+            (merged image names, list of merge records)
+        """
+        models = {i: set(ColmapModel.read(d).names) for i, d in enumerate(model_dirs)
+                  if d is not None}
+        if not models:
+            return set(), []
+
+        first = max(models, key=lambda i: len(models[i]))
+        current_dir, merged = model_dirs[first], models.pop(first)
+        records = [{"cluster": first, "shared": None, "merged": True}]
+
+        step = 0
+        while models:
+            index = max(models, key=lambda i: len(models[i] & merged))
+            names = models.pop(index)
+            shared = len(names & merged)
+            record = {"cluster": index, "shared": shared, "merged": False}
+            records.append(record)
+            if shared < 3:
+                logger.warning(f"Cluster {index} shares {shared} images, cannot merge")
+                continue
+
+            merge_dir = self.parts_dir / f"merged{step}"
+            merge_dir.mkdir(exist_ok=True)
+            cmd = [
+                self.colmap_path, "model_merger",
+                "--input_path1", str(current_dir),
+                "--input_path2", str(model_dirs[index]),
+                "--output_path", str(merge_dir)
+            ]
+            try:
+                self.runner.run(cmd, stage=f"model_merger{step}")
+            except subprocess.CalledProcessError as e:
+                logger.warning(f"Merging cluster {index} failed: {e}")
+                continue
+            step += 1
+
+            current_dir = merge_dir
+            merged = set(ColmapModel.read(merge_dir).names)
+            record["merged"] = True
+
+        output_model_dir = Path(output_model_dir)
+        output_model_dir.mkdir(parents=True, exist_ok=True)
+        for name in ("cameras.bin", "images.bin", "points3D.bin"):
+            shutil.copy(current_dir / name, output_model_dir / name)
+        return merged, records
+
+    def run(self, output_model_dir):
+        """
+        Partition, map and merge into output_model_dir
+
+        Returns:
+            Report dict (also saved as mapping_report.json) listing the
+            clusters, the merges and every dropped image with the reason
+        """
+        start_time = time.time()
+        names, weights = self.match_graph()
+        clusters, unmatched = self.partition(weights)
+        model_dirs = self.map_clusters(clusters, names)
+        merged, merges = self.merge(model_dirs, output_model_dir)
+
+        cluster_reports = []
+        in_models = set()
+        for index, (members, model_dir) in enumerate(zip(clusters, model_dirs)):
+            registered = set(ColmapModel.read(model_dir).names) if model_dir else set()
+            in_models |= registered
+            cluster_reports.append({"images": len(members), "registered": len(registered),
+                                    "model": str(model_dir) if model_dir else None})
+
+        unmatched = set(unmatched)
+        dropped = {}
+        for i, name in enumerate(names):
+            if name in merged:
+                continue
+            if i in unmatched:
+                dropped[name] = "no strong matches"
+            elif name in in_models:
+                dropped[name] = "submodel could not be merged"
+            else:
+                dropped[name] = "not registered in its cluster"
+
+        report = {
+            "mapper": "partitioned",
+            "num_images": len(names),
+            "registered": len(merged),
+            "clusters": cluster_reports,
+            "merges": merges,
+            "dropped": dropped,
+            "elapsed_s": time.time() - start_time,
+        }
+        write_mapping_report(report, self.output_dir / "mapping_report.json")
+        return report
+
+
+def fiedler_vector(weights):
+    """Second eigenvector of the normalised graph Laplacian"""
+    degree = weights.sum(axis=1)
+    scale = 1.0 / np.sqrt(np.maximum(degree, 1e-12))
+    laplacian = np.eye(len(weights)) - scale[:, None] * weights * scale[None, :]
+    _, vectors = np.linalg.eigh(laplacian)
+    return vectors[:, 1] * scale
+
+
+def largest_model(models_dir):
+    """Sub-directory of models_dir holding the model with the most images, or None"""
+    best, best_count = None, 0
+    for model_dir in sorted(Path(models_dir).iterdir()):
+        if model_dir.is_dir() and (model_dir / "images.bin").exists():
+            count = len(ColmapModel.read(model_dir).names)
+            if count > best_count:
+                best, best_count = model_dir, count
+    return best
+
+
+def write_mapping_report(report, path):
+    """Save a mapping report and log its dropped images"""
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Mapped {report['registered']}/{report['num_images']} images "
+                f"into one model ({len(report['dropped'])} dropped, see {path})")
+    for name, reason in report["dropped"].items():
+        logger.info(f"  dropped {name}: {reason}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitioned COLMAP mapping")
+    parser.add_argument("sparse_dir", help="SfM output directory with database.db")
+    parser.add_argument("image_dir", help="Directory containing the images")
+    parser.add_argument("--max-cluster-size", type=int, default=100)
+    parser.add_argument("--overlap", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    sparse_dir = Path(args.sparse_dir)
+    mapper = PartitionedMapper(
+        sparse_dir / "database.db", args.image_dir, sparse_dir,
+        max_cluster_size=args.max_cluster_size, overlap=args.overlap, workers=args.workers
+    )
+    mapper.run(sparse_dir / "sparse" / "0")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Point Cloud I/O
+Reads and writes point clouds (PLY, PCD, XYZ) as NumPy arrays, streaming large files in chunks
+"""
+
+from itertools import islice
+import numpy as np
+from pathlib import Path
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# PLY property types and their NumPy dtypes
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "<i2", "int16": "<i2", "ushort": "<u2", "uint16": "<u2",
+    "int": "<i4", "int32": "<i4", "uint": "<u4", "uint32": "<u4",
+    "float": "<f4", "float32": "<f4", "double": "<f8", "float64": "<f8",
+}
+
+# Binary XYZRGB records: float32 x, y, z then uint8 red, green, blue (15 bytes, no header)
+XYZRGB_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+                         ("red", "u1"), ("green", "u1"), ("blue", "u1")])
+
+# Output format of each file suffix
+CLOUD_FORMATS = {".ply": "ply", ".pcd": "pcd", ".xyz": "xyz", ".bin": "xyzrgb"}
+
+# Rows formatted per string operation by the XYZ writer
+XYZ_BLOCK_ROWS = 1 << 16
+
+
+class CloudWriter:
+    def __init__(self, path, count, normals=False, colors=False, fmt=None, xyz_format="%.9g"):
+        """
+        Streaming point cloud writer
+
+        Whole chunks are written per call: binary formats as one
+        structured array, XYZ text with one string formatting operation
+        per block of rows. The header is written up front, so the total
+        point count must be known.
+
+        Args:
+            path: Output file
+            count: Total number of points that will be written
+            normals: Write normals (PLY and PCD)
+            colors: Write RGB colours
+            fmt: 'ply', 'pcd', 'xyz' or 'xyzrgb' (binary XYZRGB_DTYPE
+                records); default from the suffix
+            xyz_format: printf format of XYZ coordinates
+        """
+        self.path = Path(path)
+        self.fmt = fmt or CLOUD_FORMATS.get(self.path.suffix.lower())
+        if self.fmt not in CLOUD_FORMATS.values():
+            raise ValueError(f"Unknown point cloud format: {self.fmt or self.path.suffix}")
+
+        self.count = count
+        self.normals = normals and self.fmt in ("ply", "pcd")
+        self.colors = colors or self.fmt == "xyzrgb"
+        self.written = 0
+        columns = [xyz_format] * 3 + (["%d"] * 3 if self.colors else [])
+        self.row_format = " ".join(columns) + "\n"
+
+        self.file = open(self.path, 'wb')
+        if self.fmt == "ply":
+            self.file.write(ply_header(ply_vertex_dtype(self.normals, self.colors), count))
+        elif self.fmt == "pcd":
+            self.file.write(pcd_header(count, self.normals, self.colors))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def write(self, points, normals=None, colors=None):
+        """Append points (N x 3) with their normals and 0-255 colours"""
+        points = np.asarray(points)
+        normals = np.zeros_like(points) if self.normals and normals is None else normals
+        if self.colors:
+            colors = np.zeros_like(points) if colors is None else np.asarray(colors)
+            if colors.dtype != np.uint8:
+                colors = np.clip(np.rint(colors), 0, 255).astype(np.uint8)
+
+        if self.fmt == "xyz":
+            values = np.hstack([points, colors]) if self.colors else points
+            for start in range(0, len(values), XYZ_BLOCK_ROWS):
+                block = values[start:start + XYZ_BLOCK_ROWS]
+                text = (self.row_format * len(block)) % tuple(block.ravel().tolist())
+                self.file.write(text.encode("ascii"))
+        else:
+            if self.fmt == "ply":
+                data = ply_vertices(points, normals if self.normals else None,
+                                    colors if self.colors else None)
+            elif self.fmt == "pcd":
+                data = pcd_records(points, normals if self.normals else None,
+                                   colors if self.colors else None)
+            else:
+                data = np.zeros(len(points), dtype=XYZRGB_DTYPE)
+                data["x"], data["y"], data["z"] = points.T
+                data["red"], data["green"], data["blue"] = colors.T
+            self.file.write(data.tobytes())
+        self.written += len(points)
+
+    def close(self):
+        self.file.close()
+        if self.written != self.count:
+            raise IOError(f"Wrote {self.written} of {self.count} points to {self.path}")
+
+
+def read_ply_header(path):
+    """
+    Parse the header of a PLY file whose first element is its vertices
+
+    Returns:
+        (format, vertex count, vertex dtype, byte offset of the data)
+    """
+    fmt, count, fields, element = None, None, [], None
+    with open(path, 'rb') as f:
+        if f.readline().strip() != b"ply":
+            raise IOError(f"Not a PLY file: {path}")
+        while True:
+            line = f.readline()
+            if not line:
+                raise IOError(f"Truncated PLY header: {path}")
+            words = line.decode("ascii", errors="replace").split()
+            if not words:
+                continue
+            if words[0] == "format":
+                fmt = words[1]
+            elif words[0] == "element":
+                if element is None and words[1] != "vertex":
+                    raise IOError(f"PLY file does not start with vertices: {path}")
+                element = words[1]
+                if element == "vertex":
+                    count = int(words[2])
+            elif words[0] == "property" and element == "vertex":
+                if words[1] == "list" or words[1] not in PLY_TYPES:
+                    raise IOError(f"Unsupported vertex property '{' '.join(words[1:])}': {path}")
+                fields.append((words[-1], PLY_TYPES[words[1]]))
+            elif words[0] == "end_header":
+                break
+        offset = f.tell()
+
+    if fmt not in ("binary_little_endian", "ascii"):
+        raise IOError(f"Unsupported PLY format {fmt}: {path}")
+    if count is None:
+        raise IOError(f"PLY file has no vertices: {path}")
+    return fmt, count, np.dtype(fields), offset
+
+
+def iter_ply_chunks(path, chunk_size=1 << 20):
+    """Yield the vertices of a PLY file as structured arrays of at most chunk_size rows"""
+    fmt, count, dtype, offset = read_ply_header(path)
+    if fmt == "binary_little_endian":
+        if count == 0:
+            return
+        vertices = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+        for start in range(0, count, chunk_size):
+            yield np.array(vertices[start:start + chunk_size])
+        return
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        lines = (line.decode("ascii") for line in f)
+        for start in range(0, count, chunk_size):
+            rows = list(islice(lines, min(chunk_size, count - start)))
+            if len(rows) < min(chunk_size, count - start):
+                raise IOError(f"Truncated PLY data: {path}")
+            yield np.loadtxt(rows, dtype=dtype, ndmin=1)
+
+
+def ply_arrays(vertices):
+    """
+    (points, normals, colors) of structured PLY vertices
+
+    Points are float64, normals float32 and colours float32 in 0-255;
+    normals and colours are None when the file has none.
+    """
+    names = set(vertices.dtype.names)
+    points = np.stack([vertices[axis] for axis in "xyz"], axis=1).astype(np.float64)
+    normals = colors = None
+    if {"nx", "ny", "nz"} <= names:
+        normals = np.stack([vertices[n] for n in ("nx", "ny", "nz")], axis=1).astype(np.float32)
+    if {"red", "green", "blue"} <= names:
+        colors = np.stack([vertices[c] for c in ("red", "green", "blue")], axis=1).astype(np.float32)
+        if vertices.dtype["red"].kind == "f":
+            colors *= 255  # Float colours are stored in 0-1
+    return points, normals, colors
+
+
+def ply_vertex_dtype(normals=False, colors=False):
+    """Vertex dtype of the PLY files written here"""
+    fields = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    if normals:
+        fields += [("nx", "<f4"), ("ny", "<f4"), ("nz", "<f4")]
+    if colors:
+        fields += [("red", "u1"), ("green", "u1"), ("blue", "u1")]
+    return np.dtype(fields)
+
+
+def ply_vertices(points, normals=None, colors=None):
+    """Structured PLY vertices of points with optional normals and 0-255 colours"""
+    data = np.zeros(len(points), dtype=ply_vertex_dtype(normals is not None, colors is not None))
+    data["x"], data["y"], data["z"] = np.asarray(points).T
+    if normals is not None:
+        data["nx"], data["ny"], data["nz"] = np.asarray(normals).T
+    if colors is not None:
+        data["red"], data["green"], data["blue"] = np.asarray(colors).T
+    return data
+
+
+def ply_header(dtype, count, num_faces=None):
+    """Binary little-endian PLY header of count vertices of a vertex dtype"""
+    types = {np.dtype(t).str: name for name, t in reversed(PLY_TYPES.items())}
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {count}"]
+    header += [f"property {types[dtype[name].str]} {name}" for name in dtype.names]
+    if num_faces is not None:
+        header += [f"element face {num_faces}", "property list uchar int vertex_indices"]
+    header.append("end_header")
+    return ("\n".join(header) + "\n").encode("ascii")
+
+
+def pcd_header(count, normals=False, colors=False):
+    """Binary PCD v0.7 header of count points"""
+    fields = ["x", "y", "z"]
+    if normals:
+        fields += ["normal_x", "normal_y", "normal_z"]
+    if colors:
+        fields.append("rgb")
+    header = [
+        "# .PCD v0.7 - Point Cloud Data file format",
+        "VERSION 0.7",
+        "FIELDS " + " ".join(fields),
+        "SIZE " + " ".join(["4"] * len(fields)),
+        "TYPE " + " ".join(["F"] * len(fields)),
+        "COUNT " + " ".join(["1"] * len(fields)),
+        f"WIDTH {count}",
+        "HEIGHT 1",
+        "VIEWPOINT 0 0 0 1 0 0 0",
+        f"POINTS {count}",
+        "DATA binary",
+    ]
+    return ("\n".join(header) + "\n").encode("ascii")
+
+
+def pcd_records(points, normals=None, colors=None):
+    """Binary PCD points; colours are packed into one float, as PCL does"""
+    fields = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    if normals is not None:
+        fields += [("normal_x", "<f4"), ("normal_y", "<f4"), ("normal_z", "<f4")]
+    if colors is not None:
+        fields.append(("rgb", "<u4"))
+    data = np.zeros(len(points), dtype=fields)
+    data["x"], data["y"], data["z"] = np.asarray(points).T
+    if normals is not None:
+        data["normal_x"], data["normal_y"], data["normal_z"] = np.asarray(normals).T
+    if colors is not None:
+        rgb = np.asarray(colors, dtype=np.uint32)
+        data["rgb"] = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+    return data
+
+
+def write_cloud(path, points, normals=None, colors=None, fmt=None):
+    """Write a point cloud in one go, in the format of its suffix (see CloudWriter)"""
+    with CloudWriter(path, len(points), normals=normals is not None,
+                     colors=colors is not None, fmt=fmt) as writer:
+        writer.write(points, normals, colors)
+
+
+def write_ply(path, vertices, faces=None, normals=None, colors=None):
+    """Write a binary little-endian PLY of vertices with optional normals, colours and faces"""
+    data = ply_vertices(vertices, normals, colors)
+    with open(path, 'wb') as f:
+        f.write(ply_header(data.dtype, len(data), None if faces is None else len(faces)))
+        f.write(data.tobytes())
+        if faces is not None:
+            face_data = np.zeros(len(faces), dtype=[("n", "u1"), ("v", "<i4", (3,))])
+            face_data["n"] = 3
+            face_data["v"] = faces
+            f.write(face_data.tobytes())
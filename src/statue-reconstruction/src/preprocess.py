@@ -7,14 +7,33 @@ import cv2
 import numpy as np
 from pathlib import Path
 from ultralytics import YOLO
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import torch
+import json
 import logging
+import os
+import queue
+import struct
+import threading
+import time
+from src.dataset import ImageDataset
+from src.frames import (FrameStore, apply_orientation, decode_image, reduced_decode_flag,
+                        stored_box, stored_orientation)
+from src.segmentation_cache import SegmentationCache, file_hash
+from src.feature_store import FeatureStore, descriptor_layout, keypoints_to_array
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Sentinel marking the end of a pipeline stage's queue
+_STAGE_DONE = object()
+
 
 class ImagePreprocessor:
-    def __init__(self, input_dir, output_dir, model_path="yolov8n.pt"):
+    def __init__(self, input_dir, output_dir, model_path="yolov8n.pt",
+                 frame_cache_dir=None, seg_cache_path=None, dataset=None,
+                 frame_cache_bytes=None):
         """
         Initialize preprocessor
         
@@ -22,75 +41,329 @@ class ImagePreprocessor:
             input_dir: Directory containing input images
             output_dir: Directory for processed images
             model_path: Path to YOLO model weights
+            frame_cache_dir: Optional directory for memory-mapped decoded
+                frames, reused by later runs and worker processes
+            seg_cache_path: Optional SQLite file caching detections by
+                image content, weights and confidence threshold
+            dataset: ImageDataset shared with other stages (default: a new
+                one over input_dir)
+            frame_cache_bytes: Optional size limit of frame_cache_dir
         """
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
+        # Every stage reads frames from here, so each image is decoded once
+        self.dataset = dataset or ImageDataset(self.input_dir)
+        self.frames = FrameStore(self.input_dir, cache_dir=frame_cache_dir,
+                                 dataset=self.dataset, max_cache_bytes=frame_cache_bytes)
+        
         # Load YOLO model
+        self.model_path = model_path
         self.model = YOLO(model_path)
         
-    def resize_images(self, max_size=1920):
-        """Resize images to manageable size while preserving aspect ratio"""
+        self.seg_cache = SegmentationCache(seg_cache_path) if seg_cache_path else None
+        
+    def resize_images(self, max_size=1920, workers=1, max_in_flight=None,
+                      reduced_decode=True):
+        """
+        Resize images to manageable size while preserving aspect ratio
+        
+        Args:
+            max_size: Maximum image dimension
+            workers: Number of worker processes (1 = resize in this process)
+            max_in_flight: Maximum queued images per pool (default: 2 * workers)
+            reduced_decode: Use OpenCV's reduced JPEG decode when the source
+                is at least 2x larger than max_size
+        """
         resized_dir = self.output_dir / "resized"
         resized_dir.mkdir(exist_ok=True)
         
-        for img_path in self.input_dir.glob("*.jpg"):
-            img = cv2.imread(str(img_path))
-            h, w = img.shape[:2]
-            
-            if max(h, w) > max_size:
-                scale = max_size / max(h, w)
-                new_w, new_h = int(w * scale), int(h * scale)
-                img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-            
-            output_path = resized_dir / img_path.name
-            cv2.imwrite(str(output_path), img)
-            logger.info(f"Resized: {img_path.name}")
+        start_time = time.time()
+        report = []
         
+        if workers <= 1:
+            for img_path in self.frames.paths():
+                # Frames already decoded (or mapped) are free; otherwise decode reduced
+                img = self.frames.get(img_path) if self.frames.has_frame(img_path) else None
+                report.append(resize_image(
+                    img_path, resized_dir / img_path.name, max_size,
+                    reduced_decode=reduced_decode, img=img
+                ))
+                logger.info(f"Resized: {img_path.name}")
+        else:
+            max_in_flight = max_in_flight or 2 * workers
+            jobs = (
+                (img_path, resized_dir / img_path.name, max_size, reduced_decode,
+                 self._mapped_frame_path(img_path))
+                for img_path in self.frames.paths()
+            )
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for entry in bounded_map(executor, _resize_job, jobs, max_in_flight):
+                    report.append(entry)
+                    logger.info(f"Resized: {entry['name']}")
+        
+        self.write_resize_report(report, time.time() - start_time, workers)
         return resized_dir
     
-    def segment_object(self, confidence_threshold=0.25):
+    def _mapped_frame_path(self, img_path):
+        """Memory-mapped frame a worker can load instead of decoding, if cached"""
+        if self.frames.cache_dir is None:
+            return None
+        cached = self.frames.cache_path(img_path)
+        return cached if cached.exists() else None
+    
+    def write_resize_report(self, report, total_time, workers):
+        """Log and save the per-image resize timing report"""
+        report = sorted(report, key=lambda entry: entry["name"])
+        reduced = sum(1 for entry in report if entry["reduction"] > 1)
+        
+        summary = {
+            "num_images": len(report),
+            "workers": workers,
+            "total_s": total_time,
+            "images_per_s": len(report) / total_time if total_time > 0 else 0.0,
+            "reduced_decodes": reduced,
+            "mean_decode_s": float(np.mean([e["decode_s"] for e in report])) if report else 0.0,
+            "mean_resize_s": float(np.mean([e["resize_s"] for e in report])) if report else 0.0,
+            "mean_write_s": float(np.mean([e["write_s"] for e in report])) if report else 0.0,
+        }
+        
+        report_path = self.output_dir / "resize_report.json"
+        with open(report_path, 'w') as f:
+            json.dump({"summary": summary, "images": report}, f, indent=2)
+        
+        logger.info(f"Resized {len(report)} images in {total_time:.2f}s "
+                    f"({summary['images_per_s']:.1f} img/s, {workers} workers, "
+                    f"{reduced} reduced decodes)")
+        logger.info(f"Resize report: {report_path}")
+        self.resize_report = summary
+        return report_path
+    
+    def segment_object(self, confidence_threshold=0.25, batch_size=1,
+                       num_threads=None, queue_size=4, roi_padding=0.05):
         """
         Detect and segment the main object (statue) in images
         
+        Writes a cropped ROI image to segmented/, a COLMAP-compatible mask
+        (masks/<image name>.png, zero = ignore) and a bboxes.json sidecar.
+        The masks are passed to SfM so SIFT never spends keypoints on the
+        background.
+        
+        YOLO sees upright (EXIF-oriented) frames, but COLMAP reads the
+        stored pixels, so masks and the sidecar's boxes are in stored-pixel
+        orientation; the crops in segmented/ stay upright.
+        
+        Decoding, inference and writing run as a three-stage pipeline:
+        a decoder thread fills a bounded queue, the calling thread runs
+        batched YOLO inference, and a writer thread saves masks and images
+        so disk I/O overlaps with inference.
+        
         Args:
             confidence_threshold: Minimum confidence for detection
+            batch_size: Number of images per YOLO forward pass
+            num_threads: Intra-op thread budget for torch during this call
+                (None = torch default); the previous setting is restored
+            queue_size: Maximum batches buffered between pipeline stages
+            roi_padding: Fraction of the box size added on each side of the ROI
+        
+        Returns:
+            Directory with the COLMAP mask files
         """
         segmented_dir = self.output_dir / "segmented"
         masks_dir = self.output_dir / "masks"
         segmented_dir.mkdir(exist_ok=True)
         masks_dir.mkdir(exist_ok=True)
         
-        for img_path in self.input_dir.glob("*.jpg"):
-            img = cv2.imread(str(img_path))
-            
-            # Run YOLO detection
-            results = self.model(img, conf=confidence_threshold)
-            
-            if len(results[0].boxes) > 0:
-                # Get the largest detected object
-                boxes = results[0].boxes.xyxy.cpu().numpy()
-                confidences = results[0].boxes.conf.cpu().numpy()
-                
-                # Find box with highest confidence
-                best_idx = np.argmax(confidences)
-                x1, y1, x2, y2 = map(int, boxes[best_idx])
+        decoded = queue.Queue(maxsize=queue_size * batch_size)
+        to_write = queue.Queue(maxsize=queue_size * batch_size)
+        errors = []
+        stop = threading.Event()
+        timings = {"decode": 0.0, "inference": 0.0, "write": 0.0}
+        weights_hash = self.weights_hash() if self.seg_cache else None
+        bboxes = {}
+        
+        def decode_stage():
+            try:
+                for img_path in self.frames.paths():
+                    if stop.is_set():
+                        break
+                    t0 = time.perf_counter()
+                    img = self.frames.get(img_path)
+                    key = None
+                    if self.seg_cache:
+                        key = SegmentationCache.make_key(
+                            file_hash(img_path), weights_hash, confidence_threshold
+                        )
+                    timings["decode"] += time.perf_counter() - t0
+                    decoded.put((img_path, img, key))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                decoded.put(_STAGE_DONE)
+        
+        def write_stage():
+            while True:
+                item = to_write.get()
+                if item is _STAGE_DONE:
+                    break
+                if errors:
+                    continue  # Keep draining so the producer never blocks
+                try:
+                    t0 = time.perf_counter()
+                    img_path, img, detection = item
+                    self._write_segmentation(img_path, img, detection,
+                                             segmented_dir, masks_dir)
+                    timings["write"] += time.perf_counter() - t0
+                except Exception as e:
+                    errors.append(e)
+        
+        decoder = threading.Thread(target=decode_stage, daemon=True)
+        writer = threading.Thread(target=write_stage, daemon=True)
+        decoder.start()
+        writer.start()
+        
+        # torch's thread count is process-wide, so restore it afterwards
+        previous_threads = torch.get_num_threads()
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        threads = torch.get_num_threads()
+        
+        start_time = time.time()
+        num_images = 0
+        done = False
+        try:
+            while not done:
+                # Collect the next batch from the decoder
+                batch = []
+                while len(batch) < batch_size:
+                    item = decoded.get()
+                    if item is _STAGE_DONE:
+                        done = True
+                        break
+                    
+                    # Cache hits go straight to the writer
+                    img_path, img, key = item
+                    if key is not None:
+                        hit, detection = self.seg_cache.get(key)
+                        if hit:
+                            bboxes[img_path.name] = roi_entry(
+                                img, detection, roi_padding, self.orientation(img_path))
+                            to_write.put((img_path, img, bboxes[img_path.name]))
+                            num_images += 1
+                            continue
+                    batch.append(item)
                 
-                # Create mask
-                mask = np.zeros(img.shape[:2], dtype=np.uint8)
-                mask[y1:y2, x1:x2] = 255
+                if not batch or errors:
+                    continue
                 
-                # Apply mask to image
-                segmented = cv2.bitwise_and(img, img, mask=mask)
+                t0 = time.perf_counter()
+                results = self.model([img for _, img, _ in batch],
+                                     conf=confidence_threshold, verbose=False)
+                timings["inference"] += time.perf_counter() - t0
                 
-                # Save results
-                cv2.imwrite(str(segmented_dir / img_path.name), segmented)
-                cv2.imwrite(str(masks_dir / img_path.name), mask)
+                detections = [best_detection(result) for result in results]
+                for (img_path, img, _), detection in zip(batch, detections):
+                    bboxes[img_path.name] = roi_entry(
+                        img, detection, roi_padding, self.orientation(img_path))
+                    to_write.put((img_path, img, bboxes[img_path.name]))
+                num_images += len(batch)
                 
-                logger.info(f"Segmented: {img_path.name}")
-            else:
-                logger.warning(f"No object detected in {img_path.name}")
+                if self.seg_cache:
+                    self.seg_cache.put_many(
+                        (key, detection) for (_, _, key), detection in zip(batch, detections)
+                    )
+        finally:
+            torch.set_num_threads(previous_threads)
+            to_write.put(_STAGE_DONE)
+            writer.join()
+            
+            # Stop and drain the decoder if inference ended early
+            stop.set()
+            while not done:
+                done = decoded.get() is _STAGE_DONE
+            decoder.join()
+        
+        if errors:
+            raise errors[0]
+        
+        bbox_path = self.output_dir / "bboxes.json"
+        with open(bbox_path, 'w') as f:
+            json.dump(dict(sorted(bboxes.items())), f, indent=2)
+        
+        total_time = time.time() - start_time
+        logger.info(f"Segmented {num_images} images in {total_time:.2f}s "
+                    f"(batch={batch_size}, threads={threads}; "
+                    f"decode {timings['decode']:.2f}s, "
+                    f"inference {timings['inference']:.2f}s, "
+                    f"write {timings['write']:.2f}s)")
+        if self.seg_cache:
+            logger.info(f"Segmentation cache: {self.seg_cache.summary()}")
+        logger.info(f"ROI sidecar: {bbox_path}")
+        
+        return masks_dir
+    
+    def weights_hash(self):
+        """Hash of the YOLO weights file (falls back to the model name)"""
+        weights = Path(getattr(self.model, "ckpt_path", None) or self.model_path)
+        if weights.is_file():
+            return file_hash(weights)
+        return str(self.model_path)
+    
+    def orientation(self, img_path):
+        """EXIF orientation of an input image (1 = stored upright)"""
+        return self.dataset.metadata(img_path)["orientation"]
+    
+    def _write_segmentation(self, img_path, img, entry, segmented_dir, masks_dir):
+        """Save the ROI crop and COLMAP mask for one image (entry in stored pixels)"""
+        width, height = entry["image_size"]
+        mask = np.zeros((height, width), dtype=np.uint8)
+        
+        if entry["roi"] is None:
+            # COLMAP needs a mask for every image; keep the full frame
+            logger.warning(f"No object detected in {img_path.name}")
+            mask[:] = 255
+        else:
+            x1, y1, x2, y2 = entry["roi"]
+            mask[y1:y2, x1:x2] = 255
+            stored = stored_orientation(img, entry["orientation"])
+            crop = apply_orientation(stored[y1:y2, x1:x2], entry["orientation"])
+            cv2.imwrite(str(segmented_dir / img_path.name), crop)
+            logger.info(f"Segmented: {img_path.name}")
+        
+        # COLMAP looks up masks as <mask_path>/<image name>.png
+        cv2.imwrite(str(masks_dir / f"{img_path.name}.png"), mask)
+    
+    def resize_masks(self, masks_dir, resized_dir):
+        """
+        Resize COLMAP masks to match the resized images
+        
+        The resized images have their EXIF orientation applied, so the
+        stored-orientation masks are rotated to match before resizing.
+        
+        Args:
+            masks_dir: Full-resolution masks from segment_object
+            resized_dir: Images written by resize_images
+        
+        Returns:
+            Directory with masks matching the resized images
+        """
+        masks_resized_dir = self.output_dir / "masks_resized"
+        masks_resized_dir.mkdir(exist_ok=True)
+        
+        for img_path in self.frames.paths():
+            mask_path = Path(masks_dir) / f"{img_path.name}.png"
+            resized_path = Path(resized_dir) / img_path.name
+            if not mask_path.exists() or not resized_path.exists():
+                continue
+            
+            with Image.open(resized_path) as resized:
+                size = resized.size
+            resize_mask(mask_path, masks_resized_dir / mask_path.name, size,
+                        self.orientation(img_path))
+        
+        logger.info(f"Resized masks: {masks_resized_dir}")
+        return masks_resized_dir
     
     def undistort_images(self, camera_matrix=None, dist_coeffs=None):
         """Undistort images if camera calibration is available"""
@@ -101,8 +374,7 @@ class ImagePreprocessor:
         undistorted_dir = self.output_dir / "undistorted"
         undistorted_dir.mkdir(exist_ok=True)
         
-        for img_path in self.input_dir.glob("*.jpg"):
-            img = cv2.imread(str(img_path))
+        for img_path, img in self.frames:
             h, w = img.shape[:2]
             
             # Get optimal new camera matrix
@@ -121,33 +393,505 @@ class ImagePreprocessor:
             cv2.imwrite(str(undistorted_dir / img_path.name), undistorted)
             logger.info(f"Undistorted: {img_path.name}")
     
-    def extract_features(self, method='SIFT'):
-        """Extract and visualize features for verification"""
+    def extract_features(self, method='SIFT', visualize=True, workers=1,
+                         max_in_flight=None):
+        """
+        Extract features and persist them to a feature store
+        
+        Keypoints and descriptors are written to features/store so matching,
+        QA and benchmarking code can load them without re-detection.
+        
+        Args:
+            method: 'SIFT' or 'ORB'
+            visualize: Also write debug images with the keypoints drawn
+            workers: Number of worker processes (1 = extract in this process)
+            max_in_flight: Maximum queued images per pool (default: 2 * workers)
+        
+        Returns:
+            Path to the feature store directory
+        """
         features_dir = self.output_dir / "features"
         features_dir.mkdir(exist_ok=True)
+        draw_dir = features_dir if visualize else None
+        
+        descriptor_layout(method)  # Validate the method before starting workers
+        
+        entries = []
+        if workers <= 1:
+            for img_path, img in self.frames:
+                entries.append(extract_image_features(img_path, method, draw_dir, img=img))
+                logger.info(f"Extracted {len(entries[-1][1])} features from {img_path.name}")
+        else:
+            max_in_flight = max_in_flight or 2 * workers
+            jobs = (
+                (img_path, method, draw_dir, self._mapped_frame_path(img_path))
+                for img_path in self.frames.paths()
+            )
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for entry in bounded_map(executor, _extract_job, jobs, max_in_flight):
+                    entries.append(entry)
+                    logger.info(f"Extracted {len(entry[1])} features from {entry[0]}")
+        
+        return FeatureStore.write(features_dir / "store", method, entries)
+
+
+    def triage_frames(self, thumb_size=256, blur_ratio=0.35, dark_level=0.08,
+                      bright_level=0.92, max_clipped=0.5, dup_distance=6,
+                      dup_correlation=0.7, min_images=15):
+        """
+        Reject blurry, badly exposed and near-duplicate frames before matching
+        
+        All scores are computed vectorized over a stack of grayscale
+        thumbnails: Laplacian variance for sharpness, mean level and clipped
+        fraction for exposure, and a 64-bit DCT perceptual hash for
+        near-duplicates. Frames are considered sharpest first, so of a group
+        of near-duplicates the sharpest one is kept.
+        
+        A global hash cannot tell a repeated frame from the neighbouring
+        view of a turntable ring (both keep the silhouette), so each hash
+        match is confirmed by aligning the two thumbnails with phase
+        correlation and correlating their fine detail, which only a
+        near-identical viewpoint reproduces.
+        
+        Args:
+            thumb_size: Thumbnail side length in pixels
+            blur_ratio: Drop frames sharper than less than this fraction of
+                the median sharpness
+            dark_level, bright_level: Allowed mean brightness range (0-1)
+            max_clipped: Maximum fraction of pixels at black or white
+            dup_distance: Hamming distance at or below which two hashes are
+                duplicate candidates
+            dup_correlation: Aligned detail correlation at or above which a
+                candidate is a near-duplicate (views 30 degrees apart on a
+                ring score below 0.2, repeated frames above 0.9)
+            min_images: Never keep fewer frames than this (best ones are
+                restored if triage is too aggressive)
+        
+        Returns:
+            Path to the image list (one kept file name per line) for SfM
+        """
+        start_time = time.time()
+        paths = self.frames.paths()
+        if not paths:
+            raise ValueError(f"No images found in {self.input_dir}")
+        
+        thumbs = np.stack([
+            load_thumbnail(img_path, thumb_size,
+                           img=self.frames.get(img_path) if self.frames.has_frame(img_path) else None)
+            for img_path in paths
+        ])
+        
+        sharpness = laplacian_variance(thumbs)
+        mean_level = thumbs.mean(axis=(1, 2)) / 255.0
+        clipped = ((thumbs <= 5) | (thumbs >= 250)).mean(axis=(1, 2))
+        hashes = perceptual_hash(thumbs)
+        
+        reasons = np.full(len(paths), "", dtype=object)
+        reasons[sharpness < blur_ratio * np.median(sharpness)] = "blur"
+        exposure_bad = (mean_level < dark_level) | (mean_level > bright_level) | (clipped > max_clipped)
+        reasons[(reasons == "") & exposure_bad] = "exposure"
+        
+        # Greedy near-duplicate rejection, sharpest frames first
+        kept = np.zeros(len(paths), dtype=bool)
+        for i in np.argsort(-sharpness):
+            if reasons[i]:
+                continue
+            kept_rows = np.nonzero(kept)[0]
+            distances = np.count_nonzero(hashes[kept_rows] != hashes[i], axis=1)
+            candidates = kept_rows[distances <= dup_distance]
+            if any(aligned_correlation(thumbs[j], thumbs[i]) >= dup_correlation
+                   for j in candidates):
+                reasons[i] = "duplicate"
+                continue
+            kept[i] = True
+        
+        if kept.sum() < min_images:
+            logger.warning(f"Triage kept only {kept.sum()} frames, restoring the sharpest "
+                           f"to reach {min(min_images, len(paths))}")
+            for i in np.argsort(-sharpness):
+                if kept.sum() >= min_images:
+                    break
+                if not kept[i]:
+                    kept[i] = True
+                    reasons[i] = ""
         
+        image_list = self.output_dir / "image_list.txt"
+        with open(image_list, 'w') as f:
+            for img_path, keep in zip(paths, kept):
+                if keep:
+                    f.write(f"{img_path.name}\n")
+        
+        report = {
+            img_path.name: {
+                "kept": bool(kept[i]),
+                "reason": reasons[i] or None,
+                "sharpness": float(sharpness[i]),
+                "mean_level": float(mean_level[i]),
+                "clipped": float(clipped[i]),
+                "phash": "".join("1" if bit else "0" for bit in hashes[i]),
+            }
+            for i, img_path in enumerate(paths)
+        }
+        with open(self.output_dir / "triage.json", 'w') as f:
+            json.dump(report, f, indent=2)
+        
+        n, k = len(paths), int(kept.sum())
+        counts = {reason: int((reasons == reason).sum()) for reason in ("blur", "exposure", "duplicate")}
+        logger.info(f"Triage kept {k}/{n} frames in {time.time() - start_time:.2f}s "
+                    f"(dropped: {counts}); exhaustive pairs {n * (n - 1) // 2} -> {k * (k - 1) // 2}")
+        logger.info(f"Image list: {image_list}")
+        return image_list
+    
+
+def best_detection(result):
+    """
+    Pick the highest-confidence box from a YOLO result
+    
+    Returns:
+        ((x1, y1, x2, y2), confidence) with integer pixel coordinates,
+        or None when nothing was detected
+    """
+    if len(result.boxes) == 0:
+        return None
+    
+    boxes = result.boxes.xyxy.cpu().numpy()
+    confidences = result.boxes.conf.cpu().numpy()
+    
+    best_idx = np.argmax(confidences)
+    x1, y1, x2, y2 = map(int, boxes[best_idx])
+    return (x1, y1, x2, y2), float(confidences[best_idx])
+
+
+def roi_entry(img, detection, padding=0.0, orientation=1):
+    """
+    Build the bbox sidecar entry for one image
+    
+    Boxes and image_size are in stored pixels, as COLMAP reads the image.
+    
+    Args:
+        img: Decoded frame, EXIF orientation applied (for its size)
+        detection: ((x1, y1, x2, y2), score) in img's pixels, or None
+        padding: Fraction of the box size added on each side
+        orientation: EXIF orientation of the image
+    """
+    h, w = img.shape[:2]
+    stored_size = [h, w] if orientation in (5, 6, 7, 8) else [w, h]
+    if detection is None:
+        return {"box": None, "roi": None, "score": None, "image_size": stored_size,
+                "orientation": orientation}
+    
+    (x1, y1, x2, y2), score = detection
+    pad_x = int(round((x2 - x1) * padding))
+    pad_y = int(round((y2 - y1) * padding))
+    roi = [max(0, x1 - pad_x), max(0, y1 - pad_y),
+           min(w, x2 + pad_x), min(h, y2 + pad_y)]
+    
+    return {"box": stored_box([x1, y1, x2, y2], orientation, (w, h)),
+            "roi": stored_box(roi, orientation, (w, h)),
+            "score": score, "image_size": stored_size, "orientation": orientation}
+
+
+def resize_image(img_path, output_path, max_size, reduced_decode=True, img=None):
+    """
+    Resize a single image, returning its timing entry
+    
+    Args:
+        img_path: Source image
+        output_path: Destination path (same file name as the source)
+        max_size: Maximum image dimension
+        reduced_decode: Allow reduced JPEG decode for large sources
+        img: Already decoded frame, skips decoding when given
+    """
+    t0 = time.perf_counter()
+    reduction = 1
+    
+    if img is None:
+        # Header-only read: PIL does not decode pixels until asked
+        with Image.open(img_path) as header:
+            src_w, src_h = header.size
+        
+        flag = cv2.IMREAD_COLOR
+        if reduced_decode:
+            reduction, flag = reduced_decode_flag(max(src_w, src_h), max_size)
+        img = decode_image(img_path, flag)
+        
+        # EXIF orientation may rotate the decoded image relative to the header
+        if (img.shape[0] > img.shape[1]) != (src_h > src_w):
+            src_w, src_h = src_h, src_w
+    else:
+        src_h, src_w = img.shape[:2]
+    t1 = time.perf_counter()
+    
+    # Target size is computed from the full-resolution size so output
+    # dimensions do not depend on the decode path
+    if max(src_h, src_w) > max_size:
+        scale = max_size / max(src_h, src_w)
+        new_w, new_h = int(src_w * scale), int(src_h * scale)
+        if (img.shape[1], img.shape[0]) != (new_w, new_h):
+            img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    t2 = time.perf_counter()
+    
+    write_image(output_path, img, exif=resized_exif(img_path, (src_w, src_h), img.shape))
+    t3 = time.perf_counter()
+    
+    return {
+        "name": Path(img_path).name,
+        "source_size": [src_w, src_h],
+        "output_size": [img.shape[1], img.shape[0]],
+        "reduction": reduction,
+        "decode_s": t1 - t0,
+        "resize_s": t2 - t1,
+        "write_s": t3 - t2,
+        "total_s": t3 - t0,
+        "pid": os.getpid(),
+    }
+
+
+def resized_exif(img_path, src_size, out_shape):
+    """
+    EXIF block for a resized copy of an image
+    
+    Keeps camera make/model and focal length so COLMAP derives the same
+    focal prior (in pixels of the new size). Orientation is reset because
+    OpenCV has already applied it, pixel dimensions and focal-plane
+    resolution are scaled to the output size, and the bulky MakerNote is
+    dropped to fit a single APP1 segment.
+    
+    Returns:
+        Raw EXIF bytes, or None when the source has no usable EXIF
+    """
+    try:
+        with Image.open(img_path) as src:
+            exif = src.getexif()
+            if not exif:
+                return None
+            exif_ifd = exif.get_ifd(0x8769)
+    except Exception as e:
+        logger.debug(f"Could not read EXIF from {img_path}: {e}")
+        return None
+    
+    out_h, out_w = out_shape[:2]
+    scale = out_w / src_size[0]
+    
+    exif[0x0112] = 1  # Orientation: already applied by the decoder
+    exif_ifd.pop(0x927C, None)  # MakerNote
+    exif_ifd[0xA002] = out_w  # PixelXDimension
+    exif_ifd[0xA003] = out_h  # PixelYDimension
+    for tag in (0xA20E, 0xA20F):  # FocalPlaneX/YResolution
+        if tag in exif_ifd:
+            exif_ifd[tag] = float(exif_ifd[tag]) * scale
+    
+    data = exif.tobytes()
+    return data if len(data) < 0xFFFF - 2 else None
+
+
+def write_image(output_path, img, exif=None):
+    """
+    Write an image, embedding raw EXIF bytes as an APP1 segment for JPEGs
+    
+    Args:
+        output_path: Destination path (format from the extension)
+        img: BGR image
+        exif: Raw EXIF bytes starting with b"Exif\\0\\0", or None
+    """
+    output_path = Path(output_path)
+    if exif is None or output_path.suffix.lower() not in (".jpg", ".jpeg"):
+        cv2.imwrite(str(output_path), img)
+        return
+    
+    ok, encoded = cv2.imencode(output_path.suffix, img)
+    if not ok:
+        raise IOError(f"Could not encode image: {output_path}")
+    encoded = encoded.tobytes()
+    
+    # Insert APP1 right after the SOI marker
+    app1 = b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif
+    with open(output_path, 'wb') as f:
+        f.write(encoded[:2] + app1 + encoded[2:])
+
+
+def resize_mask(mask_path, output_path, size, orientation=1):
+    """
+    Resize a binary mask to (width, height) without blending edges, first
+    applying an EXIF orientation to it
+    """
+    mask = np.ascontiguousarray(apply_orientation(
+        decode_image(mask_path, cv2.IMREAD_GRAYSCALE), orientation))
+    if (mask.shape[1], mask.shape[0]) != tuple(size):
+        mask = cv2.resize(mask, tuple(size), interpolation=cv2.INTER_NEAREST)
+    cv2.imwrite(str(output_path), mask)
+
+
+def load_thumbnail(img_path, size, img=None):
+    """
+    Square grayscale thumbnail for triage scoring
+    
+    Args:
+        img_path: Source image
+        size: Thumbnail side length
+        img: Already decoded BGR frame, skips decoding when given
+    """
+    if img is None:
+        with Image.open(img_path) as header:
+            long_side = max(header.size)
+        factor, _ = reduced_decode_flag(long_side, size)
+        flags = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+        gray = decode_image(img_path, flags[factor])
+    else:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+
+
+def laplacian_variance(thumbs):
+    """Variance of the 4-neighbour Laplacian for a stack of thumbnails (N x H x W)"""
+    x = thumbs.astype(np.float32)
+    lap = (4 * x[:, 1:-1, 1:-1] - x[:, :-2, 1:-1] - x[:, 2:, 1:-1]
+           - x[:, 1:-1, :-2] - x[:, 1:-1, 2:])
+    return lap.var(axis=(1, 2))
+
+
+def perceptual_hash(thumbs, hash_size=8, dct_size=32):
+    """
+    64-bit DCT perceptual hashes for a stack of thumbnails
+    
+    Returns:
+        Boolean array (N x hash_size**2)
+    """
+    small = np.stack([
+        cv2.resize(t, (dct_size, dct_size), interpolation=cv2.INTER_AREA)
+        for t in thumbs
+    ]).astype(np.float32)
+    
+    # Orthonormal DCT-II basis, applied to rows and columns of every thumbnail at once
+    k = np.arange(dct_size)
+    basis = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * dct_size))
+    basis[0] /= np.sqrt(2)
+    basis *= np.sqrt(2 / dct_size)
+    coeffs = basis @ small @ basis.T
+    
+    low = coeffs[:, :hash_size, :hash_size].reshape(len(thumbs), -1)
+    # Exclude the DC term from the median so overall brightness does not matter
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return low > median
+
+
+def aligned_correlation(a, b, detail_sigma=3.0):
+    """
+    Correlation of two thumbnails' fine detail after aligning them
+    
+    The high-pass images (thumbnail minus a Gaussian blur) are aligned with
+    phase correlation and compared by zero-mean normalized correlation
+    over their overlap, so a shifted repeat of a frame scores near 1 and a
+    different viewpoint of the same object near 0.
+    
+    Args:
+        a, b: Grayscale thumbnails of the same size
+        detail_sigma: Gaussian sigma separating detail from shading
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    a -= cv2.GaussianBlur(a, (0, 0), detail_sigma)
+    b -= cv2.GaussianBlur(b, (0, 0), detail_sigma)
+    
+    height, width = a.shape
+    window = cv2.createHanningWindow((width, height), cv2.CV_32F)
+    (dx, dy), _ = cv2.phaseCorrelate(a, b, window)
+    b = cv2.warpAffine(b, np.float32([[1, 0, -dx], [0, 1, -dy]]), (width, height))
+    
+    # Compare only where both thumbnails have content
+    margin = int(np.ceil(max(abs(dx), abs(dy)))) + 4
+    if 2 * margin >= min(height, width):
+        return 0.0
+    x = a[margin:-margin, margin:-margin].ravel()
+    y = b[margin:-margin, margin:-margin].ravel()
+    x = x - x.mean()
+    y = y - y.mean()
+    denominator = np.sqrt(float(x @ x) * float(y @ y))
+    return float(x @ y) / denominator if denominator > 0 else 0.0
+
+
+def _resize_job(img_path, output_path, max_size, reduced_decode, mapped_path):
+    """Process-pool entry point for resize_image"""
+    cv2.setNumThreads(1)  # The pool provides the parallelism
+    img = np.load(mapped_path, mmap_mode="r") if mapped_path is not None else None
+    return resize_image(img_path, output_path, max_size,
+                        reduced_decode=reduced_decode, img=img)
+
+
+def bounded_map(executor, fn, jobs, max_in_flight):
+    """
+    Submit jobs to an executor keeping at most max_in_flight pending,
+    yielding results in completion order
+    
+    Args:
+        executor: concurrent.futures executor
+        fn: Callable applied to each job tuple
+        jobs: Iterable of argument tuples (consumed lazily)
+        max_in_flight: Maximum number of submitted but unfinished jobs
+    """
+    pending = set()
+    for args in jobs:
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(fn, *args))
+    
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+# Detectors are created once per process and reused for every image
+_detectors = {}
+
+
+def extract_image_features(img_path, method, draw_dir=None, img=None):
+    """
+    Detect keypoints and descriptors for one image
+    
+    Args:
+        img_path: Source image
+        method: 'SIFT' or 'ORB'
+        draw_dir: Directory for the keypoint debug image (None = skip)
+        img: Already decoded frame, skips decoding when given
+    
+    Returns:
+        (image name, keypoint array, descriptors)
+    """
+    if method not in _detectors:
         if method == 'SIFT':
-            detector = cv2.SIFT_create()
+            _detectors[method] = cv2.SIFT_create()
         elif method == 'ORB':
-            detector = cv2.ORB_create()
+            _detectors[method] = cv2.ORB_create()
         else:
             raise ValueError(f"Unknown method: {method}")
-        
-        for img_path in self.input_dir.glob("*.jpg"):
-            img = cv2.imread(str(img_path))
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            
-            # Detect keypoints
-            keypoints, descriptors = detector.detectAndCompute(gray, None)
-            
-            # Draw keypoints
-            img_keypoints = cv2.drawKeypoints(
-                img, keypoints, None, 
-                flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS
-            )
-            
-            cv2.imwrite(str(features_dir / img_path.name), img_keypoints)
-            logger.info(f"Extracted {len(keypoints)} features from {img_path.name}")
+    detector = _detectors[method]
+    
+    if img is None:
+        img = decode_image(img_path)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    
+    # Detect keypoints
+    keypoints, descriptors = detector.detectAndCompute(gray, None)
+    
+    if draw_dir is not None:
+        img_keypoints = cv2.drawKeypoints(
+            img, keypoints, None, 
+            flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS
+        )
+        cv2.imwrite(str(Path(draw_dir) / Path(img_path).name), img_keypoints)
+    
+    return Path(img_path).name, keypoints_to_array(keypoints), descriptors
+
+
+def _extract_job(img_path, method, draw_dir, mapped_path):
+    """Process-pool entry point for extract_image_features"""
+    cv2.setNumThreads(1)  # The pool provides the parallelism
+    img = np.load(mapped_path, mmap_mode="r") if mapped_path is not None else None
+    return extract_image_features(img_path, method, draw_dir, img=img)
 
 
 def main():
@@ -169,6 +913,7 @@ def main():
     logger.info("Step 3: Extracting features...")
     preprocessor.extract_features(method='SIFT')
     
+    logger.info(f"Frame store: {preprocessor.frames.summary()}")
     logger.info("Preprocessing complete!")
 
 
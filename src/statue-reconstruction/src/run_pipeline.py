@@ -4,14 +4,19 @@ Orchestrates the entire process from images to 3D model
 """
 
 import argparse
+import json
 import logging
 from pathlib import Path
 import time
+from src.colmap_runner import ColmapRunner
+from src.dataset import ImageDataset
 from src.preprocess import ImagePreprocessor
 from src.sfm import SfMPipeline
 from src.mvs import MVSPipeline
 from src.mesh import MeshGenerator
 from src.export import MeshExporter
+from src.stage_cache import StageCache, colmap_version, package_version
+from src.video_ingest import VideoIngestor, is_video
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,7 +26,12 @@ logger = logging.getLogger(__name__)
 
 
 class ReconstructionPipeline:
-    def __init__(self, input_dir, output_dir="output", name="model"):
+    def __init__(self, input_dir, output_dir="output", name="model", workers=1,
+                 image_source="raw", dense_full_res=False, matching="exhaustive",
+                 sfm_backend="colmap", ba_method="colmap", colmap_threads=None, seg_threads=None,
+                 incremental=False, prune_pairs=False, mapper="incremental",
+                 stereo_backend="colmap", fusion_backend="colmap", tiled_filter=False,
+                 cache_dir=None, cache_size_gb=20, frame_cache_dir=None, frame_cache_gb=4):
         """
         Initialize complete reconstruction pipeline
         
@@ -29,10 +39,85 @@ class ReconstructionPipeline:
             input_dir: Directory containing input images (30-40 images)
             output_dir: Directory for all outputs
             name: Name for the output model
+            workers: Number of worker processes for parallel stages
+            image_source: Images fed to SfM/MVS: 'raw' (input_dir) or
+                'resized' (the --max-size output of preprocessing)
+            dense_full_res: With 'resized', rescale the sparse model back to
+                the original resolution and run MVS on the raw images
+                (ignored when any image has a non-identity EXIF orientation)
+            matching: 'exhaustive', 'sequential', or comma-separated pair
+                planner strategies ('retrieval', 'turntable', 'covisibility')
+            sfm_backend: 'colmap' or 'native' (in-process incremental SfM)
+            ba_method: Bundle adjustment after COLMAP mapping, 'colmap' or
+                'native' (reports per-iteration cost and time)
+            colmap_threads: Threads per COLMAP call (default: all cores);
+                lets several reconstructions share one machine
+            seg_threads: torch intra-op threads for YOLO segmentation
+                (default: workers)
+            incremental: Register only images missing from an existing
+                sparse model in output_dir instead of re-mapping
+            prune_pairs: Drop weak or unverified pairs before COLMAP mapping
+            mapper: 'incremental' or 'partitioned' (cluster the match graph
+                and map the clusters in parallel, using workers)
+            stereo_backend: Depth maps from 'colmap' (patch_match_stereo,
+                needs CUDA) or 'cpu' (rectified SGBM over workers processes)
+            fusion_backend: Fuse depth maps with 'colmap' (stereo_fusion) or
+                'voxel' (in process, one depth map at a time)
+            tiled_filter: Filter the fused cloud in spatial tiles streamed
+                from disk, over workers processes
+            cache_dir: Optional stage cache directory; stages whose inputs,
+                parameters and tool versions are unchanged are restored
+                from it instead of rerun
+            cache_size_gb: Stage cache size before LRU eviction
+            frame_cache_dir: Directory of decoded frames kept on disk as
+                memory-mapped arrays, so segmentation, triage and feature
+                extraction decode each image once, per run and across runs
+                (default: <output_dir>/frames)
+            frame_cache_gb: Frame cache size limit (frames take width x
+                height x 3 bytes each; images beyond the limit are decoded
+                in every stage); 0 turns the frame cache off
         """
+        if image_source not in ("raw", "resized"):
+            raise ValueError(f"Unknown image source: {image_source}")
+        
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.name = name
+        self.workers = workers
+        self.seg_threads = seg_threads or workers
+        self.image_source = image_source
+        self.dense_full_res = dense_full_res
+        self.matching = matching
+        self.sfm_backend = sfm_backend
+        self.ba_method = ba_method
+        self.incremental = incremental
+        self.prune_pairs = prune_pairs
+        self.mapper = mapper
+        self.stereo_backend = stereo_backend
+        self.fusion_backend = fusion_backend
+        self.tiled_filter = tiled_filter
+        self.mask_dir = None
+        self.image_list = None
+        self.resized_dir = None
+        self.sfm = None
+        self.sfm_stats = None
+        
+        # One lazily evaluated image index shared by every stage
+        self.dataset = ImageDataset(
+            self.input_dir,
+            index_path=self.output_dir / "dataset_index.json"
+        )
+        
+        # One COLMAP runner so every call shares the thread budget and
+        # lands in the same resource report
+        self.colmap = ColmapRunner(
+            num_threads=colmap_threads,
+            log_dir=self.output_dir / "logs"
+        )
+        
+        self.cache = StageCache(cache_dir, max_bytes=int(cache_size_gb * 1024**3)) \
+            if cache_dir else None
+        self.cached_stages = []
         
         # Create directory structure
         self.preprocessed_dir = self.output_dir / "preprocessed"
@@ -40,15 +125,18 @@ class ReconstructionPipeline:
         self.dense_dir = self.output_dir / "dense"
         self.mesh_dir = self.output_dir / "mesh"
         self.export_dir = self.output_dir / "exports"
+        self.frame_cache_dir = None
+        self.frame_cache_bytes = int(frame_cache_gb * 1024**3)
+        if frame_cache_gb > 0:
+            self.frame_cache_dir = Path(frame_cache_dir) if frame_cache_dir \
+                else self.output_dir / "frames"
         
         # Timing
         self.timings = {}
     
     def validate_images(self):
         """Validate input images"""
-        images = list(self.input_dir.glob("*.jpg")) + \
-                 list(self.input_dir.glob("*.jpeg")) + \
-                 list(self.input_dir.glob("*.png"))
+        images = self.dataset.paths()
         
         if len(images) < 15:
             logger.warning(f"Only {len(images)} images found. Recommended: 30-40 images")
@@ -57,13 +145,17 @@ class ReconstructionPipeline:
         logger.info(f"Found {len(images)} images")
         return True
     
-    def step_preprocess(self, max_size=1920, segment=True):
+    def step_preprocess(self, max_size=1920, segment=True, seg_batch_size=1,
+                        triage=False):
         """
         Step 1: Preprocess images
         
         Args:
             max_size: Maximum image dimension
             segment: Whether to run object segmentation
+            seg_batch_size: Images per YOLO forward pass
+            triage: Drop blurry, badly exposed and near-duplicate frames
+                before SfM
         """
         logger.info("="*60)
         logger.info("STEP 1: PREPROCESSING")
@@ -71,24 +163,65 @@ class ReconstructionPipeline:
         
         start_time = time.time()
         
+        key, state = self.restore_stage(
+            "preprocess",
+            inputs=self.dataset.paths(),
+            params={"max_size": max_size, "segment": segment, "triage": triage,
+                    "image_source": self.image_source},
+            versions=self.tool_versions("opencv-python", "ultralytics", "torch"),
+            outputs=[self.preprocessed_dir]
+        )
+        if state is not None:
+            self.resized_dir = self.output_path(state["resized_dir"])
+            self.mask_dir = self.output_path(state["mask_dir"])
+            self.image_list = self.output_path(state["image_list"])
+            self.timings['preprocess'] = time.time() - start_time
+            return
+        
         preprocessor = ImagePreprocessor(
             input_dir=str(self.input_dir),
-            output_dir=str(self.preprocessed_dir)
+            output_dir=str(self.preprocessed_dir),
+            frame_cache_dir=self.frame_cache_dir,
+            frame_cache_bytes=self.frame_cache_bytes,
+            seg_cache_path=str(self.preprocessed_dir / "segmentation_cache.db"),
+            dataset=self.dataset
         )
         
         # Resize images
-        resized_dir = preprocessor.resize_images(max_size=max_size)
+        self.resized_dir = preprocessor.resize_images(
+            max_size=max_size,
+            workers=self.workers
+        )
+        
+        # Optional frame triage
+        if triage:
+            self.image_list = preprocessor.triage_frames()
         
         # Optional segmentation
         if segment:
             try:
-                preprocessor.segment_object(confidence_threshold=0.25)
+                self.mask_dir = preprocessor.segment_object(
+                    confidence_threshold=0.25,
+                    batch_size=seg_batch_size,
+                    num_threads=self.seg_threads
+                )
             except Exception as e:
                 logger.warning(f"Segmentation failed: {e}")
                 logger.warning("Continuing without segmentation")
         
+        # Masks must match the images SfM reads
+        if self.image_source == "resized" and self.mask_dir is not None:
+            self.mask_dir = preprocessor.resize_masks(self.mask_dir, self.resized_dir)
+        
         # Extract features for verification
-        preprocessor.extract_features(method='SIFT')
+        preprocessor.extract_features(method='SIFT', workers=self.workers)
+        logger.info(f"Frame store: {preprocessor.frames.summary()}")
+        
+        self.store_stage("preprocess", key, [self.preprocessed_dir], {
+            "resized_dir": self.relative_path(self.resized_dir),
+            "mask_dir": self.relative_path(self.mask_dir),
+            "image_list": self.relative_path(self.image_list),
+        })
         
         self.timings['preprocess'] = time.time() - start_time
         logger.info(f"Preprocessing completed in {self.timings['preprocess']:.2f}s")
@@ -102,16 +235,45 @@ class ReconstructionPipeline:
         start_time = time.time()
         
         sfm = SfMPipeline(
-            image_dir=str(self.input_dir),
-            output_dir=str(self.sparse_dir)
+            image_dir=str(self.sfm_image_dir()),
+            output_dir=str(self.sparse_dir),
+            mask_dir=self.mask_dir,
+            image_list=self.image_list,
+            dataset=self.sfm_dataset(),
+            backend=self.sfm_backend,
+            runner=self.colmap
         )
+        self.sfm = sfm
+        
+        # Incremental runs depend on the previous model, so never cache them
+        key, state = None, None
+        if not self.incremental:
+            key, state = self.restore_stage(
+                "sfm",
+                inputs=[*sfm.dataset.paths(), *[p for p in (self.mask_dir, self.image_list) if p]],
+                params={"matching": self.matching, "backend": self.sfm_backend,
+                        "ba_method": self.ba_method, "prune": self.prune_pairs,
+                        "mapper": self.mapper},
+                versions=self.tool_versions("numpy", "scipy", "opencv-python", colmap=True),
+                outputs=[self.sparse_dir]
+            )
+        if state is not None:
+            self.sfm_stats = state["stats"]
+            self.timings['sfm'] = time.time() - start_time
+            return True
         
         try:
-            stats = sfm.run_full_pipeline()
+            stats = sfm.run_full_pipeline(matching=self.matching, ba_method=self.ba_method,
+                                          incremental=self.incremental,
+                                          prune=self.prune_pairs,
+                                          mapper=self.mapper,
+                                          workers=self.workers)
             
             if stats and stats['num_images'] > 0:
                 logger.info(f"Reconstructed {stats['num_images']} cameras")
                 logger.info(f"Created {stats['num_points']} 3D points")
+                self.sfm_stats = stats
+                self.store_stage("sfm", key, [self.sparse_dir], {"stats": stats})
             else:
                 logger.error("SfM failed to reconstruct scene")
                 return False
@@ -119,6 +281,8 @@ class ReconstructionPipeline:
         except Exception as e:
             logger.error(f"SfM failed: {e}")
             return False
+        finally:
+            self.save_colmap_report()
         
         self.timings['sfm'] = time.time() - start_time
         logger.info(f"SfM completed in {self.timings['sfm']:.2f}s")
@@ -132,27 +296,156 @@ class ReconstructionPipeline:
         
         start_time = time.time()
         
-        mvs = MVSPipeline(
-            sparse_dir=str(self.sparse_dir),
-            output_dir=str(self.output_dir)
-        )
-        
         try:
+            model_root, image_dir = self.mvs_inputs()
+            images = self.dataset if Path(image_dir) == self.input_dir else self.sfm_dataset()
+            packages = ["open3d"] + (["opencv-python"] if self.stereo_backend == "cpu" else [])
+            if self.fusion_backend == "voxel" or self.tiled_filter:
+                packages += ["numpy", "scipy"]
+            
+            key, state = self.restore_stage(
+                "mvs",
+                inputs=[Path(model_root) / "0", *images.paths()],
+                params={"dense_full_res": self.dense_full_res,
+                        "stereo_backend": self.stereo_backend,
+                        "fusion_backend": self.fusion_backend,
+                        "tiled_filter": self.tiled_filter},
+                versions=self.tool_versions(*packages, colmap=True),
+                outputs=[self.dense_dir]
+            )
+            if state is not None:
+                self.timings['mvs'] = time.time() - start_time
+                return True, self.output_path(state["dense_ply"])
+            
+            mvs = MVSPipeline(
+                sparse_dir=str(model_root),
+                output_dir=str(self.output_dir),
+                runner=self.colmap,
+                stereo_backend=self.stereo_backend,
+                fusion_backend=self.fusion_backend,
+                workers=self.workers,
+                tiled_filter=self.tiled_filter
+            )
+            
             dense_ply = mvs.run_full_pipeline(
-                image_dir=str(self.input_dir),
+                image_dir=str(image_dir),
                 visualize=False
             )
             
             logger.info(f"Dense point cloud created: {dense_ply}")
+            self.store_stage("mvs", key, [self.dense_dir],
+                             {"dense_ply": self.relative_path(dense_ply)})
             
         except Exception as e:
             logger.error(f"MVS failed: {e}")
             return False, None
+        finally:
+            self.save_colmap_report()
         
         self.timings['mvs'] = time.time() - start_time
         logger.info(f"MVS completed in {self.timings['mvs']:.2f}s")
         return True, dense_ply
     
+    def restore_stage(self, stage, inputs, params, versions, outputs):
+        """
+        Key a stage run and restore its outputs from the stage cache
+        
+        Args:
+            stage: Stage name
+            inputs: Input files or directories the stage reads
+            params: Parameters that change the stage's output
+            versions: Tool versions (see tool_versions)
+            outputs: Output directories under output_dir
+        
+        Returns:
+            (key, state) where state is None unless the stage was restored
+        """
+        if self.cache is None:
+            return None, None
+        
+        key = self.cache.key(stage, inputs, params, versions)
+        outputs = [Path(output).relative_to(self.output_dir) for output in outputs]
+        state = self.cache.restore(key, self.output_dir, outputs)
+        if state is not None:
+            self.cached_stages.append(stage)
+            logger.info(f"Restored {stage} from the stage cache ({key[:12]})")
+        return key, state
+    
+    def store_stage(self, stage, key, outputs, state):
+        """Save a finished stage's outputs and state in the stage cache"""
+        if self.cache is None or key is None:
+            return
+        outputs = [Path(output).relative_to(self.output_dir) for output in outputs]
+        self.cache.store(stage, key, self.output_dir, outputs, state)
+    
+    def tool_versions(self, *packages, colmap=False):
+        """Versions of the Python packages (and COLMAP) a stage depends on"""
+        versions = {package: package_version(package) for package in packages}
+        if colmap:
+            versions["colmap"] = colmap_version()
+        return versions
+    
+    def relative_path(self, path):
+        """Path under output_dir as stored in stage cache state"""
+        return str(Path(path).relative_to(self.output_dir)) if path else None
+    
+    def output_path(self, relative):
+        return self.output_dir / relative if relative else None
+    
+    def save_colmap_report(self):
+        """Write per-call COLMAP timings, CPU time and peak memory"""
+        if self.colmap.records:
+            self.colmap.save_report(self.output_dir / "colmap_runs.json")
+    
+    def sfm_image_dir(self):
+        """Images SfM reconstructs from"""
+        if self.image_source == "resized":
+            if self.resized_dir is None:
+                raise RuntimeError("image_source='resized' requires step_preprocess first")
+            return self.resized_dir
+        return self.input_dir
+    
+    def sfm_dataset(self):
+        """Dataset over the images SfM reads (resized copies get their own index)"""
+        if self.image_source == "resized":
+            return ImageDataset(
+                self.resized_dir,
+                index_path=self.preprocessed_dir / "resized_index.json"
+            )
+        return self.dataset
+    
+    def mvs_inputs(self):
+        """
+        Sparse model root and image directory for MVS
+        
+        MVS uses the same images as SfM so intrinsics match. With
+        dense_full_res the model is rescaled to the stored (header) sizes
+        of the original images and MVS reads the raw images. COLMAP reads
+        those unrotated while the resized images have EXIF orientation
+        applied, so full resolution is refused when any image is rotated.
+        """
+        model_root = self.sfm.sparse_dir if self.sfm else self.sparse_dir / "sparse"
+        
+        if self.image_source != "resized":
+            return model_root, self.input_dir
+        if not self.dense_full_res:
+            return model_root, self.resized_dir
+        
+        with open(self.preprocessed_dir / "resize_report.json") as f:
+            report = json.load(f)
+        metadata = {entry["name"]: self.dataset.metadata(self.input_dir / entry["name"])
+                    for entry in report["images"]}
+        rotated = sorted(name for name, meta in metadata.items() if meta["orientation"] != 1)
+        if rotated:
+            logger.warning(f"{len(rotated)} images have EXIF orientation (e.g. {rotated[0]}), "
+                           f"which COLMAP ignores; running MVS on the resized images")
+            return model_root, self.resized_dir
+        image_sizes = {name: (meta["width"], meta["height"]) for name, meta in metadata.items()}
+        
+        full_res_root = self.sparse_dir / "full_res"
+        self.sfm.rescale_model(image_sizes, full_res_root / "0")
+        return full_res_root, self.input_dir
+    
     def step_mesh(self, dense_ply, method="poisson", simplify=True):
         """
         Step 4: Generate Mesh
@@ -168,6 +461,17 @@ class ReconstructionPipeline:
         
         start_time = time.time()
         
+        key, state = self.restore_stage(
+            "mesh",
+            inputs=[dense_ply],
+            params={"method": method, "simplify": simplify},
+            versions=self.tool_versions("open3d", "trimesh"),
+            outputs=[self.mesh_dir]
+        )
+        if state is not None:
+            self.timings['mesh'] = time.time() - start_time
+            return True, self.output_path(state["mesh_path"])
+        
         mesh_gen = MeshGenerator(
             dense_dir=str(self.dense_dir),
             output_dir=str(self.output_dir)
@@ -182,6 +486,8 @@ class ReconstructionPipeline:
             )
             
             logger.info(f"Mesh generated: {mesh_path}")
+            self.store_stage("mesh", key, [self.mesh_dir],
+                             {"mesh_path": self.relative_path(mesh_path)})
             
         except Exception as e:
             logger.error(f"Mesh generation failed: {e}")
@@ -199,6 +505,17 @@ class ReconstructionPipeline:
         
         start_time = time.time()
         
+        key, state = self.restore_stage(
+            "export",
+            inputs=[mesh_path],
+            params={"name": self.name},
+            versions=self.tool_versions("open3d", "trimesh", "usd-core"),
+            outputs=[self.export_dir]
+        )
+        if state is not None:
+            self.timings['export'] = time.time() - start_time
+            return True
+        
         exporter = MeshExporter(output_dir=str(self.output_dir))
         
         try:
@@ -220,6 +537,8 @@ class ReconstructionPipeline:
                 logger.info(f"\nWeb viewer created: {viewer_path}")
                 logger.info("Open in browser to view the 3D model")
             
+            self.store_stage("export", key, [self.export_dir], {})
+            
         except Exception as e:
             logger.error(f"Export failed: {e}")
             return False
@@ -229,7 +548,8 @@ class ReconstructionPipeline:
         return True
     
     def run_full_pipeline(self, max_size=1920, segment=True, 
-                         mesh_method="poisson", simplify=True):
+                         mesh_method="poisson", simplify=True, seg_batch_size=1,
+                         triage=False):
         """
         Run complete reconstruction pipeline
         
@@ -238,6 +558,8 @@ class ReconstructionPipeline:
             segment: Whether to segment objects
             mesh_method: 'poisson' or 'ball_pivoting'
             simplify: Whether to simplify final mesh
+            seg_batch_size: Images per YOLO forward pass during segmentation
+            triage: Drop blurry, badly exposed and near-duplicate frames
         """
         logger.info("\n" + "="*60)
         logger.info("STARTING COMPLETE 3D RECONSTRUCTION PIPELINE")
@@ -250,7 +572,8 @@ class ReconstructionPipeline:
             logger.warning("Image validation warning - continuing anyway")
         
         # Step 1: Preprocess
-        self.step_preprocess(max_size=max_size, segment=segment)
+        self.step_preprocess(max_size=max_size, segment=segment,
+                             seg_batch_size=seg_batch_size, triage=triage)
         
         # Step 2: SfM
         if not self.step_sfm():
@@ -288,6 +611,15 @@ class ReconstructionPipeline:
         logger.info("\nStage timings:")
         for stage, duration in self.timings.items():
             logger.info(f"  {stage}: {duration:.2f}s")
+        colmap = self.colmap.summary()
+        if colmap["calls"]:
+            logger.info(f"\nCOLMAP: {colmap['calls']} calls, {colmap['wall_s']:.1f}s wall, "
+                        f"{colmap['cpu_s']:.1f}s CPU, peak RSS {colmap['peak_rss_mb']:.0f} MB")
+        if self.cache is not None:
+            logger.info(f"\nRestored from stage cache: {', '.join(self.cached_stages) or 'none'} "
+                        f"({self.cache.summary()})")
+        logger.info(f"\nSfM/MVS images: {self.image_source} (max_size={max_size}"
+                    f"{', dense at full resolution' if self.dense_full_res else ''})")
         
         logger.info(f"\nFinal outputs in: {self.export_dir}")
         logger.info("\nNext steps:")
@@ -299,13 +631,104 @@ class ReconstructionPipeline:
         return True
 
 
+def run_max_size_sweep(input_dir, output_dir, max_sizes, segment=True,
+                       dense=True, seg_batch_size=1, triage=False, **pipeline_kwargs):
+    """
+    Compare preprocessing/SfM/MVS speed at several max_size values
+    
+    Each size runs in its own output_dir/max_<size> with SfM and MVS
+    reading the resized images, so the stage timings show what the
+    resolution costs.
+    
+    Args:
+        input_dir: Directory containing input images
+        output_dir: Root directory for the per-size runs
+        max_sizes: Iterable of maximum image dimensions
+        segment: Whether to run object segmentation
+        dense: Also run MVS (otherwise stop after SfM)
+        seg_batch_size: Images per YOLO forward pass
+        triage: Drop blurry, badly exposed and near-duplicate frames
+        **pipeline_kwargs: ReconstructionPipeline options applied to every
+            size (workers, matching, stereo_backend, frame_cache_dir, ...)
+    
+    Returns:
+        List of per-size result dicts
+    """
+    # Each size must map its own resized images from scratch
+    unsupported = {"image_source", "dense_full_res", "incremental"} & {
+        key for key, value in pipeline_kwargs.items() if value}
+    if unsupported:
+        raise ValueError(f"Not supported by the max size sweep: {', '.join(sorted(unsupported))}")
+    
+    # Every size decodes the same inputs, so they share one frame cache
+    if not pipeline_kwargs.get("frame_cache_dir"):
+        pipeline_kwargs["frame_cache_dir"] = Path(output_dir) / "frames"
+    
+    results = []
+    
+    for max_size in sorted(max_sizes, reverse=True):
+        logger.info("\n" + "="*60)
+        logger.info(f"MAX SIZE SWEEP: {max_size}")
+        logger.info("="*60)
+        
+        pipeline = ReconstructionPipeline(
+            input_dir=input_dir,
+            output_dir=Path(output_dir) / f"max_{max_size}",
+            image_source="resized",
+            **pipeline_kwargs
+        )
+        pipeline.step_preprocess(max_size=max_size, segment=segment,
+                                 seg_batch_size=seg_batch_size, triage=triage)
+        ok = pipeline.step_sfm()
+        if ok and dense:
+            ok, _ = pipeline.step_mvs()
+        
+        stats = pipeline.sfm_stats or {}
+        results.append({
+            "max_size": max_size,
+            "success": ok,
+            "timings": dict(pipeline.timings),
+            "total_s": sum(pipeline.timings.values()),
+            "num_images": stats.get("num_images", 0),
+            "num_points": stats.get("num_points", 0),
+            "colmap": pipeline.colmap.summary(),
+        })
+    
+    # Speedups are relative to the largest size
+    baseline = results[0]["total_s"] if results else 0.0
+    logger.info("\n" + "="*60)
+    logger.info("MAX SIZE SWEEP SUMMARY")
+    logger.info("="*60)
+    logger.info(f"{'max_size':>9} {'preprocess':>11} {'sfm':>9} {'mvs':>9} "
+                f"{'total':>9} {'speedup':>8} {'images':>7} {'points':>8}")
+    for result in results:
+        timings = result["timings"]
+        speedup = baseline / result["total_s"] if result["total_s"] > 0 else 0.0
+        result["speedup"] = speedup
+        logger.info(f"{result['max_size']:>9} "
+                    f"{timings.get('preprocess', 0):>10.1f}s "
+                    f"{timings.get('sfm', 0):>8.1f}s "
+                    f"{timings.get('mvs', 0):>8.1f}s "
+                    f"{result['total_s']:>8.1f}s "
+                    f"{speedup:>7.2f}x "
+                    f"{result['num_images']:>7} {result['num_points']:>8}")
+    
+    report_path = Path(output_dir) / "max_size_sweep.json"
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"\nSweep report: {report_path}")
+    
+    return results
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="3D Reconstruction Pipeline - Convert images to 3D models"
     )
     parser.add_argument(
         "input_dir",
-        help="Directory containing input images (30-40 recommended)"
+        help="Directory containing input images (30-40 recommended) or a walk-around video"
     )
     parser.add_argument(
         "-o", "--output",
@@ -323,11 +746,141 @@ def main():
         default=1920,
         help="Maximum image dimension (default: 1920)"
     )
+    parser.add_argument(
+        "--image-source",
+        choices=["raw", "resized"],
+        default="raw",
+        help="Images used by SfM/MVS: raw inputs or the --max-size output (default: raw)"
+    )
+    parser.add_argument(
+        "--dense-full-res",
+        action="store_true",
+        help="With --image-source resized, rescale the model and run MVS on raw images"
+    )
+    parser.add_argument(
+        "--max-size-sweep",
+        help="Comma-separated max sizes to benchmark preprocessing/SfM/MVS (e.g. 960,1440,1920)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes for parallel stages (default: 1)"
+    )
     parser.add_argument(
         "--no-segment",
         action="store_true",
         help="Skip object segmentation"
     )
+    parser.add_argument(
+        "--triage",
+        action="store_true",
+        help="Drop blurry, badly exposed and near-duplicate frames before SfM"
+    )
+    parser.add_argument(
+        "--seg-batch-size",
+        type=int,
+        default=1,
+        help="Images per YOLO forward pass during segmentation (default: 1)"
+    )
+    parser.add_argument(
+        "--seg-threads",
+        type=int,
+        default=None,
+        help="torch threads for YOLO segmentation (default: --workers)"
+    )
+    parser.add_argument(
+        "--matching",
+        default="exhaustive",
+        help="'exhaustive', 'sequential', or pair planner strategies such as "
+             "'retrieval,turntable' for near-linear matching (default: exhaustive)"
+    )
+    parser.add_argument(
+        "--sfm-backend",
+        choices=["colmap", "native"],
+        default="colmap",
+        help="SfM engine: the colmap binary or the in-process NumPy/OpenCV "
+             "engine (default: colmap)"
+    )
+    parser.add_argument(
+        "--ba-method",
+        choices=["colmap", "native"],
+        default="colmap",
+        help="Bundle adjustment after COLMAP mapping (default: colmap)"
+    )
+    parser.add_argument(
+        "--mapper",
+        choices=["incremental", "partitioned"],
+        default="incremental",
+        help="COLMAP mapping: one incremental mapper, or clusters mapped in "
+             "parallel (--workers) and merged, for large captures "
+             "(default: incremental)"
+    )
+    parser.add_argument(
+        "--stereo-backend",
+        choices=["colmap", "cpu"],
+        default="colmap",
+        help="Depth maps from COLMAP's patch_match_stereo (needs CUDA) or the "
+             "CPU engine, run over --workers processes (default: colmap)"
+    )
+    parser.add_argument(
+        "--fusion-backend",
+        choices=["colmap", "voxel"],
+        default="colmap",
+        help="Fuse depth maps with COLMAP's stereo_fusion or in process through "
+             "a sparse voxel map, one depth map at a time (default: colmap)"
+    )
+    parser.add_argument(
+        "--tiled-filter",
+        action="store_true",
+        help="Filter the fused cloud in spatial tiles streamed from disk, over "
+             "--workers processes (for clouds too large for memory)"
+    )
+    parser.add_argument(
+        "--prune-pairs",
+        action="store_true",
+        help="Drop weak or unverified image pairs before mapping"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Register images added since the last run into the existing "
+             "sparse model instead of reconstructing from scratch"
+    )
+    parser.add_argument(
+        "--colmap-threads",
+        type=int,
+        default=None,
+        help="Threads per COLMAP call, to share the machine with other "
+             "reconstructions (default: all cores)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Stage cache directory; unchanged stages are restored from it. "
+             "Entries are full copies of stage outputs (default: no cache)"
+    )
+    parser.add_argument(
+        "--cache-size-gb",
+        type=float,
+        default=20,
+        help="Stage cache size before least-recently-used eviction (default: 20)"
+    )
+    parser.add_argument(
+        "--frame-cache",
+        default=None,
+        help="Directory of memory-mapped decoded frames shared by the "
+             "preprocessing stages, so each image is decoded once "
+             "(default: <output>/frames)"
+    )
+    parser.add_argument(
+        "--frame-cache-gb",
+        type=float,
+        default=4,
+        help="Frame cache size limit; frames are uncompressed, width x height "
+             "x 3 bytes each, and images beyond the limit are decoded in every "
+             "stage. 0 turns the frame cache off (default: 4)"
+    )
     parser.add_argument(
         "--mesh-method",
         choices=["poisson", "ball_pivoting"],
@@ -342,18 +895,64 @@ def main():
     
     args = parser.parse_args()
     
+    # A video input is turned into keyframes first
+    if is_video(args.input_dir):
+        keyframe_dir = Path(args.output) / "keyframes"
+        VideoIngestor(args.input_dir, keyframe_dir).run()
+        args.input_dir = str(keyframe_dir)
+    
+    # Options shared by a single run and every run of a max size sweep
+    pipeline_kwargs = dict(
+        workers=args.workers,
+        matching=args.matching,
+        sfm_backend=args.sfm_backend,
+        ba_method=args.ba_method,
+        colmap_threads=args.colmap_threads,
+        seg_threads=args.seg_threads,
+        prune_pairs=args.prune_pairs,
+        mapper=args.mapper,
+        stereo_backend=args.stereo_backend,
+        fusion_backend=args.fusion_backend,
+        tiled_filter=args.tiled_filter,
+        cache_dir=args.cache_dir,
+        cache_size_gb=args.cache_size_gb,
+        frame_cache_dir=args.frame_cache,
+        frame_cache_gb=args.frame_cache_gb
+    )
+    
+    if args.max_size_sweep:
+        if args.image_source != "raw" or args.dense_full_res or args.incremental:
+            parser.error("--max-size-sweep always maps the resized images from scratch; "
+                         "drop --image-source, --dense-full-res and --incremental")
+        run_max_size_sweep(
+            input_dir=args.input_dir,
+            output_dir=args.output,
+            max_sizes=[int(size) for size in args.max_size_sweep.split(",")],
+            segment=not args.no_segment,
+            seg_batch_size=args.seg_batch_size,
+            triage=args.triage,
+            **pipeline_kwargs
+        )
+        return
+    
     # Create and run pipeline
     pipeline = ReconstructionPipeline(
         input_dir=args.input_dir,
         output_dir=args.output,
-        name=args.name
+        name=args.name,
+        image_source=args.image_source,
+        dense_full_res=args.dense_full_res,
+        incremental=args.incremental,
+        **pipeline_kwargs
     )
     
     success = pipeline.run_full_pipeline(
         max_size=args.max_size,
         segment=not args.no_segment,
         mesh_method=args.mesh_method,
-        simplify=not args.no_simplify
+        simplify=not args.no_simplify,
+        seg_batch_size=args.seg_batch_size,
+        triage=args.triage
     )
     
     if success:
@@ -0,0 +1,140 @@
+"""
+Segmentation Result Cache
+Content-addressed store of YOLO detections so unchanged photos skip inference
+"""
+
+from pathlib import Path
+import hashlib
+import logging
+import sqlite3
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class SegmentationCache:
+    def __init__(self, db_path, max_entries=100000):
+        """
+        Initialize segmentation cache
+
+        The detected mask is always an axis-aligned rectangle, so each entry
+        is just the box and its score (or an empty row for "no detection").
+
+        Args:
+            db_path: SQLite file holding the cache
+            max_entries: Entries kept before least-recently-used eviction
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS detections ("
+            " key TEXT PRIMARY KEY,"
+            " x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,"
+            " score REAL,"
+            " last_access REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS detections_access ON detections (last_access)"
+        )
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @staticmethod
+    def make_key(image_hash, weights_hash, confidence_threshold):
+        """Combine image content, model weights and threshold into one key"""
+        return hashlib.sha256(
+            f"{image_hash}:{weights_hash}:{confidence_threshold:.6f}".encode()
+        ).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached detection
+
+        Returns:
+            (hit, detection) where detection is ((x1, y1, x2, y2), score)
+            or None when the cached result is "no object detected"
+        """
+        row = self.conn.execute(
+            "SELECT x1, y1, x2, y2, score FROM detections WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        self.conn.execute(
+            "UPDATE detections SET last_access = ? WHERE key = ?", (time.time(), key)
+        )
+        x1, y1, x2, y2, score = row
+        if score is None:
+            return True, None
+        return True, ((x1, y1, x2, y2), score)
+
+    def put_many(self, entries):
+        """
+        Store detections and evict the least recently used entries over the limit
+
+        Args:
+            entries: Iterable of (key, detection) with detection as returned by get
+        """
+        now = time.time()
+        rows = []
+        for key, detection in entries:
+            if detection is None:
+                rows.append((key, None, None, None, None, None, now))
+            else:
+                (x1, y1, x2, y2), score = detection
+                rows.append((key, x1, y1, x2, y2, score, now))
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries beyond max_entries"""
+        count = self.conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM detections WHERE key IN ("
+                " SELECT key FROM detections ORDER BY last_access LIMIT ?)",
+                (excess,)
+            )
+            self.evicted += excess
+
+    def summary(self):
+        """Return hit/miss/eviction counters and cache size"""
+        self.conn.commit()
+        entries = self.conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+            "entries": entries,
+            "size_bytes": self.db_path.stat().st_size if self.db_path.exists() else 0,
+        }
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file's bytes (hashing is far cheaper than decoding)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
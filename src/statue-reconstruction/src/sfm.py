@@ -7,13 +7,24 @@ import subprocess
 import logging
 from pathlib import Path
 import json
+import time
+import numpy as np
+from src.bundle_adjust import BundleAdjuster, adjust_model
+from src.colmap_database import ColmapDatabase
+from src.colmap_io import ColmapModel
+from src.colmap_runner import ColmapRunner
+from src.dataset import ImageDataset
+from src.incremental_sfm import IncrementalSfM
+from src.pair_planner import PairPlanner
+from src.partitioned_mapping import PartitionedMapper, write_mapping_report
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 class SfMPipeline:
-    def __init__(self, image_dir, output_dir, colmap_path="colmap"):
+    def __init__(self, image_dir, output_dir, colmap_path="colmap", mask_dir=None,
+                 image_list=None, dataset=None, backend="colmap", runner=None):
         """
         Initialize SfM pipeline with COLMAP
         
@@ -21,23 +32,47 @@ class SfMPipeline:
             image_dir: Directory containing input images
             output_dir: Directory for COLMAP output
             colmap_path: Path to COLMAP executable
+            mask_dir: Optional COLMAP mask directory (<image name>.png,
+                zero pixels are ignored during feature extraction)
+            image_list: Optional text file of image names to use (e.g. the
+                frames kept by ImagePreprocessor.triage_frames)
+            dataset: ImageDataset over image_dir (default: a new one)
+            backend: 'colmap' (the colmap binary) or 'native' (the in-process
+                IncrementalSfM engine, same sparse/0 output)
+            runner: ColmapRunner shared with other stages (default: a new one)
         """
+        if backend not in ("colmap", "native"):
+            raise ValueError(f"Unknown SfM backend: {backend}")
+        
         self.image_dir = Path(image_dir)
+        self.mask_dir = Path(mask_dir) if mask_dir else None
+        self.image_list = Path(image_list) if image_list else None
+        self.dataset = dataset or ImageDataset(self.image_dir)
         self.output_dir = Path(output_dir)
         self.database_path = self.output_dir / "database.db"
         self.sparse_dir = self.output_dir / "sparse"
         self.colmap_path = colmap_path
+        self.runner = runner or ColmapRunner()
+        self.backend = backend
         
         # Create directories
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.sparse_dir.mkdir(exist_ok=True)
     
-    def feature_extraction(self, camera_model="SIMPLE_RADIAL"):
+    def feature_extraction(self, camera_model="SIMPLE_RADIAL", use_priors=True, image_names=None):
         """
         Extract features from images
         
+        With use_priors, images are grouped by camera (make, model, size and
+        EXIF focal length) and each group is extracted with a shared camera
+        initialised from its EXIF focal length, so the mapper starts from
+        good intrinsics instead of guessing them.
+        
         Args:
             camera_model: Camera model (SIMPLE_RADIAL, PINHOLE, etc.)
+            use_priors: Pass per-camera EXIF focal priors to COLMAP
+            image_names: Optional subset to extract (e.g. new_images());
+                overrides image_list
         """
         logger.info("Extracting features...")
         
@@ -49,15 +84,64 @@ class SfMPipeline:
             "--SiftExtraction.max_num_features", "8192"
         ]
         
-        subprocess.run(cmd, check=True)
+        # Keep keypoints on the segmented object only
+        if self.mask_dir is not None and self.mask_dir.exists():
+            logger.info(f"Using masks from {self.mask_dir}")
+            cmd += ["--ImageReader.mask_path", str(self.mask_dir)]
+        
+        # Only frames that survived triage enter the database (and matching)
+        selected = None
+        extract_list = self.image_list
+        if image_names is not None:
+            selected = set(image_names)
+            extract_list = self.output_dir / "image_list_extract.txt"
+            with open(extract_list, 'w') as f:
+                f.write("\n".join(sorted(selected)) + "\n")
+        elif self.image_list is not None:
+            logger.info(f"Using image list {self.image_list}")
+            selected = set(self.selected_images())
+        
+        groups = self.dataset.camera_groups() if use_priors else []
+        if not any(group["focal_px"] for group in groups):
+            if selected is not None:
+                cmd += ["--image_list_path", str(extract_list)]
+            self.runner.run(cmd)
+            logger.info("Feature extraction complete")
+            return
+        
+        for i, group in enumerate(groups):
+            names = [n for n in group["names"] if selected is None or n in selected]
+            if not names:
+                continue
+            
+            list_path = self.output_dir / f"image_list_camera{i}.txt"
+            with open(list_path, 'w') as f:
+                f.write("\n".join(names) + "\n")
+            
+            group_cmd = cmd + ["--image_list_path", str(list_path)]
+            params = prior_camera_params(camera_model, group["focal_px"],
+                                         group["width"], group["height"])
+            if params is not None:
+                group_cmd += ["--ImageReader.single_camera", "1",
+                              "--ImageReader.camera_params", params]
+                logger.info(f"Camera {i}: {len(names)} images, focal prior "
+                            f"{group['focal_px']:.1f}px ({group['make']} {group['model']})")
+            else:
+                logger.info(f"Camera {i}: {len(names)} images without focal prior")
+            
+            self.runner.run(group_cmd, stage=f"feature_extractor_camera{i}")
+        
         logger.info("Feature extraction complete")
     
-    def feature_matching(self, matching_type="exhaustive"):
+    def feature_matching(self, matching_type="exhaustive", pairs_path=None, overlap=10):
         """
         Match features between image pairs
         
         Args:
-            matching_type: 'exhaustive', 'sequential', or 'spatial'
+            matching_type: 'exhaustive', 'sequential', or 'pairs' (match
+                only the pairs listed in pairs_path, see plan_pairs)
+            pairs_path: Pair list for matching_type='pairs'
+            overlap: Neighbours per image for sequential matching
         """
         logger.info(f"Matching features ({matching_type})...")
         
@@ -71,17 +155,276 @@ class SfMPipeline:
             cmd = [
                 self.colmap_path, "sequential_matcher",
                 "--database_path", str(self.database_path),
-                "--SequentialMatching.overlap", "10"
+                "--SequentialMatching.overlap", str(overlap)
+            ]
+        elif matching_type == "pairs":
+            if pairs_path is None:
+                raise ValueError("matching_type='pairs' requires pairs_path")
+            cmd = [
+                self.colmap_path, "matches_importer",
+                "--database_path", str(self.database_path),
+                "--match_list_path", str(pairs_path),
+                "--match_type", "pairs",
+                "--SiftMatching.guided_matching", "1"
             ]
         else:
             raise ValueError(f"Unknown matching type: {matching_type}")
         
-        subprocess.run(cmd, check=True)
+        self.runner.run(cmd)
         logger.info("Feature matching complete")
     
-    def sparse_reconstruction(self):
-        """Perform sparse 3D reconstruction"""
-        logger.info("Running sparse reconstruction...")
+    def plan_pairs(self, strategies=("retrieval", "turntable"), k=10, overlap=5,
+                   circular=True, min_shared=15):
+        """
+        Plan a candidate pair list instead of matching every pair
+        
+        Args:
+            strategies: PairPlanner strategies ('retrieval', 'turntable',
+                'covisibility'); covisibility uses the existing sparse/0
+            k: Retrieval neighbours per image
+            overlap: Turntable neighbours per image
+            circular: Wrap the turntable ordering around
+            min_shared: Shared points for a covisibility pair
+        
+        Returns:
+            Path to the pair list (matches_importer format)
+        """
+        planner = PairPlanner(self.image_dir, dataset=self.dataset,
+                              image_names=self.selected_images())
+        pairs = planner.plan(
+            strategies=strategies, k=k, overlap=overlap, circular=circular,
+            model_dir=self.sparse_dir / "0", min_shared=min_shared
+        )
+        return planner.write(pairs, self.output_dir / "pairs.txt")
+    
+    def selected_images(self):
+        """Image names from image_list, or None to use every image"""
+        if self.image_list is None:
+            return None
+        with open(self.image_list) as f:
+            return [line.strip() for line in f if line.strip()]
+    
+    def new_images(self):
+        """Images not yet registered in sparse/0 (all of them without a model)"""
+        names = self.selected_images()
+        if names is None:
+            names = self.dataset.names()
+        
+        model_dir = self.sparse_dir / "0"
+        if not (model_dir / "images.bin").exists():
+            return names
+        
+        registered = set(ColmapModel.read(model_dir).names)
+        return [name for name in names if name not in registered]
+    
+    def incremental_pairs(self, new_names, strategies=("retrieval", "turntable"),
+                          k=10, overlap=5):
+        """
+        Pairs between new images and their likely neighbours
+        
+        Only pairs with at least one new image are kept; everything else
+        is already matched in the database.
+        
+        Args:
+            new_names: Newly added image names
+            strategies: PairPlanner strategies, or ('exhaustive',) to pair
+                every new image with every image
+            k: Retrieval neighbours per image
+            overlap: Turntable neighbours per image
+        
+        Returns:
+            Path to the pair list (matches_importer format)
+        """
+        planner = PairPlanner(self.image_dir, dataset=self.dataset,
+                              image_names=self.selected_images())
+        new = set(new_names)
+        
+        if tuple(strategies) == ("exhaustive",):
+            pairs = [(a, b) for i, a in enumerate(planner.names)
+                     for b in planner.names[i + 1:] if a in new or b in new]
+        else:
+            pairs = [(a, b) for a, b in planner.plan(strategies=strategies, k=k, overlap=overlap)
+                     if a in new or b in new]
+        
+        logger.info(f"{len(pairs)} pairs for {len(new)} new images")
+        return planner.write(pairs, self.output_dir / "pairs_incremental.txt")
+    
+    def assign_existing_cameras(self, new_names):
+        """
+        Share the refined cameras of sparse/0 with newly extracted images
+
+        feature_extractor gives the new images a camera of their own,
+        initialised from the EXIF prior. Each new image is moved to the
+        camera that the registered images of its camera group (make, model,
+        size, focal length) use in sparse/0, so it is registered with the
+        refined intrinsics; groups without registered images keep their new
+        camera.
+
+        Args:
+            new_names: Newly added images (extracted already)
+
+        Returns:
+            Dict of new image name -> camera_id it now uses in the database
+        """
+        model = ColmapModel.read(self.sparse_dir / "0")
+        model_cameras = dict(zip(model.names, model.images["camera_id"].tolist()))
+
+        new = set(new_names)
+        names, camera_ids = [], []
+        for group in self.dataset.camera_groups():
+            registered = [model_cameras[n] for n in group["names"] if n in model_cameras]
+            if not registered:
+                continue
+            camera_id = max(set(registered), key=registered.count)
+            group_new = [n for n in group["names"] if n in new]
+            names += group_new
+            camera_ids += [camera_id] * len(group_new)
+
+        with ColmapDatabase(self.database_path) as db:
+            if names:
+                removed = db.set_image_cameras(names, camera_ids)
+                logger.info(f"{len(names)} new images share existing cameras "
+                            f"({len(removed)} extracted cameras removed)")
+            _, image_cameras, db_names = db.images()
+        db_cameras = dict(zip(db_names, image_cameras.tolist()))
+        return {name: db_cameras[name] for name in new_names if name in db_cameras}
+
+    def register_new_images(self, new_names, triangulate=True, local_ba=True):
+        """
+        Register new images into sparse/0 without re-mapping
+        
+        image_registrator adds the new poses, point_triangulator adds the
+        points they see, and a native bundle adjustment refines only the
+        new poses and their points. Cameras shared with registered images
+        stay fixed; cameras used only by new images (a camera group absent
+        from the model, see assign_existing_cameras) are refined too.
+        
+        Args:
+            new_names: Newly added images (extracted and matched already)
+            triangulate: Triangulate the new images' matches
+            local_ba: Run the local bundle adjustment
+        
+        Returns:
+            Report dict (also saved as incremental.json)
+        """
+        logger.info(f"Registering {len(new_names)} new images...")
+        
+        model_dir = self.sparse_dir / "0"
+        registered_dir = self.sparse_dir / "registered"
+        registered_dir.mkdir(exist_ok=True)
+        
+        cmd = [
+            self.colmap_path, "image_registrator",
+            "--database_path", str(self.database_path),
+            "--input_path", str(model_dir),
+            "--output_path", str(registered_dir)
+        ]
+        self.runner.run(cmd)
+        
+        if triangulate:
+            cmd = [
+                self.colmap_path, "point_triangulator",
+                "--database_path", str(self.database_path),
+                "--image_path", str(self.image_dir),
+                "--input_path", str(registered_dir),
+                "--output_path", str(model_dir)
+            ]
+            self.runner.run(cmd)
+            model = ColmapModel.read(model_dir)
+        else:
+            model = ColmapModel.read(registered_dir)
+        
+        new = set(new_names)
+        local = [row for row, name in enumerate(model.names) if name in new]
+        registered = {model.names[row] for row in local}
+        report = {
+            "new_images": len(new),
+            "registered": len(local),
+            "unregistered": sorted(new - registered),
+            "cameras": {model.names[row]: int(model.images["camera_id"][row]) for row in local},
+            "local_ba": None,
+        }
+        
+        if local_ba and local:
+            adjuster = BundleAdjuster(mode="full", min_improvement=1e-3)
+            try:
+                ba_report = adjust_model(model, adjuster, local_images=local)
+                report["local_ba"] = {key: ba_report[key] for key in
+                                      ("initial_rms", "final_rms", "iterations", "elapsed_s")}
+            except ValueError as e:
+                logger.warning(f"Skipping local bundle adjustment: {e}")
+        model.write(model_dir)
+        
+        with open(self.output_dir / "incremental.json", 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Registered {len(local)}/{len(new)} new images")
+        if report["unregistered"]:
+            logger.warning(f"Not registered: {', '.join(report['unregistered'])}")
+        return report
+    
+    def prune_matches(self, min_inliers=30, min_inlier_ratio=0.1):
+        """
+        Remove weak or unverified pairs from the database before mapping
+        
+        Pruning is skipped when it would split the largest connected
+        component of the match graph (as seen by the mapper's own
+        15-inlier threshold). The resulting graph summary is saved as
+        match_graph.json.
+        
+        Args:
+            min_inliers: Verified inliers for a pair to be kept
+            min_inlier_ratio: Inlier/raw match ratio for a pair to be kept
+        
+        Returns:
+            Number of pruned pairs
+        """
+        logger.info("Pruning weak pairs...")
+        
+        with ColmapDatabase(self.database_path) as db:
+            before = db.graph_stats(min_inliers=15)
+            after = db.graph_stats(min_inliers, min_inlier_ratio)
+            largest_before = len(before["components"][0]) if before["components"] else 0
+            largest_after = len(after["components"][0]) if after["components"] else 0
+            
+            if largest_after < largest_before:
+                logger.warning(f"Pruning would shrink the largest component from "
+                               f"{largest_before} to {largest_after} images, skipping")
+                pruned = 0
+                after = before
+            else:
+                pruned = len(db.prune_pairs(min_inliers, min_inlier_ratio))
+        
+        with open(self.output_dir / "match_graph.json", 'w') as f:
+            json.dump(after, f, indent=2)
+        logger.info(f"Match graph: {after['num_pairs'] - after['num_weak_pairs']} strong pairs, "
+                    f"components {[len(c) for c in after['components']][:5]}")
+        return pruned
+    
+    def sparse_reconstruction(self, mapper="incremental", workers=1, max_cluster_size=100):
+        """
+        Perform sparse 3D reconstruction
+        
+        Either way the result is a single model in sparse/0, and
+        mapping_report.json lists the images that did not make it in.
+        
+        Args:
+            mapper: 'incremental' (one COLMAP mapper over all images) or
+                'partitioned' (map match-graph clusters in parallel, then merge)
+            workers: Clusters mapped at the same time ('partitioned')
+            max_cluster_size: Images per cluster ('partitioned')
+        """
+        logger.info(f"Running sparse reconstruction ({mapper})...")
+        
+        if mapper == "partitioned":
+            PartitionedMapper(
+                self.database_path, self.image_dir, self.output_dir,
+                colmap_path=self.colmap_path, runner=self.runner,
+                max_cluster_size=max_cluster_size, workers=workers
+            ).run(self.sparse_dir / "0")
+            logger.info("Sparse reconstruction complete")
+            return
+        elif mapper != "incremental":
+            raise ValueError(f"Unknown mapper: {mapper}")
         
         cmd = [
             self.colmap_path, "mapper",
@@ -90,18 +433,107 @@ class SfMPipeline:
             "--output_path", str(self.sparse_dir)
         ]
         
-        subprocess.run(cmd, check=True)
+        self.runner.run(cmd)
+        self.select_largest_model()
         logger.info("Sparse reconstruction complete")
     
-    def bundle_adjustment(self):
-        """Refine camera poses and 3D points"""
-        logger.info("Running bundle adjustment...")
+    def select_largest_model(self):
+        """
+        Make the model with the most images sparse/0
+        
+        The mapper writes one model per disconnected part of the scene
+        (sparse/0, sparse/1, ...) and every later step reads sparse/0; the
+        images left in the other models are reported as dropped.
+        
+        Returns:
+            Report dict (also saved as mapping_report.json)
+        """
+        models = {}
+        for model_dir in self.sparse_dir.iterdir():
+            if model_dir.name.isdigit() and (model_dir / "images.bin").exists():
+                models[int(model_dir.name)] = ColmapModel.read(model_dir).names
+        
+        dropped = {}
+        registered = []
+        if models:
+            largest = max(sorted(models), key=lambda i: len(models[i]))
+            if largest != 0:
+                logger.info(f"Largest model is sparse/{largest}, moving it to sparse/0")
+                # sparse/0 may be missing or hold no model; swap only what exists
+                slot, swap = self.sparse_dir / "0", self.sparse_dir / "swap"
+                if slot.exists():
+                    slot.rename(swap)
+                (self.sparse_dir / str(largest)).rename(slot)
+                if swap.exists():
+                    swap.rename(self.sparse_dir / str(largest))
+                moved = models.pop(largest)
+                if 0 in models:
+                    models[largest] = models[0]
+                models[0] = moved
+            registered = models[0]
+            for index in sorted(models)[1:]:
+                for name in models[index]:
+                    dropped[name] = f"in separate model sparse/{index}"
+        
+        with ColmapDatabase(self.database_path) as db:
+            _, _, names = db.images()
+        in_models = set(registered) | set(dropped)
+        for name in names:
+            if name not in in_models:
+                dropped[name] = "not registered"
+        
+        report = {
+            "mapper": "incremental",
+            "num_images": len(names),
+            "registered": len(registered),
+            "models": [len(models[i]) for i in sorted(models)],
+            "dropped": dropped,
+        }
+        write_mapping_report(report, self.output_dir / "mapping_report.json")
+        return report
+    
+    def bundle_adjustment(self, method="colmap", mode="full", loss="linear",
+                          max_iterations=50, min_improvement=0.0, time_budget=None):
+        """
+        Refine camera poses and 3D points
+        
+        Args:
+            method: 'colmap' (bundle_adjuster binary) or 'native' (in-process
+                sparse least squares with per-iteration reporting)
+            mode: Native only: 'full', 'fixed_intrinsics' or 'points_only'
+            loss: Native only: robust loss ('linear', 'huber', 'soft_l1', 'cauchy')
+            max_iterations: Native only: maximum residual evaluations
+            min_improvement: Native only: stop once an iteration improves the
+                cost by less than this fraction
+            time_budget: Native only: wall-clock limit in seconds
+        
+        Returns:
+            Native report dict (also saved as bundle_adjustment.json), or
+            None for COLMAP
+        """
+        logger.info(f"Running bundle adjustment ({method})...")
         
         # Find the reconstruction directory (usually '0')
         recon_dir = self.sparse_dir / "0"
         if not recon_dir.exists():
             logger.warning("No reconstruction found in sparse/0")
-            return
+            return None
+        
+        if method == "native":
+            model = ColmapModel.read(recon_dir)
+            adjuster = BundleAdjuster(
+                loss=loss, max_nfev=max_iterations, mode=mode,
+                min_improvement=min_improvement, time_budget=time_budget, verbose=True
+            )
+            report = adjust_model(model, adjuster)
+            model.write(recon_dir)
+            
+            with open(self.output_dir / "bundle_adjustment.json", 'w') as f:
+                json.dump(report, f, indent=2)
+            logger.info(f"Bundle adjustment complete: {report['message']}")
+            return report
+        elif method != "colmap":
+            raise ValueError(f"Unknown bundle adjustment method: {method}")
         
         cmd = [
             self.colmap_path, "bundle_adjuster",
@@ -111,8 +543,9 @@ class SfMPipeline:
             "--BundleAdjustment.refine_extra_params", "1"
         ]
         
-        subprocess.run(cmd, check=True)
+        self.runner.run(cmd)
         logger.info("Bundle adjustment complete")
+        return None
     
     def export_to_text(self):
         """Export COLMAP binary format to text for inspection"""
@@ -129,70 +562,296 @@ class SfMPipeline:
             "--output_type", "TXT"
         ]
         
-        subprocess.run(cmd, check=True)
+        self.runner.run(cmd)
         logger.info(f"Text export complete: {output_text_dir}")
     
-    def get_reconstruction_stats(self):
-        """Get statistics about the reconstruction"""
-        stats_file = self.sparse_dir / "0" / "project.ini"
+    def rescale_model(self, image_sizes, output_path, recon_dir=None):
+        """
+        Rescale a model reconstructed on resized images to another resolution
         
-        if not stats_file.exists():
-            logger.warning("No reconstruction statistics found")
-            return None
+        Intrinsics (focal length, principal point, image size) and the 2D
+        observations are scaled per image; poses and 3D points are unchanged
+        because image resolution does not affect the scene geometry.
         
-        # Parse cameras.txt and points3D.txt for stats
-        text_dir = self.output_dir / "sparse_text"
+        Images sharing a camera can map to different target sizes (e.g. two
+        source resolutions resized to the same max_size). Such a camera is
+        split: each distinct scale gets its own copy of the camera, so every
+        image's intrinsics are scaled like its observations.
         
-        stats = {
-            "num_cameras": 0,
-            "num_images": 0,
-            "num_points": 0
-        }
+        Args:
+            image_sizes: Dict mapping image name -> (width, height) of the
+                target resolution (e.g. the original images)
+            output_path: Directory for the rescaled binary model
+            recon_dir: Model to rescale (default: sparse/0)
         
-        cameras_file = text_dir / "cameras.txt"
-        if cameras_file.exists():
-            with open(cameras_file) as f:
-                stats["num_cameras"] = sum(1 for line in f if not line.startswith("#"))
+        Returns:
+            Path to the rescaled model
+        """
+        recon_dir = Path(recon_dir) if recon_dir else self.sparse_dir / "0"
+        output_path = Path(output_path)
+        output_path.mkdir(parents=True, exist_ok=True)
+        
+        logger.info(f"Rescaling model {recon_dir} -> {output_path}")
+        
+        model = ColmapModel.read(recon_dir)
+        camera_rows = {int(cid): i for i, cid in enumerate(model.cameras["camera_id"])}
+        
+        # Scale the 2D observations of every image and group the images by
+        # (camera, scale); the first scale of a camera keeps its camera_id
+        camera_scales = {}
+        image_camera_ids = model.images["camera_id"].copy()
+        scaled_rows, split_cameras = set(), []
+        next_camera_id = int(model.cameras["camera_id"].max()) + 1 if len(model.cameras) else 1
+        xy = model.points2D["xy"]
+        for i, (name, image) in enumerate(zip(model.names, model.images)):
+            if name not in image_sizes:
+                raise ValueError(f"No target size for image {name}")
+            
+            row = camera_rows[int(image["camera_id"])]
+            target_w, target_h = image_sizes[name]
+            sx = target_w / int(model.cameras["width"][row])
+            sy = target_h / int(model.cameras["height"][row])
+            scale = (sx, sy, target_w, target_h)
+            
+            if (row, scale) not in camera_scales:
+                if row in scaled_rows:
+                    camera_scales[(row, scale)] = next_camera_id
+                    split_cameras.append((row, next_camera_id))
+                    next_camera_id += 1
+                else:
+                    camera_scales[(row, scale)] = int(image["camera_id"])
+                    scaled_rows.add(row)
+            image_camera_ids[i] = camera_scales[(row, scale)]
+            
+            xy[model.points2D_offsets[i]:model.points2D_offsets[i + 1]] *= (sx, sy)
+        
+        if split_cameras:
+            copies = model.cameras[[row for row, _ in split_cameras]].copy()
+            copies["camera_id"] = [camera_id for _, camera_id in split_cameras]
+            model.cameras = np.concatenate([model.cameras, copies])
+            model.images["camera_id"] = image_camera_ids
+            logger.warning(f"Split {len(split_cameras)} cameras whose images have "
+                           f"different target sizes")
         
-        images_file = text_dir / "images.txt"
-        if images_file.exists():
-            with open(images_file) as f:
-                stats["num_images"] = sum(1 for line in f if not line.startswith("#") and line.strip()) // 2
+        camera_rows = {int(cid): i for i, cid in enumerate(model.cameras["camera_id"])}
+        for (_, (sx, sy, target_w, target_h)), camera_id in camera_scales.items():
+            row = camera_rows[camera_id]
+            model_name, _ = model.camera_model(row)
+            scale_camera(model.cameras[row:row + 1], model_name, sx, sy, target_w, target_h)
         
-        points_file = text_dir / "points3D.txt"
-        if points_file.exists():
-            with open(points_file) as f:
-                stats["num_points"] = sum(1 for line in f if not line.startswith("#"))
+        model.write(output_path)
+        logger.info(f"Rescaled model saved: {output_path}")
+        return output_path
+    
+    def get_reconstruction_stats(self, recon_dir=None):
+        """
+        Get statistics about the reconstruction
+        
+        Read straight from the binary model, so no text export is needed.
         
-        logger.info(f"Reconstruction stats: {stats}")
+        Args:
+            recon_dir: Model directory (default: sparse/0)
+        """
+        recon_dir = Path(recon_dir) if recon_dir else self.sparse_dir / "0"
+        
+        if not (recon_dir / "images.bin").exists():
+            logger.warning(f"No reconstruction found in {recon_dir}")
+            return None
+        
+        start_time = time.time()
+        stats = ColmapModel.read(recon_dir).stats()
+        elapsed = time.time() - start_time
+        
+        logger.info(f"Reconstruction stats ({elapsed * 1000:.1f} ms): {stats}")
         return stats
     
-    def run_full_pipeline(self):
-        """Run the complete SfM pipeline"""
-        logger.info("Starting full SfM pipeline...")
+    def run_full_pipeline(self, matching="exhaustive", ba_method="colmap", incremental=False,
+                          prune=False, mapper="incremental", workers=1):
+        """
+        Run the complete SfM pipeline
+        
+        Args:
+            matching: 'exhaustive', 'sequential', or a comma-separated list
+                of PairPlanner strategies (e.g. 'retrieval,turntable')
+            ba_method: Final bundle adjustment for the COLMAP backend,
+                'colmap' or 'native'
+            incremental: Register only images missing from an existing
+                sparse/0 (see run_incremental)
+            prune: Drop weak pairs from the database before mapping
+            mapper: 'incremental' or 'partitioned' (see sparse_reconstruction)
+            workers: Clusters mapped at the same time with 'partitioned'
+        """
+        if incremental:
+            if self.backend != "colmap":
+                raise ValueError("Incremental registration requires the colmap backend")
+            return self.run_incremental(matching, ba_method, prune=prune, mapper=mapper,
+                                        workers=workers)
+        
+        logger.info(f"Starting full SfM pipeline ({self.backend})...")
+        
+        if self.backend == "native":
+            return self.run_native(matching)
         
         # Step 1: Feature extraction
         self.feature_extraction()
         
         # Step 2: Feature matching
-        self.feature_matching(matching_type="exhaustive")
+        if matching in ("exhaustive", "sequential"):
+            self.feature_matching(matching_type=matching)
+        else:
+            pairs_path = self.plan_pairs(strategies=matching.split(","))
+            self.feature_matching(matching_type="pairs", pairs_path=pairs_path)
         
         # Step 3: Sparse reconstruction
-        self.sparse_reconstruction()
+        if prune:
+            self.prune_matches()
+        self.sparse_reconstruction(mapper=mapper, workers=workers)
         
         # Step 4: Bundle adjustment
-        self.bundle_adjustment()
+        self.bundle_adjustment(method=ba_method)
+        
+        # Step 5: Get stats
+        stats = self.get_reconstruction_stats()
+        
+        logger.info("SfM pipeline complete!")
+        return stats
+    
+    def run_incremental(self, matching="exhaustive", ba_method="colmap", prune=False,
+                        mapper="incremental", workers=1):
+        """
+        Add new images to an existing reconstruction
+        
+        Only images missing from sparse/0 are extracted and matched (against
+        their likely neighbours) and registered into the model. Without an
+        existing model and database this runs the full pipeline.
         
-        # Step 5: Export to text
-        self.export_to_text()
+        Args:
+            matching: As for run_full_pipeline; 'exhaustive' pairs each new
+                image with every image, 'sequential' with its turntable
+                neighbours
+            ba_method: Used only when falling back to the full pipeline
+            prune: Used only when falling back to the full pipeline
+            mapper: Used only when falling back to the full pipeline
+            workers: Used only when falling back to the full pipeline
+        """
+        if not (self.sparse_dir / "0" / "images.bin").exists() or not self.database_path.exists():
+            logger.info("No existing reconstruction, running the full pipeline")
+            return self.run_full_pipeline(matching=matching, ba_method=ba_method, prune=prune,
+                                          mapper=mapper, workers=workers)
+        
+        new_names = self.new_images()
+        if not new_names:
+            logger.info("No new images to register")
+            return self.get_reconstruction_stats()
+        
+        logger.info(f"Starting incremental SfM for {len(new_names)} new images...")
+        
+        if matching == "exhaustive":
+            strategies = ("exhaustive",)
+        elif matching == "sequential":
+            strategies = ("turntable",)
+        else:
+            strategies = matching.split(",")
+        
+        self.feature_extraction(image_names=new_names)
+        self.assign_existing_cameras(new_names)
+        pairs_path = self.incremental_pairs(new_names, strategies=strategies)
+        self.feature_matching(matching_type="pairs", pairs_path=pairs_path)
+        self.register_new_images(new_names)
         
-        # Step 6: Get stats
         stats = self.get_reconstruction_stats()
+        logger.info("Incremental SfM complete!")
+        return stats
+    
+    def run_native(self, matching="exhaustive"):
+        """
+        Run SfM in process with IncrementalSfM (no colmap binary needed)
         
+        Args:
+            matching: As for run_full_pipeline; 'sequential' matches each
+                image with its next 10 in capture order
+        """
+        engine = IncrementalSfM(
+            self.image_dir, self.output_dir, dataset=self.dataset,
+            image_list=self.image_list, mask_dir=self.mask_dir
+        )
+        
+        if matching == "exhaustive":
+            pairs = None
+        elif matching == "sequential":
+            planner = PairPlanner(self.image_dir, dataset=self.dataset,
+                                  image_names=engine.names)
+            pairs = planner.plan(strategies=("turntable",), overlap=10, circular=False)
+        else:
+            with open(self.plan_pairs(strategies=matching.split(","))) as f:
+                pairs = [tuple(line.split()) for line in f if line.strip()]
+        
+        summary = engine.run(self.sparse_dir / "0", pairs=pairs)
+        self.native_timings = summary["timings"]
+        
+        stats = self.get_reconstruction_stats()
         logger.info("SfM pipeline complete!")
         return stats
 
 
+# Camera models whose first parameters are (f, cx, cy); the rest use
+# (fx, fy, cx, cy). Distortion parameters are resolution independent.
+SINGLE_FOCAL_MODELS = {
+    "SIMPLE_PINHOLE", "SIMPLE_RADIAL", "RADIAL",
+    "SIMPLE_RADIAL_FISHEYE", "RADIAL_FISHEYE",
+}
+
+
+def prior_camera_params(camera_model, focal_px, width, height):
+    """
+    COLMAP --ImageReader.camera_params string for a focal prior
+    
+    The principal point starts at the image centre and distortion at zero.
+    Returns None when there is no prior or the model is not supported.
+    """
+    if not focal_px:
+        return None
+    
+    f, cx, cy = focal_px, width / 2, height / 2
+    params = {
+        "SIMPLE_PINHOLE": [f, cx, cy],
+        "PINHOLE": [f, f, cx, cy],
+        "SIMPLE_RADIAL": [f, cx, cy, 0.0],
+        "RADIAL": [f, cx, cy, 0.0, 0.0],
+        "OPENCV": [f, f, cx, cy, 0.0, 0.0, 0.0, 0.0],
+    }.get(camera_model)
+    
+    if params is None:
+        return None
+    return ",".join(f"{p:.6g}" for p in params)
+
+
+def scale_camera(camera, model_name, sx, sy, width, height):
+    """
+    Scale a camera to a new image size, in place
+    
+    Args:
+        camera: One-row view into a ColmapModel cameras array
+        model_name: COLMAP camera model name
+        sx, sy: Horizontal and vertical scale factors
+        width, height: New image size
+    """
+    params = camera["params"][0]
+    
+    if model_name in SINGLE_FOCAL_MODELS:
+        params[0] *= (sx + sy) / 2
+        params[1] *= sx
+        params[2] *= sy
+    else:
+        params[0] *= sx
+        params[1] *= sy
+        params[2] *= sx
+        params[3] *= sy
+    
+    camera["width"] = width
+    camera["height"] = height
+
+
 def main():
     """Example usage"""
     sfm = SfMPipeline(
@@ -0,0 +1,290 @@
+"""
+Pipeline Stage Cache
+Content-addressed store of whole stage outputs so unchanged stages are restored instead of rerun
+"""
+
+from importlib import metadata
+from pathlib import Path
+import functools
+import hashlib
+import json
+import logging
+import shutil
+import sqlite3
+import subprocess
+import time
+from src.segmentation_cache import file_hash
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate every entry when stage outputs change meaning
+CACHE_VERSION = 1
+
+
+class StageCache:
+    def __init__(self, cache_dir, max_bytes=20 * 1024**3):
+        """
+        Initialize stage cache
+
+        An entry is a copy of a stage's output files plus a small JSON state
+        (e.g. the paths the stage returned), keyed on the content of its
+        input files, its parameters and the versions of the tools it runs.
+        Files are copied in both directions, never linked, because later
+        stages rewrite some outputs in place.
+
+        Args:
+            cache_dir: Directory holding the entries and the SQLite index
+            max_bytes: Total entry size kept before least-recently-used eviction
+        """
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self.conn = sqlite3.connect(str(self.cache_dir / "index.db"))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " stage TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " state TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_access ON entries (last_access)"
+        )
+        # Content hashes of input files, valid while size and mtime match
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " digest TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def key(self, stage, inputs=(), params=None, versions=None):
+        """
+        Cache key of a stage run
+
+        Args:
+            stage: Stage name
+            inputs: Input files or directories (hashed by content, directories
+                recursively with their relative file names)
+            params: JSON-serialisable parameters that change the output
+            versions: Tool name -> version string
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            "cache_version": CACHE_VERSION,
+            "stage": stage,
+            "params": params or {},
+            "versions": versions or {},
+        }, sort_keys=True, default=str).encode())
+
+        for path in inputs:
+            path = Path(path)
+            files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+            for file in files:
+                name = file.relative_to(path).as_posix() if path.is_dir() else file.name
+                digest.update(f"{name}:{self.content_hash(file)}\n".encode())
+        self.conn.commit()
+        return digest.hexdigest()
+
+    def content_hash(self, path):
+        """SHA-256 of a file, reused while its size and mtime are unchanged"""
+        stat = path.stat()
+        resolved = str(path.resolve())
+        row = self.conn.execute(
+            "SELECT digest FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (resolved, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        if row:
+            return row[0]
+
+        digest = file_hash(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+            (resolved, stat.st_size, stat.st_mtime_ns, digest)
+        )
+        return digest
+
+    def restore(self, key, root, outputs):
+        """
+        Put a cached stage's outputs back under root
+
+        Outputs already stamped with this key under root are left as they
+        are, so rerunning in the same output directory copies nothing. On a
+        miss the outputs' stamps are cleared, as the caller reruns the stage.
+
+        Args:
+            key: Key from key()
+            root: Directory the output paths are relative to
+            outputs: Output files or directories, relative to root
+
+        Returns:
+            The stored state dict, or None on a miss
+        """
+        root = Path(root)
+        stamps = read_stamps(root)
+
+        row = self.conn.execute("SELECT state FROM entries WHERE key = ?", (key,)).fetchone()
+        entry_dir = self.objects_dir / key
+        if row is None or not entry_dir.exists():
+            # The stage is about to rerun, so its outputs stop matching any key
+            for output in outputs:
+                stamps.pop(str(output), None)
+            write_stamps(root, stamps)
+            self.misses += 1
+            return None
+
+        if not all(stamps.get(str(output)) == key and (root / output).exists()
+                   for output in outputs):
+            for output in outputs:
+                target = root / output
+                if target.is_dir():
+                    shutil.rmtree(target)
+                elif target.exists():
+                    target.unlink()
+                source = entry_dir / output
+                if source.is_dir():
+                    shutil.copytree(source, target)
+                elif source.exists():
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy2(source, target)
+                stamps[str(output)] = key
+            write_stamps(root, stamps)
+
+        self.hits += 1
+        self.conn.execute(
+            "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+        )
+        self.conn.commit()
+        return json.loads(row[0])
+
+    def store(self, stage, key, root, outputs, state=None):
+        """
+        Copy a finished stage's outputs into the cache
+
+        Args:
+            stage: Stage name (recorded in the index)
+            key: Key from key()
+            root: Directory the output paths are relative to
+            outputs: Output files or directories, relative to root
+            state: JSON-serialisable dict returned by restore()
+        """
+        root = Path(root)
+        entry_dir = self.objects_dir / key
+        if entry_dir.exists():
+            shutil.rmtree(entry_dir)
+
+        for output in outputs:
+            source, target = root / output, entry_dir / output
+            if source.is_dir():
+                shutil.copytree(source, target)
+            elif source.exists():
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(source, target)
+
+        size = sum(p.stat().st_size for p in entry_dir.rglob("*") if p.is_file()) \
+            if entry_dir.exists() else 0
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            (key, stage, size, json.dumps(state or {}), now, now)
+        )
+
+        stamps = read_stamps(root)
+        stamps.update({str(output): key for output in outputs})
+        write_stamps(root, stamps)
+
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the total fits in max_bytes"""
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in self.conn.execute(
+            "SELECT key, size FROM entries ORDER BY last_access"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self.objects_dir / key, ignore_errors=True)
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.evicted += 1
+
+    def summary(self):
+        """Return hit/miss/eviction counters and cache size"""
+        self.conn.commit()
+        entries, size = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def read_stamps(root):
+    """Output path -> cache key of the entry it was produced or restored from"""
+    path = Path(root) / ".stage_cache.json"
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_stamps(root, stamps):
+    path = Path(root) / ".stage_cache.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(stamps, f, indent=2)
+
+
+def package_version(name):
+    """Installed version of a Python package, without importing it"""
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "not installed"
+
+
+@functools.lru_cache(maxsize=None)
+def colmap_version(colmap_path="colmap"):
+    """First line of COLMAP's help text, e.g. 'COLMAP 3.9.1 (Commit ...)'"""
+    try:
+        result = subprocess.run([colmap_path, "-h"], capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return "not found"
+    lines = [line.strip() for line in result.stdout.splitlines() if line.strip()]
+    return lines[0] if lines else "unknown"
+
+
+def main():
+    """Example usage"""
+    cache = StageCache("output/.stage_cache")
+    logger.info(f"Stage cache: {cache.summary()}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
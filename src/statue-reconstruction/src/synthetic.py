@@ -0,0 +1,824 @@
+"""
+Synthetic Ground-Truth Datasets
+Renders a known mesh from camera rings on the CPU so pipeline stages can be scored for time and accuracy
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+import cv2
+from PIL import Image
+from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import logging
+import time
+from src.colmap_io import (CAMERA_DTYPE, CAMERA_MODEL_IDS, IMAGE_DTYPE, POINT2D_DTYPE,
+                           POINT3D_DTYPE, TRACK_DTYPE, ColmapModel, rotation_to_quaternion)
+from src.pointcloud_io import write_ply
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Height -> (radius, front-to-back depth ratio) of the procedural bust, from
+# the plinth through the shoulders and neck to the top of the head
+BUST_PROFILE = np.array([
+    [0.00, 0.300, 0.55],
+    [0.04, 0.320, 0.55],
+    [0.22, 0.310, 0.55],
+    [0.33, 0.240, 0.60],
+    [0.40, 0.130, 0.95],
+    [0.47, 0.110, 1.00],
+    [0.54, 0.150, 1.15],
+    [0.66, 0.170, 1.20],
+    [0.80, 0.165, 1.15],
+    [0.91, 0.130, 1.05],
+    [0.97, 0.070, 1.00],
+    [1.00, 0.020, 1.00],
+])
+
+# Facial relief as radial Gaussian bumps: (angle, height, angle sigma,
+# height sigma, amplitude); the face looks along +x (angle 0)
+BUST_FEATURES = [
+    (0.0, 0.700, 0.12, 0.030, 0.030),    # nose
+    (0.0, 0.760, 0.50, 0.012, 0.010),    # brow
+    (0.35, 0.735, 0.12, 0.015, -0.012),  # eye sockets
+    (-0.35, 0.735, 0.12, 0.015, -0.012),
+    (0.0, 0.640, 0.25, 0.008, 0.008),    # lips
+    (0.0, 0.575, 0.30, 0.020, 0.015),    # chin
+    (np.pi / 2, 0.710, 0.10, 0.035, 0.020),   # ears
+    (-np.pi / 2, 0.710, 0.10, 0.035, 0.020),
+]
+
+# Key light direction (world, z up), fixed so shading is view independent
+LIGHT_DIRECTION = np.array([0.5, -0.35, 0.8]) / np.linalg.norm([0.5, -0.35, 0.8])
+
+# Fragments rasterized per NumPy batch
+RASTER_BATCH = 1 << 20
+
+
+class SyntheticDataset:
+    def __init__(self, output_dir, mesh_path=None, width=640, height=480, focal=None,
+                 radial=0.0, rings=((10, 24), (35, 24)), radius=2.0, jitter=0.0,
+                 supersample=2, noise_sigma=0.0, blur_sigma=0.0, jpeg_quality=95,
+                 num_samples=200000, num_points=5000, seed=0):
+        """
+        Initialize synthetic dataset generator
+
+        The scene is 1 unit tall, standing on z = 0 with z up. Images go to
+        output_dir/images and the ground truth to output_dir/ground_truth:
+        a COLMAP model of the true cameras with tracks of visible surface
+        points (sparse/0), the mesh (mesh.ply), dense surface samples seen
+        by at least two views (surface_points.ply) and scene.json.
+
+        Args:
+            output_dir: Dataset directory
+            mesh_path: Mesh file to render instead of the procedural bust
+                (read with trimesh, rescaled to 1 unit tall along z)
+            width: Image width
+            height: Image height
+            focal: Focal length in pixels (default: 1.2 * max(width, height))
+            radial: SIMPLE_RADIAL distortion coefficient k
+            rings: (elevation in degrees, number of views) per camera ring
+            radius: Camera distance from the scene centre
+            jitter: Relative random perturbation of camera distance,
+                azimuth and elevation (0 = perfect rings)
+            supersample: Rendering supersampling factor per axis
+            noise_sigma: Gaussian image noise in 8-bit levels
+            blur_sigma: Gaussian blur in pixels
+            jpeg_quality: JPEG quality of the images
+            num_samples: Surface samples for scoring dense reconstructions
+            num_points: Points in the ground-truth sparse model
+            seed: Seed for the texture, jitter and noise
+        """
+        self.output_dir = Path(output_dir)
+        self.images_dir = self.output_dir / "images"
+        self.gt_dir = self.output_dir / "ground_truth"
+        self.mesh_path = mesh_path
+        self.width = width
+        self.height = height
+        self.focal = focal or 1.2 * max(width, height)
+        self.radial = radial
+        self.rings = [tuple(ring) for ring in rings]
+        self.radius = radius
+        self.jitter = jitter
+        self.supersample = max(1, supersample)
+        self.noise_sigma = noise_sigma
+        self.blur_sigma = blur_sigma
+        self.jpeg_quality = jpeg_quality
+        self.num_samples = num_samples
+        self.num_points = num_points
+        self.seed = seed
+
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        self.gt_dir.mkdir(parents=True, exist_ok=True)
+
+    def camera_params(self):
+        """SIMPLE_RADIAL parameters (f, cx, cy, k)"""
+        return np.array([self.focal, self.width / 2, self.height / 2, self.radial])
+
+    def camera_poses(self, target):
+        """
+        World-to-camera poses of every ring, looking at target
+
+        Returns:
+            (R N x 3 x 3, t N x 3)
+        """
+        rng = np.random.default_rng(self.seed)
+        centers = []
+        for ring, (elevation, count) in enumerate(self.rings):
+            # Alternate rings are offset by half a step to spread the views
+            azimuth = 2 * np.pi * (np.arange(count) + 0.5 * (ring % 2)) / count
+            elev = np.full(count, np.radians(elevation))
+            distance = np.full(count, self.radius)
+            if self.jitter:
+                azimuth += self.jitter * rng.normal(size=count)
+                elev += self.jitter * rng.normal(size=count)
+                distance *= 1 + self.jitter * rng.normal(size=count)
+            centers.append(target + distance[:, None] * np.stack([
+                np.cos(elev) * np.cos(azimuth),
+                np.cos(elev) * np.sin(azimuth),
+                np.sin(elev),
+            ], axis=1))
+        return look_at(np.concatenate(centers), target)
+
+    def generate(self, workers=None):
+        """
+        Render every view and write the ground truth
+
+        Args:
+            workers: Render processes (default: all CPUs)
+
+        Returns:
+            Summary dict (also saved in ground_truth/scene.json)
+        """
+        start_time = time.time()
+        workers = workers or os.cpu_count() or 1
+
+        if self.mesh_path:
+            vertices, faces = load_mesh(self.mesh_path)
+        else:
+            vertices, faces = bust_mesh(seed=self.seed)
+        normals = vertex_normals(vertices, faces)
+        samples, sample_normals = sample_surface(vertices, faces, self.num_samples, self.seed)
+        logger.info(f"Scene: {len(vertices)} vertices, {len(faces)} faces, "
+                    f"{len(samples)} surface samples")
+
+        target = (vertices.min(axis=0) + vertices.max(axis=0)) / 2
+        R, t = self.camera_poses(target)
+        names = [f"view_{i:03d}.jpg" for i in range(len(R))]
+
+        scene_path = self.gt_dir / "scene.npz"
+        np.savez(scene_path, vertices=vertices, faces=faces, normals=normals,
+                 samples=samples, sample_normals=sample_normals)
+
+        settings = {
+            "width": self.width, "height": self.height, "params": self.camera_params(),
+            "supersample": self.supersample, "noise_sigma": self.noise_sigma,
+            "blur_sigma": self.blur_sigma, "jpeg_quality": self.jpeg_quality,
+            "seed": self.seed,
+        }
+        jobs = [(scene_path, self.images_dir / name, R[i], t[i], i, settings)
+                for i, name in enumerate(names)]
+
+        if workers <= 1:
+            results = [_render_job(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_render_job, *zip(*jobs)))
+        render_s = time.time() - start_time
+        logger.info(f"Rendered {len(names)} views in {render_s:.1f}s")
+
+        visible = [ids for ids, _ in results]
+        observations = [xy for _, xy in results]
+        views = np.bincount(np.concatenate(visible), minlength=len(samples))
+        np.savez(scene_path, vertices=vertices, faces=faces, normals=normals,
+                 samples=samples, sample_normals=sample_normals, sample_views=views)
+
+        seen = views >= 2
+        colors = np.clip(surface_albedo(samples[seen], self.seed) * 255, 0, 255).astype(np.uint8)
+        write_ply(self.gt_dir / "surface_points.ply", samples[seen],
+                  normals=sample_normals[seen], colors=colors)
+        write_ply(self.gt_dir / "mesh.ply", vertices, faces=faces, normals=normals)
+
+        model = self.ground_truth_model(names, R, t, samples, visible, observations, views)
+        model.write(self.gt_dir / "sparse" / "0")
+
+        summary = {
+            "num_images": len(names),
+            "width": self.width,
+            "height": self.height,
+            "camera_model": "SIMPLE_RADIAL",
+            "camera_params": self.camera_params().tolist(),
+            "rings": self.rings,
+            "radius": self.radius,
+            "jitter": self.jitter,
+            "noise_sigma": self.noise_sigma,
+            "blur_sigma": self.blur_sigma,
+            "mesh": str(self.mesh_path) if self.mesh_path else "procedural bust",
+            "seed": self.seed,
+            "num_vertices": len(vertices),
+            "num_faces": len(faces),
+            "num_surface_points": int(seen.sum()),
+            "num_sparse_points": len(model.points3D),
+            "elapsed_s": time.time() - start_time,
+            "images": [
+                {"name": name, "qvec": q.tolist(), "tvec": tvec.tolist(), "center": c.tolist()}
+                for name, q, tvec, c in zip(names, rotation_to_quaternion(R), t,
+                                            -np.einsum("nji,nj->ni", R, t))
+            ],
+        }
+        with open(self.gt_dir / "scene.json", 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        logger.info(f"Synthetic dataset written to {self.output_dir} "
+                    f"({summary['elapsed_s']:.1f}s)")
+        return summary
+
+    def ground_truth_model(self, names, R, t, samples, visible, observations, views):
+        """
+        ColmapModel of the true cameras, with a random subset of the samples
+        seen by at least two views as its 3D points
+        """
+        rng = np.random.default_rng(self.seed)
+        candidates = np.flatnonzero(views >= 2)
+        chosen = np.sort(rng.choice(candidates, min(self.num_points, len(candidates)),
+                                    replace=False))
+        # Sample index -> point row (-1 when not chosen)
+        point_row = np.full(len(samples), -1, dtype=np.int64)
+        point_row[chosen] = np.arange(len(chosen))
+
+        cameras = np.zeros(1, dtype=CAMERA_DTYPE)
+        cameras["params"] = np.nan
+        cameras[0] = (1, CAMERA_MODEL_IDS["SIMPLE_RADIAL"], self.width, self.height,
+                      np.pad(self.camera_params(), (0, cameras["params"].shape[1] - 4),
+                             constant_values=np.nan))
+
+        blocks, obs_images, obs_points = [], [], []
+        for i, (ids, xy) in enumerate(zip(visible, observations)):
+            rows = point_row[ids]
+            keep = rows >= 0
+            block = np.zeros(keep.sum(), dtype=POINT2D_DTYPE)
+            block["xy"] = xy[keep]
+            block["point3D_id"] = rows[keep] + 1
+            blocks.append(block)
+            obs_images.append(np.full(len(block), i + 1))
+            obs_points.append(rows[keep])
+
+        images = np.zeros(len(names), dtype=IMAGE_DTYPE)
+        images["image_id"] = np.arange(1, len(names) + 1)
+        images["qvec"] = rotation_to_quaternion(R)
+        images["tvec"] = t
+        images["camera_id"] = 1
+        images["num_points2D"] = [len(block) for block in blocks]
+        points2D_offsets = np.concatenate([[0], np.cumsum(images["num_points2D"])]).astype(np.int64)
+
+        # Tracks: every observation grouped by point
+        obs_points = np.concatenate(obs_points)
+        obs_images = np.concatenate(obs_images)
+        obs_index = np.concatenate([np.arange(len(block)) for block in blocks])
+        order = np.argsort(obs_points, kind="stable")
+        tracks = np.zeros(len(order), dtype=TRACK_DTYPE)
+        tracks["image_id"] = obs_images[order]
+        tracks["point2D_idx"] = obs_index[order]
+        track_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(obs_points, minlength=len(chosen)))]
+        ).astype(np.int64)
+
+        points3D = np.zeros(len(chosen), dtype=POINT3D_DTYPE)
+        points3D["point3D_id"] = np.arange(1, len(chosen) + 1)
+        points3D["xyz"] = samples[chosen]
+        points3D["rgb"] = np.clip(surface_albedo(samples[chosen], self.seed) * 255, 0, 255)
+        points3D["track_length"] = np.diff(track_offsets)
+
+        return ColmapModel(cameras, images, names, np.concatenate(blocks), points2D_offsets,
+                           points3D, tracks, track_offsets)
+
+
+def bust_mesh(rings=160, segments=256, relief=0.01, seed=0):
+    """
+    Procedural bust-like closed triangle mesh, 1 unit tall on z = 0
+
+    A surface of revolution over BUST_PROFILE with an elliptical cross
+    section, the BUST_FEATURES relief and a little noise displacement.
+
+    Returns:
+        (vertices V x 3, faces F x 3 with outward winding)
+    """
+    z = np.linspace(0.0, 1.0, rings)
+    theta = np.linspace(-np.pi, np.pi, segments, endpoint=False)
+    Z, T = np.meshgrid(z, theta, indexing="ij")
+
+    radius = np.interp(Z, BUST_PROFILE[:, 0], BUST_PROFILE[:, 1])
+    depth = np.interp(Z, BUST_PROFILE[:, 0], BUST_PROFILE[:, 2])
+    for angle, center, angle_sigma, height_sigma, amplitude in BUST_FEATURES:
+        radius += amplitude * np.exp(-0.5 * ((T - angle) / angle_sigma) ** 2
+                                     - 0.5 * ((Z - center) / height_sigma) ** 2)
+    directions = np.stack([np.cos(T), np.sin(T), Z], axis=-1).reshape(-1, 3)
+    radius += relief * (fractal_noise(directions, 4.0, 3, seed).reshape(Z.shape) - 0.5)
+    radius = np.maximum(radius, 0.005)
+
+    ring_vertices = np.stack([radius * depth * np.cos(T), radius * np.sin(T), Z], axis=-1)
+    vertices = np.concatenate([ring_vertices.reshape(-1, 3), [[0, 0, 0], [0, 0, 1]]])
+
+    j, i = np.meshgrid(np.arange(rings - 1), np.arange(segments), indexing="ij")
+    a = j * segments + i
+    b = j * segments + (i + 1) % segments
+    c = b + segments
+    d = a + segments
+    side = np.concatenate([np.stack([a, b, c], -1).reshape(-1, 3),
+                           np.stack([a, c, d], -1).reshape(-1, 3)])
+
+    bottom_pole, top_pole = rings * segments, rings * segments + 1
+    i = np.arange(segments)
+    top = (rings - 1) * segments
+    bottom = np.stack([np.full(segments, bottom_pole), (i + 1) % segments, i], -1)
+    cap = np.stack([top + i, top + (i + 1) % segments, np.full(segments, top_pole)], -1)
+    return vertices, np.concatenate([side, bottom, cap]).astype(np.int64)
+
+
+def load_mesh(mesh_path):
+    """Read a mesh with trimesh and rescale it to 1 unit tall, standing on z = 0"""
+    import trimesh  # Only needed for bundled meshes
+
+    mesh = trimesh.load(mesh_path, force="mesh")
+    vertices = np.asarray(mesh.vertices, dtype=np.float64)
+    low, high = vertices.min(axis=0), vertices.max(axis=0)
+    vertices = (vertices - [(low[0] + high[0]) / 2, (low[1] + high[1]) / 2, low[2]]) \
+        / (high[2] - low[2])
+    return vertices, np.asarray(mesh.faces, dtype=np.int64)
+
+
+def vertex_normals(vertices, faces):
+    """Area-weighted vertex normals"""
+    face_normals = np.cross(vertices[faces[:, 1]] - vertices[faces[:, 0]],
+                            vertices[faces[:, 2]] - vertices[faces[:, 0]])
+    normals = np.zeros_like(vertices)
+    for k in range(3):
+        np.add.at(normals, faces[:, k], face_normals)
+    return normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+
+
+def sample_surface(vertices, faces, count, seed=0):
+    """
+    Uniform random points on the mesh surface
+
+    Returns:
+        (points count x 3, face normals count x 3)
+    """
+    rng = np.random.default_rng(seed)
+    v0, v1, v2 = (vertices[faces[:, k]] for k in range(3))
+    cross = np.cross(v1 - v0, v2 - v0)
+    area = np.linalg.norm(cross, axis=1)
+    face = rng.choice(len(faces), count, p=area / area.sum())
+    u, v = rng.random((2, count))
+    flip = u + v > 1
+    u[flip], v[flip] = 1 - u[flip], 1 - v[flip]
+    points = v0[face] + u[:, None] * (v1 - v0)[face] + v[:, None] * (v2 - v0)[face]
+    return points, cross[face] / np.maximum(area[face], 1e-12)[:, None]
+
+
+def look_at(centers, target, up=(0.0, 0.0, 1.0)):
+    """World-to-camera (R, t) of cameras at centers looking at target (x right, y down)"""
+    forward = target - centers
+    forward /= np.linalg.norm(forward, axis=1, keepdims=True)
+    right = np.cross(forward, up)
+    right /= np.linalg.norm(right, axis=1, keepdims=True)
+    down = np.cross(forward, right)
+    R = np.stack([right, down, forward], axis=1)
+    return R, -np.einsum("nij,nj->ni", R, centers)
+
+
+def lattice_hash(cells, seed):
+    """Pseudo-random value in [0, 1) per integer lattice cell (N x 3)"""
+    h = (cells[..., 0] * 73856093) ^ (cells[..., 1] * 19349663) \
+        ^ (cells[..., 2] * 83492791) ^ (seed * 2654435761)
+    h = h.astype(np.uint64) & 0xFFFFFFFF
+    for _ in range(2):
+        h = ((h >> 16) ^ h) * 0x45D9F3B & 0xFFFFFFFF
+    h = (h >> 16) ^ h
+    return h.astype(np.float64) / 2**32
+
+
+def value_noise(points, frequency, seed=0):
+    """Smooth 3D value noise in [0, 1) with frequency lattice cells per unit"""
+    p = np.asarray(points, dtype=np.float64) * frequency
+    cell = np.floor(p)
+    f = p - cell
+    f = f * f * (3 - 2 * f)
+    cell = cell.astype(np.int64)
+    result = np.zeros(len(p))
+    for corner in range(8):
+        offset = np.array([(corner >> k) & 1 for k in range(3)])
+        weight = np.prod(np.where(offset, f, 1 - f), axis=1)
+        result += weight * lattice_hash(cell + offset, seed)
+    return result
+
+
+def fractal_noise(points, frequency, octaves, seed=0):
+    """Sum of value noise octaves (each twice the frequency, half the weight), in [0, 1)"""
+    total, norm = 0.0, 0.0
+    for octave in range(octaves):
+        weight = 0.5 ** octave
+        total = total + weight * value_noise(points, frequency * 2 ** octave, seed + octave)
+        norm += weight
+    return total / norm
+
+
+def surface_albedo(points, seed=0):
+    """
+    Procedural marble-like RGB albedo in [0, 1] at world points
+
+    A solid texture, so every view sees the same colour at the same point;
+    the finest grain (1/96 unit) gives feature detectors texture to find.
+    """
+    veins = fractal_noise(points, 3.0, 4, seed)
+    grain = fractal_noise(points, 16.0, 4, seed + 10)
+    speckle = value_noise(points, 96.0, seed + 20)
+    marble = 0.5 + 0.5 * np.sin(12.0 * points[:, 2] + 10.0 * veins)
+    level = 0.3 + 0.25 * marble + 0.6 * (grain - 0.5) + 0.4 * (speckle - 0.5)
+    tint = np.array([1.0, 0.93, 0.82]) + 0.15 * (veins[:, None] - 0.5) * [1.0, 0.2, -0.6]
+    return np.clip(level[:, None] * tint, 0.0, 1.0)
+
+
+def rasterize(vertices, faces, K, R, t, width, height, near=1e-3, cull=True):
+    """
+    Z-buffer rasterization of a triangle mesh
+
+    Triangles are binned by the power-of-two size of their screen bounding
+    box and each bin is rasterized as one NumPy batch over the boxes, so
+    the cost is a handful of vectorized passes, not a loop over triangles.
+    Pixel centres sit at +0.5, as in COLMAP.
+
+    Returns:
+        (depth H x W (inf on background), face index H x W (-1 on
+        background), perspective-correct barycentrics H x W x 3)
+    """
+    cam = vertices @ R.T + t
+    z = cam[:, 2]
+    uv = cam[:, :2] / np.maximum(z, near)[:, None] * [K[0, 0], K[1, 1]] + K[:2, 2]
+
+    keep = (z[faces] > near).all(axis=1)
+    if cull:
+        center = -R.T @ t
+        v0 = vertices[faces[:, 0]]
+        normals = np.cross(vertices[faces[:, 1]] - v0, vertices[faces[:, 2]] - v0)
+        keep &= np.einsum("ij,ij->i", normals, center - v0) > 0
+    tri = np.flatnonzero(keep)
+
+    # Pixels whose centres fall inside each triangle's bounding box
+    corners = uv[faces[tri]]
+    x0 = np.maximum(np.ceil(corners[..., 0].min(axis=1) - 0.5), 0).astype(np.int64)
+    x1 = np.minimum(np.floor(corners[..., 0].max(axis=1) - 0.5), width - 1).astype(np.int64)
+    y0 = np.maximum(np.ceil(corners[..., 1].min(axis=1) - 0.5), 0).astype(np.int64)
+    y1 = np.minimum(np.floor(corners[..., 1].max(axis=1) - 0.5), height - 1).astype(np.int64)
+    on_screen = (x1 >= x0) & (y1 >= y0)
+    tri, x0, x1, y0, y1 = tri[on_screen], x0[on_screen], x1[on_screen], y0[on_screen], y1[on_screen]
+    size = np.maximum(x1 - x0, y1 - y0) + 1
+    bins = np.ceil(np.log2(size)).astype(np.int64)
+
+    zbuf = np.full(width * height, np.inf)
+    fbuf = np.full(width * height, -1, dtype=np.int64)
+    bbuf = np.zeros((width * height, 3))
+    face_z = z[faces]
+
+    for level in np.unique(bins):
+        span = 1 << int(level)
+        members = np.flatnonzero(bins == level)
+        step = max(1, RASTER_BATCH // (span * span))
+        offsets = np.arange(span)
+        for start in range(0, len(members), step):
+            m = members[start:start + step]
+            px = x0[m, None, None] + offsets[None, None, :]
+            py = y0[m, None, None] + offsets[None, :, None]
+            a, b, c = (uv[faces[tri[m], k]][:, None, None, :] for k in range(3))
+            cx, cy = px + 0.5, py + 0.5
+
+            w0 = (c[..., 0] - b[..., 0]) * (cy - b[..., 1]) - (c[..., 1] - b[..., 1]) * (cx - b[..., 0])
+            w1 = (a[..., 0] - c[..., 0]) * (cy - c[..., 1]) - (a[..., 1] - c[..., 1]) * (cx - c[..., 0])
+            w2 = (b[..., 0] - a[..., 0]) * (cy - a[..., 1]) - (b[..., 1] - a[..., 1]) * (cx - a[..., 0])
+            area = w0 + w1 + w2
+            with np.errstate(divide="ignore", invalid="ignore"):
+                l0, l1, l2 = w0 / area, w1 / area, w2 / area
+            inside = ((px <= x1[m, None, None]) & (py <= y1[m, None, None])
+                      & (l0 >= 0) & (l1 >= 0) & (l2 >= 0) & (area != 0))
+
+            k, row, col = np.nonzero(inside)
+            if not len(k):
+                continue
+            fz = face_z[tri[m[k]]]
+            weights = np.stack([l0[k, row, col], l1[k, row, col], l2[k, row, col]], axis=1) / fz
+            inverse = weights.sum(axis=1)
+            depth = 1.0 / inverse
+            pixel = (y0[m[k]] + row) * width + x0[m[k]] + col
+
+            # Nearest fragment per pixel in this batch, then against the buffer
+            order = np.lexsort((depth, pixel))
+            first = order[np.concatenate([[True], pixel[order][1:] != pixel[order][:-1]])]
+            first = first[depth[first] < zbuf[pixel[first]]]
+            zbuf[pixel[first]] = depth[first]
+            fbuf[pixel[first]] = tri[m[k[first]]]
+            bbuf[pixel[first]] = weights[first] / inverse[first, None]
+
+    return (zbuf.reshape(height, width), fbuf.reshape(height, width),
+            bbuf.reshape(height, width, 3))
+
+
+def render_view(vertices, faces, normals, K, R, t, width, height, supersample=2,
+                background=0.12, seed=0):
+    """
+    Render a Lambert-shaded view of the textured mesh
+
+    Returns:
+        (RGB image H x W x 3 float in [0, 1], depth H x W (inf on background))
+    """
+    scale = np.diag([supersample, supersample, 1.0])
+    depth, face, bary = rasterize(vertices, faces, scale @ K, R, t,
+                                  width * supersample, height * supersample)
+    image = np.full(depth.shape + (3,), background)
+    hit = face >= 0
+    corners = faces[face[hit]]
+    weights = bary[hit]
+    points = np.einsum("nk,nkd->nd", weights, vertices[corners])
+    normal = np.einsum("nk,nkd->nd", weights, normals[corners])
+    normal /= np.maximum(np.linalg.norm(normal, axis=1, keepdims=True), 1e-12)
+    shade = 0.35 + 0.65 * np.clip(normal @ LIGHT_DIRECTION, 0.0, None)
+    image[hit] = surface_albedo(points, seed) * shade[:, None]
+
+    if supersample > 1:
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        depth = depth[supersample // 2::supersample, supersample // 2::supersample]
+    return image, depth
+
+
+def distort_image(image, depth, params):
+    """
+    Warp an ideal pinhole rendering into the SIMPLE_RADIAL camera
+
+    Each output pixel samples the ideal image at its undistorted position
+    (the distortion is inverted by fixed-point iteration).
+    """
+    f, cx, cy, k = params
+    height, width = depth.shape
+    u, v = np.meshgrid(np.arange(width) + 0.5, np.arange(height) + 0.5)
+    xd, yd = (u - cx) / f, (v - cy) / f
+    x, y = xd.copy(), yd.copy()
+    for _ in range(10):
+        factor = 1 + k * (x * x + y * y)
+        x, y = xd / factor, yd / factor
+    map_x = (f * x + cx - 0.5).astype(np.float32)
+    map_y = (f * y + cy - 0.5).astype(np.float32)
+    image = cv2.remap(image, map_x, map_y, cv2.INTER_LINEAR,
+                      borderMode=cv2.BORDER_REPLICATE)
+    depth = cv2.remap(depth.astype(np.float32), map_x, map_y, cv2.INTER_NEAREST,
+                      borderMode=cv2.BORDER_CONSTANT, borderValue=np.inf)
+    return image, depth
+
+
+def project(points, R, t, params):
+    """SIMPLE_RADIAL projection: (pixel coordinates N x 2, depth N)"""
+    f, cx, cy, k = params
+    cam = points @ R.T + t
+    z = cam[:, 2]
+    xy = cam[:, :2] / z[:, None]
+    xy *= 1 + k * (xy ** 2).sum(axis=1, keepdims=True)
+    return f * xy + [cx, cy], z
+
+
+def visible_samples(samples, depth, R, t, params, tolerance=0.01):
+    """
+    Surface samples seen by a view: inside the image and within tolerance
+    (relative) of the rendered depth
+
+    Returns:
+        (sample indices, their pixel coordinates)
+    """
+    xy, z = project(samples, R, t, params)
+    height, width = depth.shape
+    col, row = np.floor(xy[:, 0]).astype(np.int64), np.floor(xy[:, 1]).astype(np.int64)
+    inside = (z > 0) & (col >= 0) & (col < width) & (row >= 0) & (row < height)
+    ids = np.flatnonzero(inside)
+    seen = np.abs(depth[row[ids], col[ids]] - z[ids]) <= tolerance * z[ids]
+    return ids[seen], xy[ids[seen]]
+
+
+def _render_job(scene_path, image_path, R, t, index, settings):
+    """Process-pool entry point: render, degrade and save one view"""
+    cv2.setNumThreads(1)  # The pool provides the parallelism
+    scene = np.load(scene_path)
+    params = settings["params"]
+    f, cx, cy, _ = params
+    K = np.array([[f, 0, cx], [0, f, cy], [0, 0, 1]])
+    image, depth = render_view(scene["vertices"], scene["faces"], scene["normals"], K, R, t,
+                               settings["width"], settings["height"],
+                               settings["supersample"], seed=settings["seed"])
+    if params[3]:
+        image, depth = distort_image(image, depth, params)
+
+    image = image * 255
+    if settings["blur_sigma"]:
+        image = cv2.GaussianBlur(image, (0, 0), settings["blur_sigma"])
+    if settings["noise_sigma"]:
+        rng = np.random.default_rng([settings["seed"], index])
+        image = image + rng.normal(0, settings["noise_sigma"], image.shape)
+    save_image(np.clip(image + 0.5, 0, 255).astype(np.uint8), image_path, f,
+               settings["jpeg_quality"])
+
+    ids, xy = visible_samples(scene["samples"], depth, R, t, params)
+    logger.info(f"Rendered {Path(image_path).name}: {len(ids)} samples visible")
+    return ids, xy
+
+
+def save_image(rgb, path, focal, quality=95):
+    """Save a JPEG with EXIF make, model and 35 mm equivalent focal length"""
+    exif = Image.Exif()
+    exif[0x010F] = "Synthetic"
+    exif[0x0110] = "statue-reconstruction"
+    exif.get_ifd(0x8769)[0xA405] = int(round(focal / max(rgb.shape[:2]) * 36))
+    Image.fromarray(rgb).save(path, quality=quality, exif=exif)
+
+
+def align_centers(source, target):
+    """
+    Similarity transform (Umeyama) mapping source points onto target points
+
+    Returns:
+        (scale, R, t, aligned source points)
+    """
+    mu_s, mu_t = source.mean(axis=0), target.mean(axis=0)
+    s, t = source - mu_s, target - mu_t
+    U, D, Vt = np.linalg.svd(t.T @ s / len(source))
+    S = np.eye(3)
+    if np.linalg.det(U) * np.linalg.det(Vt) < 0:
+        S[2, 2] = -1
+    R = U @ S @ Vt
+    scale = np.trace(np.diag(D) @ S) / s.var(axis=0).sum()
+    translation = mu_t - scale * R @ mu_s
+    return scale, R, translation, (scale * (R @ source.T)).T + translation
+
+
+def score_sparse(dataset_dir, model_dir):
+    """
+    Score a sparse model against the ground-truth cameras
+
+    The model is first aligned to the ground truth by the similarity
+    transform of the shared camera centres, as SfM only recovers the scene
+    up to one.
+
+    Args:
+        dataset_dir: Directory written by SyntheticDataset
+        model_dir: Reconstructed binary model (e.g. output/sparse/sparse/0)
+
+    Returns:
+        Dict with the registered images, rotation errors (degrees), centre
+        errors (fractions of the camera distance), the relative focal error
+        and the alignment (scale, R, t) that score_points takes
+    """
+    truth = ColmapModel.read(Path(dataset_dir) / "ground_truth" / "sparse" / "0")
+    model = ColmapModel.read(model_dir)
+    index = {name: i for i, name in enumerate(truth.names)}
+    rows = [(i, index[name]) for i, name in enumerate(model.names) if name in index]
+    result = {"num_images": len(truth.names), "registered": len(rows)}
+    if len(rows) < 3:
+        logger.warning(f"Only {len(rows)} ground-truth images in {model_dir}, cannot align")
+        return result
+
+    rows_model, rows_truth = map(np.array, zip(*rows))
+    centers_truth = truth.camera_centers()[rows_truth]
+    scale, R, t, aligned = align_centers(model.camera_centers()[rows_model], centers_truth)
+
+    # Camera distance from the scene, so errors compare across scenes
+    target = (truth.points3D["xyz"].min(axis=0) + truth.points3D["xyz"].max(axis=0)) / 2
+    distance = np.linalg.norm(centers_truth - target, axis=1).mean()
+    center_errors = np.linalg.norm(aligned - centers_truth, axis=1) / distance
+
+    # World-to-camera rotations in the ground-truth frame: R_model @ R^T
+    relative = truth.rotations()[rows_truth] @ (model.rotations()[rows_model] @ R.T).transpose(0, 2, 1)
+    cosine = np.clip((np.trace(relative, axis1=1, axis2=2) - 1) / 2, -1, 1)
+    rotation_errors = np.degrees(np.arccos(cosine))
+
+    # Focal lengths compared at the ground-truth resolution
+    camera_row = {int(c): i for i, c in enumerate(model.cameras["camera_id"])}
+    cams = np.array([camera_row[int(c)] for c in model.images["camera_id"][rows_model]])
+    focal = model.cameras["params"][cams, 0] * truth.cameras["width"][0] \
+        / model.cameras["width"][cams]
+    focal_errors = np.abs(focal / truth.cameras["params"][0, 0] - 1)
+
+    result.update({
+        "median_rotation_error_deg": float(np.median(rotation_errors)),
+        "max_rotation_error_deg": float(rotation_errors.max()),
+        "median_center_error": float(np.median(center_errors)),
+        "max_center_error": float(center_errors.max()),
+        "median_focal_error": float(np.median(focal_errors)),
+        "alignment": {"scale": float(scale), "R": R.tolist(), "t": t.tolist()},
+    })
+    return result
+
+
+def score_points(dataset_dir, points, alignment=None, threshold=0.005):
+    """
+    Score a dense point cloud against the ground-truth surface
+
+    Only surface samples seen by at least two views count towards
+    completeness. Distances are in scene units (the scene is 1 unit tall).
+
+    Args:
+        dataset_dir: Directory written by SyntheticDataset
+        points: N x 3 array or point cloud file
+        alignment: Alignment from score_sparse (points are in the
+            reconstruction's frame); None when already in the scene frame
+        threshold: Distance within which a point counts as correct
+
+    Returns:
+        Dict with accuracy (reconstruction to surface), completeness
+        (surface to reconstruction), precision, recall and F-score
+    """
+    if not isinstance(points, np.ndarray):
+        import open3d as o3d  # Only needed to read point cloud files
+        points = np.asarray(o3d.io.read_point_cloud(str(points)).points)
+    if alignment is not None:
+        points = alignment["scale"] * points @ np.asarray(alignment["R"]).T + alignment["t"]
+
+    scene = np.load(Path(dataset_dir) / "ground_truth" / "scene.npz")
+    surface = scene["samples"][scene["sample_views"] >= 2]
+    if not len(points):
+        return {"num_points": 0, "precision": 0.0, "recall": 0.0, "fscore": 0.0}
+
+    to_surface, _ = cKDTree(surface).query(points)
+    to_points, _ = cKDTree(points).query(surface)
+    precision = float((to_surface < threshold).mean())
+    recall = float((to_points < threshold).mean())
+    return {
+        "num_points": len(points),
+        "threshold": threshold,
+        "mean_accuracy": float(to_surface.mean()),
+        "median_accuracy": float(np.median(to_surface)),
+        "mean_completeness": float(to_points.mean()),
+        "median_completeness": float(np.median(to_points)),
+        "precision": precision,
+        "recall": recall,
+        "fscore": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
+
+
+def parse_rings(text):
+    """'10:24,35:24' -> [(10.0, 24), (35.0, 24)]"""
+    rings = []
+    for ring in text.split(","):
+        elevation, count = ring.split(":")
+        rings.append((float(elevation), int(count)))
+    return rings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic ground-truth datasets")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Render a dataset")
+    generate.add_argument("output_dir", help="Dataset directory")
+    generate.add_argument("--mesh", help="Mesh to render (default: procedural bust)")
+    generate.add_argument("--width", type=int, default=640)
+    generate.add_argument("--height", type=int, default=480)
+    generate.add_argument("--focal", type=float, help="Focal length in pixels")
+    generate.add_argument("--radial", type=float, default=0.0,
+                          help="SIMPLE_RADIAL distortion k (default: 0)")
+    generate.add_argument("--rings", type=parse_rings, default="10:24,35:24",
+                          help="Rings as elevation:views, comma separated (default: 10:24,35:24)")
+    generate.add_argument("--radius", type=float, default=2.0,
+                          help="Camera distance in bust heights (default: 2.0)")
+    generate.add_argument("--jitter", type=float, default=0.0,
+                          help="Relative camera placement noise (default: 0)")
+    generate.add_argument("--noise", type=float, default=0.0,
+                          help="Gaussian image noise in 8-bit levels (default: 0)")
+    generate.add_argument("--blur", type=float, default=0.0,
+                          help="Gaussian blur sigma in pixels (default: 0)")
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("--workers", type=int, help="Render processes (default: all CPUs)")
+
+    score = commands.add_parser("score", help="Score a reconstruction against a dataset")
+    score.add_argument("dataset_dir", help="Dataset directory")
+    score.add_argument("--model", default="output/sparse/sparse/0",
+                       help="Sparse model (default: output/sparse/sparse/0)")
+    score.add_argument("--points", help="Dense point cloud, e.g. output/dense/fused_filtered.ply")
+    score.add_argument("--threshold", type=float, default=0.005,
+                       help="Point distance counted as correct, in bust heights (default: 0.005)")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        SyntheticDataset(
+            args.output_dir, mesh_path=args.mesh, width=args.width, height=args.height,
+            focal=args.focal, radial=args.radial, rings=args.rings, radius=args.radius,
+            jitter=args.jitter, noise_sigma=args.noise, blur_sigma=args.blur, seed=args.seed
+        ).generate(workers=args.workers)
+        return
+
+    report = {"sparse": score_sparse(args.dataset_dir, args.model)}
+    if args.points:
+        report["dense"] = score_points(args.dataset_dir, args.points,
+                                       report["sparse"].get("alignment"), args.threshold)
+    logger.info(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Out-of-Core Point Cloud Filtering
+Voxel downsampling and statistical outlier removal over spatial tiles of a PLY streamed from disk
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import numpy as np
+from pathlib import Path
+from scipy.spatial import cKDTree
+import logging
+import tempfile
+import time
+from src.depth_fusion import VoxelMap
+from src.pointcloud_io import (iter_ply_chunks, ply_arrays, ply_header, ply_vertex_dtype,
+                               ply_vertices, read_ply_header)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Spill record of one point while it waits for its tile
+RAW_DTYPE = np.dtype([("xyz", "<f8", (3,)), ("normal", "<f4", (3,)), ("color", "<f4", (3,))])
+
+
+class TiledFilter:
+    def __init__(self, voxel_size=0.01, nb_neighbors=20, std_ratio=2.0, tile_points=2_000_000,
+                 halo=None, chunk_size=1 << 20, workers=1):
+        """
+        Initialize tiled point cloud filtering
+
+        Follows open3d's voxel_down_sample and remove_statistical_outlier
+        without holding the cloud in memory:
+        1. The PLY is streamed in chunks to find its bounds, then again to
+           bucket the points into spill files, one per tile. Tile edges
+           are whole voxels of one global grid, so no voxel is split.
+        2. Each tile is downsampled on its own.
+        3. Each tile's mean neighbour distances are computed against its
+           downsampled points plus a halo from the adjacent tiles.
+        4. One global distance threshold is applied and the kept points
+           are written tile by tile.
+        Peak memory is a few tiles per worker. Points whose neighbourhood
+        reaches past the halo are counted and logged.
+
+        Args:
+            voxel_size: Voxel size for downsampling
+            nb_neighbors: Number of neighbors for statistical outlier removal
+            std_ratio: Standard deviation ratio threshold
+            tile_points: Approximate input points per tile
+            halo: Width of the neighbouring points a tile sees (default: 8 voxels)
+            chunk_size: Points read per chunk
+            workers: Worker processes filtering tiles
+        """
+        self.voxel_size = voxel_size
+        self.nb_neighbors = nb_neighbors
+        self.std_ratio = std_ratio
+        self.tile_points = tile_points
+        self.halo = halo if halo is not None else 8 * voxel_size
+        self.chunk_size = chunk_size
+        self.workers = workers
+
+    def tile_voxels(self, num_points, extent):
+        """Tile edge in voxels, sized for about tile_points points on a surface"""
+        divisions = np.ceil(np.sqrt(max(num_points / self.tile_points, 1.0)))
+        voxels = int(np.ceil(extent.max() / divisions / self.voxel_size))
+        return max(voxels, int(np.ceil(self.halo / self.voxel_size)), 1)
+
+    def run(self, input_ply, output_ply):
+        """
+        Filter a PLY point cloud
+
+        Args:
+            input_ply: Input point cloud file
+            output_ply: Output file path
+
+        Returns:
+            Stats dict with point counts, tiles and timing
+        """
+        start_time = time.time()
+        input_ply, output_ply = Path(input_ply), Path(output_ply)
+        _, count, dtype, _ = read_ply_header(input_ply)
+        has_normals = {"nx", "ny", "nz"} <= set(dtype.names)
+        has_colors = {"red", "green", "blue"} <= set(dtype.names)
+        out_dtype = ply_vertex_dtype(has_normals, has_colors)
+        logger.info(f"Original points: {count}")
+        if count == 0:
+            with open(output_ply, 'wb') as f:
+                f.write(ply_header(out_dtype, 0))
+            return {"input_points": 0, "downsampled_points": 0, "output_points": 0, "tiles": 0,
+                    "halo_clipped_points": 0, "elapsed_s": time.time() - start_time}
+
+        lower, upper = np.full(3, np.inf), np.full(3, -np.inf)
+        for chunk in iter_ply_chunks(input_ply, self.chunk_size):
+            points = ply_arrays(chunk)[0]
+            lower = np.minimum(lower, points.min(axis=0))
+            upper = np.maximum(upper, points.max(axis=0))
+
+        # open3d's voxel grid starts half a voxel below the minimum bound
+        origin = lower - self.voxel_size / 2
+        tile_voxels = self.tile_voxels(count, upper - origin)
+        tile_size = tile_voxels * self.voxel_size
+        grid = np.floor((upper - origin) / tile_size).astype(np.int64) + 1
+        bounds = (origin, origin + grid * tile_size)
+
+        with tempfile.TemporaryDirectory(prefix="tiles_", dir=output_ply.parent) as tile_dir:
+            tile_dir = Path(tile_dir)
+            tile_counts = {}
+            for chunk in iter_ply_chunks(input_ply, self.chunk_size):
+                points, normals, colors = ply_arrays(chunk)
+                records = np.zeros(len(points), dtype=RAW_DTYPE)
+                records["xyz"] = points
+                if normals is not None:
+                    records["normal"] = normals
+                if colors is not None:
+                    records["color"] = colors
+                cell = np.floor((points - origin) / self.voxel_size).astype(np.int64) // tile_voxels
+                tiles = np.ravel_multi_index(tuple(np.minimum(cell, grid - 1).T), tuple(grid))
+                order = np.argsort(tiles, kind="stable")
+                ids, starts = np.unique(tiles[order], return_index=True)
+                for tile, part in zip(ids, np.split(records[order], starts[1:])):
+                    with open(tile_dir / f"raw_{tile}.bin", 'ab') as f:
+                        f.write(part.tobytes())
+                    tile_counts[int(tile)] = tile_counts.get(int(tile), 0) + len(part)
+            logger.info(f"Bucketed {count} points into {len(tile_counts)} tiles of "
+                        f"{tile_size:.3f} ({max(tile_counts.values())} points max)")
+
+            tiles = sorted(tile_counts)
+            down_counts = self._map(_downsample_job, [
+                (tile_dir, tile, origin, self.voxel_size) for tile in tiles])
+            logger.info(f"After downsampling: {sum(down_counts)}")
+
+            jobs = []
+            for tile in tiles:
+                index = np.array(np.unravel_index(tile, tuple(grid)))
+                neighbors = [int(np.ravel_multi_index(tuple(index + offset), tuple(grid)))
+                             for offset in itertools.product((-1, 0, 1), repeat=3)
+                             if any(offset) and np.all((index + offset >= 0) & (index + offset < grid))]
+                box = (origin + index * tile_size, origin + (index + 1) * tile_size)
+                jobs.append((tile_dir, tile, [n for n in neighbors if n in tile_counts],
+                             box, bounds, self.halo, self.nb_neighbors, sum(down_counts)))
+            sums = np.array(self._map(_distance_job, jobs)).reshape(-1, 4).sum(axis=0)
+            valid, total, total_sq, clipped = sums
+            if clipped:
+                logger.info(f"{int(clipped)} points have neighbours beyond the "
+                            f"{self.halo:.3f} halo (consider a larger halo)")
+
+            threshold = -np.inf
+            if valid > 1:
+                mean = total / valid
+                std = np.sqrt(max(total_sq - valid * mean ** 2, 0.0) / (valid - 1))
+                threshold = mean + self.std_ratio * std
+
+            kept = [((d > 0) & (d < threshold)) for d in
+                    (np.load(tile_dir / f"dist_{tile}.npy") for tile in tiles)]
+            with open(output_ply, 'wb') as f:
+                f.write(ply_header(out_dtype, int(sum(k.sum() for k in kept))))
+                for tile, keep in zip(tiles, kept):
+                    down = np.load(tile_dir / f"down_{tile}.npy")[keep]
+                    f.write(ply_vertices(down["xyz"], down["normal"] if has_normals else None,
+                                         down["color"] if has_colors else None).tobytes())
+
+        stats = {
+            "input_points": count,
+            "downsampled_points": int(sum(down_counts)),
+            "output_points": int(sum(k.sum() for k in kept)),
+            "tiles": len(tiles),
+            "halo_clipped_points": int(clipped),
+            "elapsed_s": time.time() - start_time,
+        }
+        logger.info(f"After filtering: {stats['output_points']} "
+                    f"({len(tiles)} tiles, {stats['elapsed_s']:.1f}s)")
+        return stats
+
+    def _map(self, job, jobs):
+        if self.workers <= 1 or len(jobs) <= 1:
+            return [job(*args) for args in jobs]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(job, *zip(*jobs)))
+
+
+def _downsample_job(tile_dir, tile, origin, voxel_size):
+    """Process-pool entry point: voxel-average one tile's points"""
+    raw = np.fromfile(tile_dir / f"raw_{tile}.bin", dtype=RAW_DTYPE)
+    voxels = VoxelMap(voxel_size)
+    voxels.add(raw["xyz"] - origin, raw["normal"], raw["color"])
+    points, normals, colors = voxels.means()
+    down = np.zeros(len(points), dtype=RAW_DTYPE)
+    down["xyz"], down["normal"], down["color"] = points + origin, normals, colors
+    np.save(tile_dir / f"down_{tile}.npy", down)
+    return len(down)
+
+
+def _distance_job(tile_dir, tile, neighbors, box, bounds, halo, nb_neighbors, total_points):
+    """
+    Process-pool entry point: mean distance of each downsampled point of a
+    tile to its nb_neighbors nearest points (itself included, as open3d)
+
+    Returns:
+        (valid count, sum, sum of squares of the distances, halo-clipped count)
+    """
+    points = np.load(tile_dir / f"down_{tile}.npy")["xyz"]
+    lower, upper = box[0] - halo, box[1] + halo
+    context = [points]
+    for neighbor in neighbors:
+        other = np.load(tile_dir / f"down_{neighbor}.npy")["xyz"]
+        context.append(other[np.all((other >= lower) & (other < upper), axis=1)])
+    context = np.concatenate(context)
+
+    k = min(nb_neighbors, total_points)
+    distances, _ = cKDTree(context).query(points, k=k)
+    # Fewer than k points within the halo leaves inf distances: such points are dropped
+    distances = np.asarray(distances).reshape(len(points), -1)
+    mean = distances.mean(axis=1)
+    np.save(tile_dir / f"dist_{tile}.npy", mean)
+
+    # A neighbourhood is exact if it stays inside the halo (or the cloud's bounds)
+    margin = np.minimum(np.where(lower > bounds[0], points - lower, np.inf),
+                        np.where(upper < bounds[1], upper - points, np.inf)).min(axis=1)
+    clipped = int((distances[:, -1] > margin).sum())
+    valid = np.isfinite(mean) & (mean > 0)
+    return valid.sum(), mean[valid].sum(), (mean[valid] ** 2).sum(), clipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter a large point cloud tile by tile")
+    parser.add_argument("input", help="Input PLY")
+    parser.add_argument("-o", "--output", required=True, help="Output PLY")
+    parser.add_argument("--voxel-size", type=float, default=0.01)
+    parser.add_argument("--nb-neighbors", type=int, default=20)
+    parser.add_argument("--std-ratio", type=float, default=2.0)
+    parser.add_argument("--tile-points", type=int, default=2_000_000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    TiledFilter(voxel_size=args.voxel_size, nb_neighbors=args.nb_neighbors,
+                std_ratio=args.std_ratio, tile_points=args.tile_points,
+                workers=args.workers).run(args.input, args.output)
+
+
+if __name__ == "__main__":
+    main()
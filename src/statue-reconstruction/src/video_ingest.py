@@ -0,0 +1,242 @@
+"""
+Streaming Video-to-Keyframe Ingestion
+Selects sharp, well-spaced keyframes from a walk-around video with bounded memory
+"""
+
+import argparse
+import cv2
+import numpy as np
+from pathlib import Path
+import json
+import logging
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi", ".mkv", ".m4v", ".webm"}
+
+
+class VideoIngestor:
+    def __init__(self, video_path, output_dir, analysis_width=320, min_motion=0.08,
+                 window=15, min_sharpness=0.0, stride=1, jpeg_quality=95):
+        """
+        Initialize video ingestor
+
+        Frames are read one at a time; only the previous downscaled frame
+        and the current best keyframe candidate are held in memory.
+
+        Args:
+            video_path: Local video file
+            output_dir: Directory receiving keyframes as JPEGs (the
+                ImagePreprocessor input layout)
+            analysis_width: Width of the downscaled frames used for motion
+                and sharpness scoring
+            min_motion: Accumulated optical-flow motion, as a fraction of the
+                frame width, required before the next keyframe
+            window: Frames examined after min_motion is reached; the sharpest
+                of them becomes the keyframe
+            min_sharpness: Laplacian variance below which frames are never
+                selected
+            stride: Analyse every stride-th frame only
+            jpeg_quality: JPEG quality of the written keyframes
+        """
+        self.video_path = Path(video_path)
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        self.analysis_width = analysis_width
+        self.min_motion = min_motion
+        self.window = window
+        self.min_sharpness = min_sharpness
+        self.stride = stride
+        self.jpeg_quality = jpeg_quality
+
+    def iter_frames(self):
+        """Yield (frame index, timestamp in seconds, BGR frame) from the video"""
+        cap = cv2.VideoCapture(str(self.video_path))
+        if not cap.isOpened():
+            raise IOError(f"Could not open video: {self.video_path}")
+
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        index = 0
+        try:
+            while True:
+                # grab() skips decoding the frames we do not analyse
+                if index % self.stride != 0:
+                    if not cap.grab():
+                        break
+                    index += 1
+                    continue
+
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield index, index / fps if fps > 0 else 0.0, frame
+                index += 1
+        finally:
+            cap.release()
+
+    def select_keyframes(self, frames):
+        """
+        Select keyframes from a frame stream
+
+        Motion is the median optical-flow magnitude between consecutive
+        downscaled frames, accumulated since the last keyframe. Once it
+        exceeds min_motion, the sharpest frame of the next window frames is
+        emitted and counting restarts from that frame.
+
+        Args:
+            frames: Iterable of (index, timestamp, frame)
+
+        Yields:
+            (index, timestamp, frame, motion, sharpness) for each keyframe
+        """
+        prev_small = None
+        motion = 0.0
+        best = None
+        window_left = 0
+
+        for index, timestamp, frame in frames:
+            small = downscale_gray(frame, self.analysis_width)
+            sharpness = float(cv2.Laplacian(small, cv2.CV_32F).var())
+
+            if prev_small is None:
+                # Always start from the first usable frame
+                prev_small = small
+                if sharpness >= self.min_sharpness:
+                    yield index, timestamp, frame, 0.0, sharpness
+                continue
+
+            motion += flow_magnitude(prev_small, small) / small.shape[1]
+            prev_small = small
+
+            if window_left == 0 and motion >= self.min_motion:
+                window_left = self.window
+
+            if window_left > 0:
+                if sharpness >= self.min_sharpness and (best is None or sharpness > best[4]):
+                    best = (index, timestamp, frame.copy(), motion, sharpness)
+                window_left -= 1
+
+                if window_left == 0 and best is not None:
+                    yield best
+                    # Keep the motion accumulated after the chosen frame
+                    motion -= best[3]
+                    best = None
+
+        if best is not None:
+            yield best
+
+    def run(self):
+        """
+        Ingest the video, writing keyframes to output_dir
+
+        Returns:
+            List of written keyframe paths
+        """
+        logger.info(f"Ingesting {self.video_path}...")
+        start_time = time.time()
+
+        counter = {"frames": 0}
+
+        def counted(frames):
+            for item in frames:
+                counter["frames"] += 1
+                yield item
+
+        written = []
+        keyframes = []
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        for index, timestamp, frame, motion, sharpness in self.select_keyframes(
+                counted(self.iter_frames())):
+            path = self.output_dir / f"{self.video_path.stem}_{index:06d}.jpg"
+            cv2.imwrite(str(path), frame, params)
+            written.append(path)
+            keyframes.append({
+                "name": path.name,
+                "frame": index,
+                "time_s": timestamp,
+                "motion": motion,
+                "sharpness": sharpness,
+            })
+            logger.info(f"Keyframe {len(written)}: frame {index} "
+                        f"(motion {motion:.3f}, sharpness {sharpness:.1f})")
+
+        elapsed = time.time() - start_time
+        fps = counter["frames"] / elapsed if elapsed > 0 else 0.0
+        summary = {
+            "video": str(self.video_path),
+            "frames_analysed": counter["frames"],
+            "keyframes": len(written),
+            "elapsed_s": elapsed,
+            "throughput_fps": fps,
+        }
+        with open(self.output_dir / "keyframes.json", 'w') as f:
+            json.dump({"summary": summary, "keyframes": keyframes}, f, indent=2)
+
+        logger.info(f"Selected {len(written)} keyframes from {counter['frames']} frames "
+                    f"in {elapsed:.2f}s ({fps:.1f} frames/s)")
+        return written
+
+
+def downscale_gray(frame, width):
+    """Grayscale copy of a frame scaled to the given width"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    if w <= width:
+        return gray
+    return cv2.resize(gray, (width, int(round(h * width / w))), interpolation=cv2.INTER_AREA)
+
+
+def flow_magnitude(prev_gray, gray):
+    """Median dense optical-flow magnitude (pixels) between two frames"""
+    flow = cv2.calcOpticalFlowFarneback(
+        prev_gray, gray, None,
+        pyr_scale=0.5, levels=3, winsize=15,
+        iterations=3, poly_n=5, poly_sigma=1.2, flags=0
+    )
+    return float(np.median(np.hypot(flow[..., 0], flow[..., 1])))
+
+
+def is_video(path):
+    """Whether a path looks like a video file"""
+    path = Path(path)
+    return path.is_file() and path.suffix.lower() in VIDEO_EXTENSIONS
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract keyframes from a walk-around video"
+    )
+    parser.add_argument("video", help="Input video file")
+    parser.add_argument(
+        "-o", "--output",
+        default="data/input_images/video",
+        help="Keyframe directory (default: data/input_images/video)"
+    )
+    parser.add_argument(
+        "--min-motion",
+        type=float,
+        default=0.08,
+        help="Motion between keyframes as a fraction of frame width (default: 0.08)"
+    )
+    parser.add_argument(
+        "--stride",
+        type=int,
+        default=1,
+        help="Analyse every n-th frame (default: 1)"
+    )
+    args = parser.parse_args()
+
+    ingestor = VideoIngestor(
+        args.video,
+        args.output,
+        min_motion=args.min_motion,
+        stride=args.stride
+    )
+    ingestor.run()
+
+
+if __name__ == "__main__":
+    main()
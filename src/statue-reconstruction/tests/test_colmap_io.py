@@ -0,0 +1,37 @@
+"""
+COLMAP IO Tests
+rotation_to_quaternion round trips, including 180 degree rotations
+"""
+
+import numpy as np
+import pytest
+from src.colmap_io import quaternion_to_rotation, rotation_to_quaternion
+
+
+def axis_angle_rotation(axis, angle):
+    """Rodrigues rotation matrix for a rotation of angle about axis"""
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.linalg.norm(axis)
+    K = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    return np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * K @ K
+
+
+@pytest.mark.parametrize("axis", [(1, 0, 0), (0, 1, 0), (0, 0, 1), (1, -1, 0),
+                                  (1, 1, -1), (-0.3, 0.5, 0.8), (0.2, -0.9, -0.4)])
+@pytest.mark.parametrize("angle", [0.0, 0.4, np.pi / 2, 2.5, np.pi - 1e-9, np.pi])
+def test_rotation_quaternion_round_trip(axis, angle):
+    R = axis_angle_rotation(axis, angle)
+    q = rotation_to_quaternion(R)
+    assert q.shape == (4,)
+    assert np.isclose(np.linalg.norm(q), 1.0)
+    assert q[0] >= 0
+    np.testing.assert_allclose(quaternion_to_rotation(q), R, atol=1e-9)
+
+
+def test_rotation_to_quaternion_batched():
+    rng = np.random.default_rng(0)
+    q = rng.normal(size=(200, 4))
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    R = quaternion_to_rotation(q)
+    np.testing.assert_allclose(quaternion_to_rotation(rotation_to_quaternion(R)), R, atol=1e-9)
+    np.testing.assert_allclose(rotation_to_quaternion(R), q * np.sign(q[:, :1]), atol=1e-9)
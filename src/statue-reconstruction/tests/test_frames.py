@@ -0,0 +1,50 @@
+"""
+Frame Store Tests
+Size-limited frame cache: eviction of unused frames and a stable cached prefix
+"""
+
+import cv2
+import numpy as np
+from src.frames import FrameStore
+
+FRAME_BYTES = 100 * 100 * 3 + 128  # .npy header
+
+
+def write_images(image_dir, count):
+    image_dir.mkdir()
+    for i in range(count):
+        cv2.imwrite(str(image_dir / f"{i}.png"), np.full((100, 100, 3), i, np.uint8))
+
+
+def test_frame_cache_limit_keeps_a_cached_prefix(tmp_path):
+    write_images(tmp_path / "images", 6)
+    frames = FrameStore(tmp_path / "images", cache_dir=tmp_path / "frames",
+                        max_cache_bytes=3 * FRAME_BYTES)
+
+    for _ in range(2):
+        for img_path in frames.paths():
+            frames.get(img_path)
+            frames.release()
+
+    # The first three stay mapped; the rest are decoded on every pass
+    assert frames.num_mapped == 6
+    assert frames.num_decoded == 3 + 2 * 3
+    assert frames.num_evicted == 0
+    assert len(list((tmp_path / "frames").glob("*.npy"))) == 3
+
+
+def test_frame_cache_evicts_frames_from_earlier_runs(tmp_path):
+    write_images(tmp_path / "images", 6)
+    paths = FrameStore(tmp_path / "images").paths()
+    FrameStore(tmp_path / "images", cache_dir=tmp_path / "frames",
+               max_cache_bytes=3 * FRAME_BYTES).get(paths[0])
+
+    frames = FrameStore(tmp_path / "images", cache_dir=tmp_path / "frames",
+                        max_cache_bytes=3 * FRAME_BYTES)
+    for img_path in paths[3:]:
+        frames.get(img_path)
+
+    assert frames.num_evicted == 1
+    assert frames.num_uncached == 0
+    assert all(frames.has_frame(p) for p in paths[3:])
+    assert not frames.cache_path(paths[0]).exists()
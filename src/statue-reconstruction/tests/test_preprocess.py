@@ -0,0 +1,55 @@
+"""
+Preprocessing Tests
+Frame triage keeps every view of a turntable ring and drops repeated frames
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("ultralytics")
+
+from src import preprocess  # noqa: E402
+from src.synthetic import SyntheticDataset  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def ring_dir(tmp_path_factory):
+    """12 views 30 degrees apart on one ring around the synthetic bust"""
+    dataset = SyntheticDataset(tmp_path_factory.mktemp("ring"), width=160, height=120,
+                               rings=((10, 12),), supersample=1, num_samples=2000,
+                               num_points=200)
+    dataset.generate(workers=1)
+    return dataset.images_dir
+
+
+def triage(monkeypatch, image_dir, output_dir):
+    monkeypatch.setattr(preprocess, "YOLO", lambda model_path: None)
+    preprocessor = preprocess.ImagePreprocessor(image_dir, output_dir)
+    with open(preprocessor.triage_frames(min_images=0)) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def test_triage_keeps_ring_views(monkeypatch, ring_dir, tmp_path):
+    kept = triage(monkeypatch, ring_dir, tmp_path / "preprocessed")
+    assert kept == sorted(p.name for p in ring_dir.glob("*.jpg"))
+
+
+def test_triage_drops_repeated_frame(monkeypatch, ring_dir, tmp_path):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for img_path in ring_dir.glob("*.jpg"):
+        (image_dir / img_path.name).write_bytes(img_path.read_bytes())
+
+    # The same view again, with a small camera shake and sensor noise
+    img = cv2.imread(str(ring_dir / "view_003.jpg"))
+    shaken = cv2.warpAffine(img, np.float32([[1, 0, 1], [0, 1, 0]]), img.shape[1::-1],
+                            borderMode=cv2.BORDER_REPLICATE)
+    noise = np.random.default_rng(0).normal(0, 2, img.shape)
+    cv2.imwrite(str(image_dir / "view_003b.jpg"),
+                np.clip(shaken + noise, 0, 255).astype(np.uint8))
+
+    kept = triage(monkeypatch, image_dir, tmp_path / "preprocessed")
+    assert len(kept) == 12
+    assert ("view_003.jpg" in kept) != ("view_003b.jpg" in kept)
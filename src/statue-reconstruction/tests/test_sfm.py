@@ -0,0 +1,89 @@
+"""
+SfM Model Selection Tests
+select_largest_model with the mapper's sparse/0 slot missing or empty, new
+images reusing the cameras of an existing model, and rescaling a model
+whose shared camera maps to several target sizes
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+from src.colmap_database import ColmapDatabase
+from src.colmap_io import (CAMERA_DTYPE, IMAGE_DTYPE, POINT2D_DTYPE, POINT3D_DTYPE,
+                           TRACK_DTYPE, ColmapModel)
+from src.sfm import SfMPipeline
+
+NAMES = ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg"]
+
+
+def write_model(model_dir, names):
+    """A model of names with one shared camera and no points"""
+    cameras = np.zeros(1, dtype=CAMERA_DTYPE)
+    cameras["params"] = np.nan
+    cameras["camera_id"], cameras["width"], cameras["height"] = 1, 640, 480
+    cameras["params"][0, :3] = [500.0, 320, 240]  # SIMPLE_PINHOLE
+    images = np.zeros(len(names), dtype=IMAGE_DTYPE)
+    images["image_id"] = np.arange(1, len(names) + 1)
+    images["qvec"] = [1, 0, 0, 0]
+    images["camera_id"] = 1
+    ColmapModel(cameras, images, list(names), np.zeros(0, dtype=POINT2D_DTYPE),
+                np.zeros(len(names) + 1, dtype=np.int64), np.zeros(0, dtype=POINT3D_DTYPE),
+                np.zeros(0, dtype=TRACK_DTYPE), np.zeros(1, dtype=np.int64)).write(model_dir)
+
+
+@pytest.mark.parametrize("slot_zero", ["missing", "empty"])
+def test_select_largest_model_without_model_zero(tmp_path, slot_zero):
+    sfm = SfMPipeline(tmp_path / "images", tmp_path / "sfm")
+    with ColmapDatabase(sfm.database_path, create=True) as db:
+        camera_id = db.add_camera(0, 640, 480, [500.0, 320, 240])
+        db.add_images(NAMES, camera_id)
+        db.connection.commit()
+    if slot_zero == "empty":
+        (sfm.sparse_dir / "0").mkdir()
+    write_model(sfm.sparse_dir / "1", NAMES[:1])
+    write_model(sfm.sparse_dir / "2", NAMES[1:4])
+
+    report = sfm.select_largest_model()
+
+    assert ColmapModel.read(sfm.sparse_dir / "0").names == NAMES[1:4]
+    assert report["registered"] == 3
+    assert report["models"] == [3, 1]
+    assert report["dropped"] == {"a.jpg": "in separate model sparse/1",
+                                 "e.jpg": "not registered"}
+    assert not (sfm.sparse_dir / "swap").exists()
+
+
+def test_assign_existing_cameras(tmp_path):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for name in NAMES:
+        Image.new("RGB", (640, 480)).save(image_dir / name)
+    Image.new("RGB", (480, 640)).save(image_dir / "f.jpg")
+
+    sfm = SfMPipeline(image_dir, tmp_path / "sfm")
+    with ColmapDatabase(sfm.database_path, create=True) as db:
+        db.add_images(NAMES[:3], db.add_camera(0, 640, 480, [500.0, 320, 240]))
+        db.add_images(NAMES[3:], db.add_camera(0, 640, 480, [450.0, 320, 240], True))
+        db.add_images(["f.jpg"], db.add_camera(0, 480, 640, [450.0, 240, 320], True))
+        db.connection.commit()
+    write_model(sfm.sparse_dir / "0", NAMES[:3])
+
+    cameras = sfm.assign_existing_cameras(NAMES[3:] + ["f.jpg"])
+
+    assert cameras == {"d.jpg": 1, "e.jpg": 1, "f.jpg": 3}
+    with ColmapDatabase(sfm.database_path) as db:
+        assert db.cameras()["camera_id"].tolist() == [1, 3]
+
+
+def test_rescale_model_splits_cameras_by_target_size(tmp_path):
+    sfm = SfMPipeline(tmp_path / "images", tmp_path / "sfm")
+    write_model(sfm.sparse_dir / "0", NAMES[:3])
+    sizes = {"a.jpg": (1280, 960), "b.jpg": (1280, 960), "c.jpg": (1920, 1440)}
+
+    model = ColmapModel.read(sfm.rescale_model(sizes, tmp_path / "full_res"))
+
+    assert model.images["camera_id"].tolist() == [1, 1, 2]
+    assert model.cameras["camera_id"].tolist() == [1, 2]
+    assert model.cameras["width"].tolist() == [1280, 1920]
+    np.testing.assert_allclose(model.cameras["params"][:, :3],
+                               [[1000, 640, 480], [1500, 960, 720]])